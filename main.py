@@ -1,10 +1,20 @@
 from src.workflow import create_workflow
-from langgraph.checkpoint.memory import MemorySaver
+from src.checkpoint import SqliteCheckpointer
+from src.history import history_manager
+from src.utils import get_llm_flight_stats
+from src.instrumentation import instrumentation, configure_logging
+from src.config import METRICS_PORT
 # from src.test_key import test_key
 
 
 def main():
-    memory = MemorySaver()
+    # 节点过程日志默认关闭，ZENGRAPH_LOG_LEVEL=INFO 打开
+    configure_logging()
+    if METRICS_PORT:
+        instrumentation.serve_prometheus(METRICS_PORT)
+
+    # 持久化到 SQLite：重启不丢记忆 (state 里的检索结果本身就只有父块 ID)
+    memory = SqliteCheckpointer()
     
     app = create_workflow().compile(checkpointer=memory)
     
@@ -21,28 +31,32 @@ def main():
     # --- 第一轮对话 ---
     print("\n=== 🟢 张三的第一问 ===")
     query1 = "我很焦虑，感觉前途迷茫。"
-    # 注意：第一次调用要初始化 chat_history 为空
-    app.invoke({"query": query1, "chat_history": []}, config=config_zhangsan)
+    # 注意：对话日志 history_log 是只追加的，第一次调用不需要初始化
+    app.invoke({"query": query1}, config=config_zhangsan)
 
     print("\n=== 🔵 李四的第一问 (完全不干扰张三) ===")
-    app.invoke({"query": "什么是‘空’？", "chat_history": []}, config=config_lisi)
+    app.invoke({"query": "什么是‘空’？"}, config=config_lisi)
 
     # --- 第二轮对话 (测试记忆) ---
     print("\n=== 🟢 张三的第二问 (测试追问) ===")
     # 用户追问 "那具体该怎么做？" -> 法师应该知道他在问关于"焦虑"的做法
     
     query2 = "那具体该怎么做呢？"
-# 🔥 注意：这里我们不需要手动传旧的 chat_history！
+# 🔥 注意：这里我们不需要手动传旧的对话历史！
     # LangGraph 会根据 thread_id 自动从 memory 里把上次的 history 捞出来传给节点
     result = app.invoke({"query": query2}, config=config_zhangsan)
     
     # 打印最后的结果看看
     print(f"\n>>>> 最终状态检查 (张三):")
     # 我们从 result 里拿到最新的 history 打印出来证明它记住了
-    final_history = result["chat_history"]
+    final_history = history_manager.view(result)
     for line in final_history:
         print(line)
 
+    print(f"\n>>>> 请求合并统计: {get_llm_flight_stats()}")
+    print(f">>>> 节点耗时 (ms): {instrumentation.snapshot()['histograms']}")
+    memory.close()
+
 if __name__ == "__main__":
     main()
     # test_key()
\ No newline at end of file
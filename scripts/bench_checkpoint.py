@@ -0,0 +1,206 @@
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import tracemalloc
+from typing import TypedDict
+
+from langgraph.graph import StateGraph, END
+from langgraph.checkpoint.memory import MemorySaver
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src.schema import AgentState
+from src.checkpoint import SqliteCheckpointer
+from src.history import HistoryManager
+
+# 模拟父块库：每个父块约 1000 字，检索一次取 3 个
+PARENTS = {f"parent-{i}": f"第{i}段经文。" + "如是我闻，一时佛在舍卫国祇树给孤独园。" * 50 for i in range(200)}
+ANSWER = "阿弥陀佛，施主。" + "心无挂碍，无挂碍故，无有恐怖。" * 8
+
+
+def resolve_context(node_ids):
+    return "\n\n".join(PARENTS[i] for i in node_ids)
+
+
+# 存成引用的 blob 类型标记，和 serde 自己的类型名区分开
+REF_TYPE = "ref:node_ids"
+
+
+class NodeIdRef:
+    """
+    把由父块拼接出来的大文本字段按引用存储：只记父块 node_id 列表，读取时再从父块库还原。
+
+    只有当 resolver(ids) 能原样还原出当前值时才存引用，
+    否则 (比如兜底节点改写了 context) 照常存原文，保证读回来的 state 和写进去的一致。
+    """
+
+    def __init__(self, ids_channel: str, resolver):
+        self.ids_channel = ids_channel
+        self.resolver = resolver
+
+    def encode(self, value, channel_values: dict):
+        node_ids = channel_values.get(self.ids_channel)
+        if not node_ids or not isinstance(value, str):
+            return None
+        if self.resolver(node_ids) != value:
+            return None
+        return json.dumps(list(node_ids)).encode("utf-8")
+
+    def decode(self, blob: bytes):
+        return self.resolver(json.loads(blob.decode("utf-8")))
+
+
+class RefCheckpointer(SqliteCheckpointer):
+    """
+    旧 state 形状的对照组：ref_fields 里的通道按 NodeIdRef 存引用。当前 AgentState 只存 retrieved_refs，线上不需要。
+    """
+
+    def __init__(self, path: str, *, ref_fields: dict = None, **kwargs):
+        super().__init__(path, **kwargs)
+        self.ref_fields = ref_fields or {}
+
+    def _dump_blob(self, channel: str, value, channel_values: dict):
+        codec = self.ref_fields.get(channel)
+        if codec is not None:
+            ref = codec.encode(value, channel_values)
+            if ref is not None:
+                return REF_TYPE, ref
+        return super()._dump_blob(channel, value, channel_values)
+
+    def _load_value(self, channel: str, type_: str, blob: bytes):
+        if type_ == REF_TYPE:
+            return self.ref_fields[channel].decode(blob)
+        return super()._load_value(channel, type_, blob)
+
+
+class FullState(TypedDict):
+    """
+    旧的 state 形状：检索原文、父块 ID、得分分开存，对话历史每轮整体重写。
+    """
+    query: str
+    route: str
+    retrieved_context: str
+    retrieved_node_ids: list
+    retrieval_scores: list
+    final_answer: str
+    grade: str
+    loop_step: int
+    chat_history: list
+
+
+def pick_ids(query: str, loop: int) -> list:
+    seed = sum(map(ord, query)) * 7 + loop * 3
+    return [f"parent-{(seed + k) % len(PARENTS)}" for k in range(3)]
+
+
+def build_graph(layout: str, loops: int):
+    """
+    和真实工作流同样的步数 (router -> retrieve -> grade -> [rewrite -> retrieve -> grade]*loops -> answer)，
+    但不调模型、不加载索引。layout 为 full 时用旧的 state 形状，compact 时用当前的 AgentState。
+    """
+    manager = HistoryManager(summarizer=lambda summary, lines: (summary + "".join(lines))[-100:])
+
+    def router(state):
+        return {"route": "hyde", "loop_step": 0}
+
+    def retrieve(state):
+        ids = pick_ids(state["query"], state.get("loop_step", 0))
+        scores = [0.8 - 0.05 * k for k in range(3)]
+        if layout == "full":
+            return {"retrieved_context": resolve_context(ids), "retrieved_node_ids": ids, "retrieval_scores": scores}
+        return {"retrieved_refs": list(zip(ids, scores))}
+
+    def grade(state):
+        return {"grade": "no" if state.get("loop_step", 0) < loops else "yes"}
+
+    def rewrite(state):
+        return {"loop_step": state.get("loop_step", 0) + 1}
+
+    def answer(state):
+        lines = [f"信众: {state['query']}", f"法师: {ANSWER}"]
+        if layout == "full":
+            # 旧的 HistoryManager 同样只保留最近 4 轮原文，但每轮都把整个列表写回去
+            return {"final_answer": ANSWER, "chat_history": (list(state.get("chat_history") or []) + lines)[-8:]}
+        return {"final_answer": ANSWER, **manager.append_turn(state, *lines)}
+
+    workflow = StateGraph(FullState if layout == "full" else AgentState)
+    for name, fn in (("router", router), ("retrieve", retrieve), ("grade", grade), ("rewrite", rewrite), ("answer", answer)):
+        workflow.add_node(name, fn)
+    workflow.set_entry_point("router")
+    workflow.add_edge("router", "retrieve")
+    workflow.add_edge("retrieve", "grade")
+    workflow.add_conditional_edges("grade", lambda state: state["grade"], {"yes": "answer", "no": "rewrite"})
+    workflow.add_edge("rewrite", "retrieve")
+    workflow.add_edge("answer", END)
+    return workflow
+
+
+def memory_saver_bytes(saver: MemorySaver) -> int:
+    """
+    MemorySaver 不做清理，存下来的 blob 与 writes 之和就是累计序列化写入的字节数。
+    """
+    blobs = sum(len(value[1]) for value in saver.blobs.values())
+    writes = sum(len(w[2][1]) for inner in saver.writes.values() for w in inner.values())
+    return blobs + writes
+
+
+def run(saver, layout: str, threads: int, turns: int, loops: int):
+    app = build_graph(layout, loops).compile(checkpointer=saver)
+    tracemalloc.start()
+    base, _ = tracemalloc.get_traced_memory()
+    start = time.perf_counter()
+    for turn in range(turns):
+        for t in range(threads):
+            config = {"configurable": {"thread_id": f"bench-{t}"}}
+            app.invoke({"query": f"第{turn}问：如何安住当下？"}, config=config)
+    elapsed = time.perf_counter() - start
+    if isinstance(saver, SqliteCheckpointer):
+        saver.flush()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, current - base
+
+
+def main():
+    parser = argparse.ArgumentParser(description="对比不同 state 形状下 MemorySaver 与 SqliteCheckpointer 的写入量/内存/磁盘增长")
+    parser.add_argument("--threads", type=int, default=20)
+    parser.add_argument("--turns", type=int, default=10)
+    parser.add_argument("--loops", type=int, default=1, help="每轮 grade 判否后重写检索的次数")
+    parser.add_argument("--keep-last", type=int, default=3)
+    parser.add_argument("--layout", choices=["full", "compact", "both"], default="both")
+    args = parser.parse_args()
+    invocations = args.threads * args.turns
+    steps = invocations * (3 + 3 * args.loops)  # router/retrieve/grade/answer + 每次循环的 rewrite/retrieve/grade
+    layouts = ["full", "compact"] if args.layout == "both" else [args.layout]
+
+    print(f"--- 🧪 {args.threads} 个线程 × {args.turns} 轮，每轮重写检索 {args.loops} 次 ({steps // invocations} 步) ---")
+    for layout in layouts:
+        saver = MemorySaver()
+        elapsed, mem = run(saver, layout, args.threads, args.turns, args.loops)
+        written = memory_saver_bytes(saver)
+        print(f"\n=== [{layout}] MemorySaver ===")
+        print(f"累计写入: {written / 1024:.1f} KB (每轮 {written / invocations / 1024:.2f} KB) | "
+              f"内存增长: {mem / 1024:.1f} KB | 每步耗时 {elapsed / steps * 1000:.3f}ms")
+
+        variants = [("按值存储", None)]
+        if layout == "full":
+            variants.append(("父块 ID 引用", {"retrieved_context": NodeIdRef("retrieved_node_ids", resolve_context)}))
+        with tempfile.TemporaryDirectory() as tmp:
+            for i, (label, refs) in enumerate(variants):
+                saver = RefCheckpointer(os.path.join(tmp, f"{i}.sqlite"), keep_last=args.keep_last, ref_fields=refs)
+                elapsed, mem = run(saver, layout, args.threads, args.turns, args.loops)
+                stats = saver.stats()
+                per_thread = saver.stats("bench-0")
+                saver.close()
+                size = os.path.getsize(saver.path)
+                print(f"\n=== [{layout}] SqliteCheckpointer ({label}, keep_last={args.keep_last}) ===")
+                print(f"内存增长: {mem / 1024:.1f} KB | 每步耗时 {elapsed / steps * 1000:.3f}ms")
+                print(f"数据库文件: {size / 1024:.1f} KB (每线程 {size / args.threads / 1024:.1f} KB)")
+                print(f"单线程: checkpoints {per_thread['checkpoints_rows']} 行 / blobs {per_thread['blobs_bytes'] / 1024:.1f} KB / writes {per_thread['writes_bytes'] / 1024:.1f} KB")
+                print(f"全部: {stats}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,239 @@
+import os
+import sys
+import json
+import time
+import zlib
+import argparse
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from mock_llm_server import LatencyModel, ScriptedResponder, start_in_background, load_config
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# ==============================================================================
+# 端到端压测：本地 Mock LLM + 轻量检索器，多个 thread_id 并发跑完整张图，
+# 报告每个节点与整轮的 p50/p95/p99、每秒完成轮数、每轮 LLM 调用数。
+# 用脚本化的 Router / Grader 输出强制走指定路径 (追问补全、HyDE、重写循环、兜底、闲聊直连)。
+# ==============================================================================
+
+# 预设场景：Router / Grader 的输出序列 (全局轮转)。注意每个会话的第一轮没有历史，Router 不调 LLM，固定走 HyDE
+SCENARIOS = {
+    "happy": {"router": ["hyde"], "grader": ["yes"]},
+    "followup": {"router": ["contextualize"], "grader": ["yes"]},
+    "direct": {"router": ["direct"], "grader": ["yes"]},
+    "rewrite": {"router": ["hyde"], "grader": ["no", "yes"]},
+    "fallback": {"router": ["hyde"], "grader": ["no"]},
+    "mixed": {"router": ["contextualize", "hyde", "direct"], "grader": ["no", "yes", "yes"]},
+}
+
+QUERIES = [
+    "我很焦虑，感觉前途迷茫。",
+    "那具体该怎么做呢？",
+    "什么是‘空’？",
+    "它和无常有什么关系？",
+    "谢谢师父。",
+    "如何放下执着？",
+]
+
+
+class SyntheticRetriever:
+    """
+    不加载嵌入模型和索引的检索器：按查询哈希确定性地返回 top_k 个合成父块，可注入固定延迟。
+    得分落在 0.4~0.7 的中间地带，配合压测里关闭的评分短路，保证每次都由 (脚本化的) LLM 评分。
+    """
+
+    def __init__(self, top_k: int = 3, corpus_size: int = 200, chunk_chars: int = 600, latency_ms: float = 0):
+        self.top_k = top_k
+        self.latency_ms = latency_ms
+        self.texts = {
+            f"synthetic-{i}": (f"第{i}段经文。" + "诸行无常，是生灭法。生灭灭已，寂灭为乐。" * chunk_chars)[:chunk_chars]
+            for i in range(corpus_size)
+        }
+        self.ids = list(self.texts)
+
+    def retrieve(self, text: str):
+        from src.schema import RetrievedChunk
+
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000)
+        seed = zlib.crc32(text.encode("utf-8"))
+        chunks = []
+        for rank in range(self.top_k):
+            node_id = self.ids[(seed + rank * 7919) % len(self.ids)]
+            chunks.append(RetrievedChunk(node_id, self.texts[node_id], 0.7 - rank * 0.1))
+        return chunks
+
+    def get_texts(self, node_ids: list) -> list:
+        return [self.texts[i] for i in node_ids if i in self.texts]
+
+
+class NodeTimer:
+    """
+    通过 create_workflow(node_wrapper=...) 给每个节点计时。
+    保留全部样本算精确分位数 (instrumentation 的直方图只保留最近的滑动窗口)。
+    """
+
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self._lock = threading.Lock()
+
+    def wrap(self, name, fn):
+        def timed(state):
+            start = time.perf_counter()
+            try:
+                return fn(state)
+            finally:
+                elapsed = (time.perf_counter() - start) * 1000
+                with self._lock:
+                    self.samples[name].append(elapsed)
+
+        return timed
+
+
+def build_app(args, timer: NodeTimer):
+    from src.workflow import create_workflow
+    from src.nodes import set_retriever
+    from src.grading import grade_policy
+
+    if not args.real_retriever:
+        set_retriever(SyntheticRetriever(latency_ms=args.retrieve_ms))
+    if not args.keep_grade_policy:
+        # 关闭相似度短路，评分结论完全由脚本决定；也不把 Mock 的评分写进标定日志
+        grade_policy.high, grade_policy.low = float("inf"), float("-inf")
+        grade_policy.log_decision = lambda *a, **kw: None
+
+    if args.checkpointer == "sqlite":
+        from src.checkpoint import SqliteCheckpointer
+
+        path = args.sqlite_path
+        if os.path.exists(path):
+            os.remove(path)
+        memory = SqliteCheckpointer(path)
+    else:
+        from langgraph.checkpoint.memory import MemorySaver
+
+        memory = MemorySaver()
+    return create_workflow(node_wrapper=timer.wrap).compile(checkpointer=memory), memory
+
+
+def run_conversation(app, thread_id: str, turns: int) -> list:
+    config = {"configurable": {"thread_id": thread_id}}
+    latencies = []
+    for turn in range(turns):
+        query = QUERIES[(zlib.crc32(thread_id.encode()) + turn) % len(QUERIES)]
+        # 每轮从 0 开始计重写次数，让各轮的路径只由脚本决定
+        payload = {"query": query, "loop_step": 0}
+        start = time.perf_counter()
+        app.invoke(payload, config=config)
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description="整张图的端到端并发压测 (Mock LLM，不花 API 额度)")
+    parser.add_argument("--threads", type=int, default=32, help="并发会话 (thread_id) 数")
+    parser.add_argument("--turns", type=int, default=4, help="每个会话的轮数")
+    parser.add_argument("--concurrency", type=int, default=16, help="同时在跑的会话数")
+    parser.add_argument("--scenario", choices=list(SCENARIOS), default="mixed")
+    parser.add_argument("--config", default=None, help="Mock LLM 的 JSON 配置 (覆盖 --scenario 与延迟参数)")
+    parser.add_argument("--dist", choices=["fixed", "uniform", "lognormal"], default="lognormal")
+    parser.add_argument("--latency-ms", type=float, default=120)
+    parser.add_argument("--jitter-ms", type=float, default=0)
+    parser.add_argument("--sigma", type=float, default=0.4)
+    parser.add_argument("--retrieve-ms", type=float, default=20, help="合成检索器的固定延迟")
+    parser.add_argument("--real-retriever", action="store_true", help="使用真实的 BuddhistRecursiveRetriever")
+    parser.add_argument("--keep-grade-policy", action="store_true", help="保留评分短路阈值")
+    parser.add_argument("--checkpointer", choices=["memory", "sqlite"], default="memory")
+    parser.add_argument("--sqlite-path", default="./checkpoints/bench_graph.sqlite")
+    parser.add_argument("--output", default=None, help="把结果写成 JSON")
+    parser.add_argument("--verbose", action="store_true", help="输出节点的过程日志")
+    parser.add_argument("--events", default=None, help="把模型调用事件 (含完整消息) 写成 JSONL，供 prompt_prefix_stability.py 分析")
+    args = parser.parse_args()
+
+    if args.config:
+        options = load_config(args.config)
+    else:
+        options = {"responder": ScriptedResponder(SCENARIOS[args.scenario])}
+    server, base_url = start_in_background(
+        latency=LatencyModel(args.latency_ms, args.jitter_ms, dist=args.dist, sigma=args.sigma), **options
+    )
+    os.environ["DEEPSEEK_BASE_URL"] = base_url
+    os.environ.setdefault("OPENAI_API_KEY", "mock-key")
+
+    from src.stats import summarize
+    from src.history import history_manager
+    from src.utils import get_llm_flight_stats, get_llm_resilience_stats
+    from src.instrumentation import instrumentation, configure_logging, JsonlSink
+
+    configure_logging("INFO" if args.verbose else "WARNING")
+    if args.events:
+        instrumentation.record_prompts = True
+        instrumentation.add_sink(JsonlSink(args.events))
+
+    timer = NodeTimer()
+    app, memory = build_app(args, timer)
+    thread_ids = [f"bench-{i:04d}" for i in range(args.threads)]
+    print(f"--- 🧪 Mock LLM: {base_url} | 场景 {args.config or args.scenario} | "
+          f"{args.threads} 个会话 × {args.turns} 轮，并发 {args.concurrency} ---")
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        results = list(pool.map(lambda t: run_conversation(app, t, args.turns), thread_ids))
+    wall = time.perf_counter() - start
+    # 结束前等后台摘要任务跑完，它们的 LLM 调用也算进总数
+    history_manager.flush()
+
+    turns = sum(len(r) for r in results)
+    calls = server.stats["requests"]
+    counters = instrumentation.snapshot()["counters"]
+    tokens = {
+        kind: sum(v for k, v in counters.items() if k.startswith(f"llm_{kind}_tokens_total"))
+        for kind in ("prompt", "completion", "prompt_cache_hit")
+    }
+    report = {
+        "scenario": args.config or args.scenario,
+        "threads": args.threads,
+        "turns": turns,
+        "concurrency": args.concurrency,
+        "wall_seconds": wall,
+        "turns_per_second": turns / wall,
+        "end_to_end_ms": summarize([ms for r in results for ms in r]),
+        "nodes_ms": {name: summarize(v) for name, v in timer.samples.items()},
+        "node_visits_per_turn": {name: len(v) / turns for name, v in timer.samples.items()},
+        "llm_calls_per_turn": calls / turns,
+        "llm_calls_by_kind": dict(server.stats["by_kind"]),
+        "prompt_tokens_per_turn": tokens["prompt"] / turns,
+        "completion_tokens_per_turn": tokens["completion"] / turns,
+        "prompt_cache_hit_ratio": tokens["prompt_cache_hit"] / tokens["prompt"] if tokens["prompt"] else 0.0,
+        "singleflight": get_llm_flight_stats(),
+        "resilience": get_llm_resilience_stats(),
+    }
+
+    e2e = report["end_to_end_ms"]
+    print(f"\n=== 整轮 === p50 {e2e['p50']:.0f}ms | p95 {e2e['p95']:.0f}ms | p99 {e2e['p99']:.0f}ms | "
+          f"{report['turns_per_second']:.1f} 轮/秒")
+    print(f"{'节点':<14}{'次/轮':>8}{'p50':>10}{'p95':>10}{'p99':>10}")
+    for name, s in sorted(report["nodes_ms"].items(), key=lambda kv: -kv[1]["p50"]):
+        print(f"{name:<14}{report['node_visits_per_turn'][name]:>8.2f}"
+              f"{s['p50']:>8.0f}ms{s['p95']:>8.0f}ms{s['p99']:>8.0f}ms")
+    print(f"\nLLM 调用 {calls} 次，平均每轮 {report['llm_calls_per_turn']:.2f} 次 | 按类别 {report['llm_calls_by_kind']}")
+    print(f"每轮 token: prompt {report['prompt_tokens_per_turn']:.0f} | completion {report['completion_tokens_per_turn']:.0f} | "
+          f"前缀缓存命中 {report['prompt_cache_hit_ratio']:.1%}")
+    print(f"请求合并 {report['singleflight']}")
+
+    if args.output:
+        if os.path.dirname(args.output):
+            os.makedirs(os.path.dirname(args.output), exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"--- ✅ 结果已写入: {args.output} ---")
+
+    if hasattr(memory, "close"):
+        memory.close()
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+import os
+import sys
+import time
+import argparse
+import statistics
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src.history import HistoryManager, estimate_tokens, apply_update
+from src.agents import build_master_task_prompt
+
+# 模拟一段固定长度的检索上下文和问答，保证两种模式只有历史部分不同
+FAKE_CONTEXT = "诸行无常，是生灭法。生灭灭已，寂灭为乐。" * 20
+FAKE_QUESTION = "第{turn}问：弟子近来心绪不宁，总被往事牵绊，该如何放下？"
+FAKE_ANSWER = "阿弥陀佛，施主。" + "心如流水，念起念落，不必抓取，亦不必驱赶，只管看着它来去。" * 4
+
+
+def slow_summarizer(delay: float):
+    """
+    模拟 LLM 摘要：睡 delay 秒后返回截断文本。用来证明摘要不在回答的关键路径上。
+    """
+    def _summarize(summary, lines):
+        time.sleep(delay)
+        return ("；".join([summary] + [line[:20] for line in lines]))[-300:]
+    return _summarize
+
+
+def run_conversation(turns: int, bounded: bool, summary_delay: float):
+    manager = HistoryManager(summarizer=slow_summarizer(summary_delay))
+    state = {"history_log": [], "history_summary": ""}
+    rows = []
+
+    for turn in range(1, turns + 1):
+        question = FAKE_QUESTION.format(turn=turn)
+
+        start = time.perf_counter()
+        history = manager.view(state) if bounded else state["history_log"]
+        prompt = build_master_task_prompt(question, FAKE_CONTEXT, history)
+        if bounded:
+            state = apply_update(state, manager.append_turn(state, f"信众: {question}", f"法师: {FAKE_ANSWER}"))
+        else:
+            state["history_log"] = state["history_log"] + [f"信众: {question}", f"法师: {FAKE_ANSWER}"]
+        elapsed_ms = (time.perf_counter() - start) * 1000
+
+        rows.append({
+            "turn": turn,
+            "prompt_chars": len(prompt),
+            "prompt_tokens": estimate_tokens(prompt),
+            "local_ms": elapsed_ms,
+            "state_lines": len(state["history_log"]),
+        })
+
+    manager.flush()
+    return rows
+
+
+def report(name: str, rows: list, ms_per_1k_tokens: float):
+    print(f"\n=== {name} ===")
+    print(f"{'turn':>5} {'prompt_chars':>13} {'prompt_tokens':>14} {'state_lines':>12} {'est_prefill_ms':>15}")
+    checkpoints = {1, 10, 25, 50, 75, len(rows)}
+    for row in rows:
+        if row["turn"] in checkpoints:
+            prefill = row["prompt_tokens"] / 1000 * ms_per_1k_tokens
+            print(f"{row['turn']:>5} {row['prompt_chars']:>13} {row['prompt_tokens']:>14} "
+                  f"{row['state_lines']:>12} {prefill:>15.1f}")
+
+    local = [row["local_ms"] for row in rows]
+    total_tokens = sum(row["prompt_tokens"] for row in rows)
+    print(f"--- 累计提示词 tokens: {total_tokens} | 预估累计 prefill: {total_tokens / 1000 * ms_per_1k_tokens / 1000:.1f}s ---")
+    print(f"--- 本地拼装耗时 (每轮): mean {statistics.mean(local):.3f}ms | max {max(local):.3f}ms ---")
+    return total_tokens
+
+
+def main():
+    parser = argparse.ArgumentParser(description="对比有界/无界对话历史在长对话中的提示词增长与耗时")
+    parser.add_argument("--turns", type=int, default=100)
+    parser.add_argument("--summary-delay", type=float, default=0.05, help="模拟摘要 LLM 的耗时 (秒)")
+    parser.add_argument("--ms-per-1k-tokens", type=float, default=150.0,
+                        help="上游 prefill 的线性耗时模型，用于把 tokens 换算成预估延迟")
+    args = parser.parse_args()
+
+    print(f"--- 🧪 模拟 {args.turns} 轮对话 ---")
+    unbounded = report("无界历史 (旧实现)", run_conversation(args.turns, False, args.summary_delay), args.ms_per_1k_tokens)
+    bounded = report("有界历史 + 滚动摘要", run_conversation(args.turns, True, args.summary_delay), args.ms_per_1k_tokens)
+    print(f"\n--- ✅ 累计提示词 tokens 减少 {(1 - bounded / unbounded) * 100:.1f}% ---")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,288 @@
+import os
+import sys
+import ast
+import json
+import math
+import time
+import argparse
+from datetime import datetime
+
+import pandas as pd
+from tqdm import tqdm
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src.config import PERSIST_PATH, get_device, CHUNK_SIZE, CHUNK_OVERLAP, TOP_K
+from src.schema import RetrievedChunk
+from src.stats import summarize
+from src.utils import convert_to_simplified
+
+# ==============================================================================
+# 离线检索质量基准：不调用任何 LLM，只比较检索结果与标注的金标准片段。
+# 输出 recall@k / MRR / nDCG@k 和单次检索延迟分位数，写成 JSON 以便回归对比。
+# ==============================================================================
+
+TESTSET_PATH = "./testdata/dharma_db_testset.csv"
+OUTPUT_PATH = "./testdata/retrieval_bench.json"
+
+
+# ------------------------------------------------------------------------------
+# 检索后端：统一返回 list[RetrievedChunk]
+# ------------------------------------------------------------------------------
+def make_recursive_backend(top_k: int):
+    """线上正在用的 BuddhistRecursiveRetriever (子块命中 -> 返回父块)。"""
+    from src.retriever import BuddhistRecursiveRetriever
+    retriever = BuddhistRecursiveRetriever(similarity_top_k=top_k)
+    return retriever.retrieve
+
+
+def make_chroma_backend(top_k: int, collection_name: str = "buddhist_sutras"):
+    """直连 scripts/ingest.py 建的 Chroma 集合 (只有子块，没有父块展开)。"""
+    import chromadb
+    from llama_index.embeddings.huggingface import HuggingFaceEmbedding
+
+    embed_model = HuggingFaceEmbedding(model_name="BAAI/bge-small-zh-v1.5", device=get_device())
+    collection = chromadb.PersistentClient(path=PERSIST_PATH).get_collection(collection_name)
+
+    to_similarity = chroma_similarity(collection_space(collection))
+
+    def retrieve(text: str):
+        result = collection.query(query_embeddings=[embed_model.get_query_embedding(text)], n_results=top_k)
+        return [
+            RetrievedChunk(node_id, doc, to_similarity(dist))
+            for node_id, doc, dist in zip(result["ids"][0], result["documents"][0], result["distances"][0])
+        ]
+
+    return retrieve
+
+
+def collection_space(collection) -> str:
+    """
+    集合的距离度量：旧版本写在 metadata 的 hnsw:space 里，新版本在 configuration 里；都没有时是 Chroma 默认的 l2。
+    """
+    space = (collection.metadata or {}).get("hnsw:space")
+    if space is None:
+        space = ((getattr(collection, "configuration", None) or {}).get("hnsw") or {}).get("space")
+    return space or "l2"
+
+
+def chroma_similarity(space: str):
+    """
+    把 Chroma 返回的距离换算成和其他后端同向的相似度 (越大越相关)：
+    - cosine：距离是 1 - cos；
+    - ip：距离是 1 - 点积；
+    - l2：距离是欧氏距离的平方，bge 的向量已归一化，cos = 1 - d / 2。
+    """
+    if space in ("cosine", "ip"):
+        return lambda dist: 1 - dist
+    if space == "l2":
+        return lambda dist: 1 - dist / 2
+    raise ValueError(f"未知的 Chroma 距离度量: {space!r}")
+
+
+def make_sidecar_backend(top_k: int):
+    """
+    线上 sidecar 部署的服务路径：经 RetrieverClient 走 Unix socket，检索在 scripts/retriever_sidecar.py 启动的进程里完成。
+    sidecar 的 top_k 在启动时固定 (TOP_K)，这里只能截断，不能取得更多。
+    """
+    from src.retrieval_service import RetrieverClient
+
+    if top_k > TOP_K:
+        print(f"--- ⚠️ sidecar 每次只返回 {TOP_K} 个结果，@{top_k} 的指标按 {TOP_K} 个计算 ---")
+    client = RetrieverClient()
+
+    def retrieve(text: str):
+        return client.retrieve(text)[:top_k]
+
+    return retrieve
+
+
+BACKENDS = {
+    "recursive": make_recursive_backend,
+    "chroma": make_chroma_backend,
+    "sidecar": make_sidecar_backend,
+}
+
+
+# ------------------------------------------------------------------------------
+# 标注数据与相关性判定
+# ------------------------------------------------------------------------------
+def load_labelled_set(path: str) -> list:
+    """
+    读取 (问题, 金标准片段列表)。支持 Ragas 生成的 CSV (reference_contexts 是字符串化的 list)
+    以及每行 {"query": ..., "gold": [...]} 的 JSONL。
+    """
+    if path.endswith(".jsonl"):
+        with open(path, "r", encoding="utf-8") as f:
+            rows = [json.loads(line) for line in f if line.strip()]
+        raw = [(r["query"], r.get("gold")) for r in rows]
+    else:
+        df = pd.read_csv(path)
+        raw = []
+        for _, row in df.iterrows():
+            gold = row.get("reference_contexts")
+            if isinstance(gold, str):
+                try:
+                    gold = ast.literal_eval(gold)
+                except (ValueError, SyntaxError):
+                    gold = [gold]
+            raw.append((row["user_input"], gold))
+
+    # 先过滤空片段，再丢掉金标准为空的样本 (否则 score_query 里会除以零)
+    samples = []
+    for query, gold in raw:
+        if isinstance(gold, str):
+            gold = [gold]
+        gold = [g for g in (gold if isinstance(gold, (list, tuple)) else []) if isinstance(g, str) and g.strip()]
+        if gold:
+            samples.append((query, gold))
+    if len(samples) < len(raw):
+        print(f"--- ⚠️ {len(raw) - len(samples)} 条样本没有有效的金标准片段，已跳过 ---")
+    return samples
+
+
+def _normalize(text: str) -> str:
+    return "".join(convert_to_simplified(text).split())
+
+
+def _bigrams(text: str) -> set:
+    return {text[i:i + 2] for i in range(len(text) - 1)}
+
+
+def is_match(gold: str, retrieved: str, min_overlap: float) -> bool:
+    """
+    金标准片段与检索结果的切分粒度不同 (子块 vs 父块)，所以不要求全等：
+    金标准被检索文本包含，或金标准的字符二元组有 min_overlap 以上出现在检索文本中，即视为命中。
+    """
+    gold, retrieved = _normalize(gold), _normalize(retrieved)
+    if not gold or not retrieved:
+        return False
+    if gold in retrieved:
+        return True
+    gold_grams = _bigrams(gold)
+    return len(gold_grams & _bigrams(retrieved)) / len(gold_grams) >= min_overlap
+
+
+def score_query(golds: list, chunks: list, ks: list, min_overlap: float) -> dict:
+    # relevance[i]：第 i 个检索结果是否命中任一金标准 (用于 MRR)；
+    # gain[i]：第 i 个检索结果是否命中了此前还没被命中的金标准 (用于 nDCG，每个金标准只计一次)；
+    # hit_rank[g]：金标准 g 第一次被命中的名次
+    relevance, gain = [], []
+    hit_rank = {}
+    for rank, chunk in enumerate(chunks, start=1):
+        matched = [g for g in range(len(golds)) if is_match(golds[g], chunk.text, min_overlap)]
+        new = [g for g in matched if g not in hit_rank]
+        relevance.append(1 if matched else 0)
+        gain.append(1 if new else 0)
+        for g in new:
+            hit_rank[g] = rank
+
+    first = next((i for i, rel in enumerate(relevance, start=1) if rel), None)
+    metrics = {"mrr": 1 / first if first else 0.0}
+    for k in ks:
+        metrics[f"recall@{k}"] = sum(1 for r in hit_rank.values() if r <= k) / len(golds)
+        # 理想排序：前 min(金标准数, k) 个结果各命中一个新的金标准，与 gain 的计分口径一致，nDCG 不会超过 1
+        dcg = sum(g / math.log2(i + 1) for i, g in enumerate(gain[:k], start=1))
+        idcg = sum(1 / math.log2(i + 1) for i in range(1, min(len(golds), k) + 1))
+        metrics[f"ndcg@{k}"] = dcg / idcg if idcg else 0.0
+    return metrics
+
+
+# ------------------------------------------------------------------------------
+# 主流程
+# ------------------------------------------------------------------------------
+def run_backend(name: str, samples: list, ks: list, min_overlap: float, warmup: int) -> dict:
+    print(f"--- 🔧 初始化检索后端: {name} ---")
+    retrieve = BACKENDS[name](max(ks))
+
+    # 预热：首次查询会触发模型加载、算子编译等，不计入延迟
+    for query, _ in samples[:warmup]:
+        retrieve(query)
+
+    per_query = []
+    for query, golds in tqdm(samples, desc=name):
+        start = time.perf_counter()
+        chunks = retrieve(query)
+        latency_ms = (time.perf_counter() - start) * 1000
+        metrics = score_query(golds, chunks, ks, min_overlap)
+        per_query.append({"query": query, "latency_ms": latency_ms, "retrieved": [c.node_id for c in chunks], **metrics})
+
+    metric_names = [m for m in per_query[0] if m == "mrr" or "@" in m] if per_query else []
+    aggregate = {m: sum(q[m] for q in per_query) / len(per_query) for m in metric_names}
+    return {
+        "metrics": aggregate,
+        "latency_ms": summarize([q["latency_ms"] for q in per_query]),
+        "per_query": per_query,
+    }
+
+
+def compare(result: dict, baseline_path: str, tolerance: float) -> bool:
+    """
+    与基线结果逐项比较，任一质量指标下降超过 tolerance 即视为回归。
+    """
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    ok = True
+    for backend, current in result["backends"].items():
+        base = baseline.get("backends", {}).get(backend)
+        if base is None:
+            continue
+        for metric, value in current["metrics"].items():
+            old = base["metrics"].get(metric)
+            if old is None:
+                continue
+            delta = value - old
+            flag = "❌" if delta < -tolerance else "  "
+            ok = ok and delta >= -tolerance
+            print(f"{flag} {backend:<10} {metric:<10} {old:.4f} -> {value:.4f} ({delta:+.4f})")
+        old_p95, new_p95 = base["latency_ms"]["p95"], current["latency_ms"]["p95"]
+        print(f"   {backend:<10} p95 延迟   {old_p95:.1f}ms -> {new_p95:.1f}ms")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="离线检索质量基准 (不需要 LLM)")
+    parser.add_argument("--testset", default=TESTSET_PATH, help="CSV (Ragas 测试集) 或 JSONL 标注文件")
+    parser.add_argument("--backends", default="recursive", help=f"逗号分隔，可选: {','.join(BACKENDS)}")
+    parser.add_argument("--ks", default="1,3,5")
+    parser.add_argument("--min-overlap", type=float, default=0.6, help="判定命中的字符二元组重合比例")
+    parser.add_argument("--warmup", type=int, default=3)
+    parser.add_argument("--output", default=OUTPUT_PATH)
+    parser.add_argument("--baseline", default=None, help="与之前的结果文件对比，指标下降超过容差则返回非零")
+    parser.add_argument("--tolerance", type=float, default=0.02)
+    args = parser.parse_args()
+
+    ks = sorted(int(k) for k in args.ks.split(","))
+    samples = load_labelled_set(args.testset)
+    print(f"--- 📂 载入 {len(samples)} 条标注查询 ---")
+
+    result = {
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "testset": args.testset,
+        "ks": ks,
+        "min_overlap": args.min_overlap,
+        "config": {"chunk_size": CHUNK_SIZE, "chunk_overlap": CHUNK_OVERLAP, "persist_path": PERSIST_PATH},
+        "backends": {},
+    }
+    backends = [name.strip() for name in args.backends.split(",") if name.strip()]
+    unknown = [name for name in backends if name not in BACKENDS]
+    if unknown:
+        parser.error(f"未知的检索后端: {', '.join(unknown)} (可选: {', '.join(BACKENDS)})")
+    for name in backends:
+        result["backends"][name] = run_backend(name, samples, ks, args.min_overlap, args.warmup)
+        m, lat = result["backends"][name]["metrics"], result["backends"][name]["latency_ms"]
+        print(f"=== {name} === " + " | ".join(f"{k} {v:.3f}" for k, v in m.items()))
+        print(f"    延迟 p50 {lat['p50']:.1f}ms | p95 {lat['p95']:.1f}ms | p99 {lat['p99']:.1f}ms")
+
+    if os.path.dirname(args.output):
+        os.makedirs(os.path.dirname(args.output), exist_ok=True)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    print(f"--- ✅ 结果已写入: {args.output} ---")
+
+    if args.baseline and not compare(result, args.baseline, args.tolerance):
+        print("--- ❌ 检索质量回归 ---")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import threading
+
+from mock_llm_server import LatencyModel, ScriptedResponder, start_in_background
+from bench_graph import SCENARIOS, QUERIES, SyntheticRetriever
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# ==============================================================================
+# HTTP 服务压测：进程内起 Mock LLM + serve 的 FastAPI 应用 (合成检索器)，
+# 按不同并发档位打 /chat，报告成功/被拒比例、端到端分位数、首字时间 (流式) 和吞吐。
+# 并发超过 max_in_flight + max_queue 时应看到 503 快速失败，而不是所有请求一起变慢。
+# ==============================================================================
+
+
+def start_server(app, port: int):
+    import uvicorn
+
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+
+async def wait_ready(client, timeout: float = 120):
+    end = time.monotonic() + timeout
+    while time.monotonic() < end:
+        if (await client.get("/readyz")).status_code == 200:
+            return
+        await asyncio.sleep(0.1)
+    raise RuntimeError("服务预热超时")
+
+
+async def one_turn(client, thread_id: str, query: str, stream: bool) -> dict:
+    start = time.perf_counter()
+    body = {"thread_id": thread_id, "query": query, "stream": stream}
+    if not stream:
+        response = await client.post("/chat", json=body)
+        return {"status": response.status_code, "ms": (time.perf_counter() - start) * 1000, "ttft_ms": None}
+
+    ttft = None
+    async with client.stream("POST", "/chat", json=body) as response:
+        if response.status_code != 200:
+            await response.aread()
+            return {"status": response.status_code, "ms": (time.perf_counter() - start) * 1000, "ttft_ms": None}
+        async for line in response.aiter_lines():
+            if ttft is None and line == "event: token":
+                ttft = (time.perf_counter() - start) * 1000
+            if line == "event: error":
+                return {"status": 500, "ms": (time.perf_counter() - start) * 1000, "ttft_ms": ttft}
+    return {"status": 200, "ms": (time.perf_counter() - start) * 1000, "ttft_ms": ttft}
+
+
+async def run_level(client, concurrency: int, turns: int, stream: bool, tag: str) -> dict:
+    from src.stats import summarize
+
+    async def conversation(i):
+        results = []
+        for turn in range(turns):
+            results.append(await one_turn(client, f"{tag}-{i:04d}", QUERIES[(i + turn) % len(QUERIES)], stream))
+        return results
+
+    start = time.perf_counter()
+    results = [r for conv in await asyncio.gather(*[conversation(i) for i in range(concurrency)]) for r in conv]
+    wall = time.perf_counter() - start
+
+    ok = [r for r in results if r["status"] == 200]
+    codes = {}
+    for r in results:
+        codes[r["status"]] = codes.get(r["status"], 0) + 1
+    return {
+        "concurrency": concurrency,
+        "requests": len(results),
+        "status_codes": codes,
+        "ok_ms": summarize([r["ms"] for r in ok]),
+        "rejected_ms": summarize([r["ms"] for r in results if r["status"] in (429, 503)]),
+        "ttft_ms": summarize([r["ttft_ms"] for r in ok if r["ttft_ms"] is not None]),
+        "ok_per_second": len(ok) / wall,
+    }
+
+
+async def race_check(client, graph, requests: int) -> dict:
+    """
+    同一 thread_id 并发打多轮：成功的轮次应全部留在对话历史里 (没有互相覆盖)，排队过多的返回 429。
+    """
+    thread_id = "race-0000"
+    results = await asyncio.gather(*[one_turn(client, thread_id, f"第{i}问：何为般若？", False) for i in range(requests)])
+    from src.history import history_manager
+
+    history = history_manager.view(graph.get_state({"configurable": {"thread_id": thread_id}}).values)
+    return {
+        "status_codes": [r["status"] for r in results],
+        "succeeded": sum(r["status"] == 200 for r in results),
+        "turns_in_history": sum(line.startswith("信众:") for line in history),
+    }
+
+
+async def drive(args, port: int, graph):
+    import httpx
+
+    levels = [int(x) for x in args.levels.split(",")]
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=120) as client:
+        await wait_ready(client)
+        report = {"levels": []}
+        for level in levels:
+            result = await run_level(client, level, args.turns, args.stream, f"c{level}")
+            report["levels"].append(result)
+            s, t = result["ok_ms"], result["ttft_ms"]
+            line = (f"并发 {level:>4} | 状态 {result['status_codes']} | p50 {s['p50']:.0f}ms p95 {s['p95']:.0f}ms "
+                    f"p99 {s['p99']:.0f}ms | {result['ok_per_second']:.1f} 成功/秒")
+            if args.stream:
+                line += f" | 首字 p50 {t['p50']:.0f}ms p95 {t['p95']:.0f}ms"
+            print(line)
+        report["race"] = await race_check(client, graph, args.race)
+        report["stats"] = (await client.get("/stats")).json()
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="HTTP 服务压测 (Mock LLM + 合成检索器)")
+    parser.add_argument("--levels", default="4,16,64", help="逗号分隔的并发客户端数")
+    parser.add_argument("--turns", type=int, default=2, help="每个客户端 (thread_id) 连续的轮数")
+    parser.add_argument("--stream", action="store_true", help="走 SSE 流式接口，额外统计首字时间")
+    parser.add_argument("--scenario", choices=list(SCENARIOS), default="happy")
+    parser.add_argument("--latency-ms", type=float, default=100)
+    parser.add_argument("--sigma", type=float, default=0.3)
+    parser.add_argument("--max-in-flight", type=int, default=16)
+    parser.add_argument("--max-queue", type=int, default=16)
+    parser.add_argument("--queue-timeout", type=float, default=2.0)
+    parser.add_argument("--race", type=int, default=4, help="同一 thread_id 并发请求数")
+    parser.add_argument("--port", type=int, default=8799)
+    parser.add_argument("--output", default=None)
+    args = parser.parse_args()
+
+    mock, base_url = start_in_background(
+        latency=LatencyModel(args.latency_ms, dist="lognormal", sigma=args.sigma),
+        responder=ScriptedResponder(SCENARIOS[args.scenario]),
+    )
+    os.environ["DEEPSEEK_BASE_URL"] = base_url
+    os.environ.setdefault("OPENAI_API_KEY", "mock-key")
+
+    from langgraph.checkpoint.memory import MemorySaver
+    from src.server import create_app
+    from src.grading import grade_policy
+
+    # 与 bench_graph 一样：评分结论只由脚本决定，不污染标定日志
+    grade_policy.high, grade_policy.low = float("inf"), float("-inf")
+    grade_policy.log_decision = lambda *a, **kw: None
+
+    app = create_app(
+        checkpointer=MemorySaver(),
+        retriever=SyntheticRetriever(latency_ms=20),
+        max_in_flight=args.max_in_flight,
+        max_queue=args.max_queue,
+        queue_timeout=args.queue_timeout,
+    )
+    server = start_server(app, args.port)
+    print(f"--- 🧪 Mock LLM: {base_url} | 在途上限 {args.max_in_flight} | 排队上限 {args.max_queue} | "
+          f"{'流式' if args.stream else '非流式'} ---")
+    try:
+        report = asyncio.run(drive(args, args.port, app.state.graph))
+    finally:
+        server.should_exit = True
+
+    race = report["race"]
+    print(f"同会话并发 {args.race} 次: 状态 {race['status_codes']} | 成功 {race['succeeded']} 轮，历史里有 {race['turns_in_history']} 轮")
+    print(f"服务端统计: {report['stats']['admission']}")
+    if args.output:
+        if os.path.dirname(args.output):
+            os.makedirs(os.path.dirname(args.output), exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"--- ✅ 结果已写入: {args.output} ---")
+
+
+if __name__ == "__main__":
+    main()
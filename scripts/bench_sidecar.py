@@ -0,0 +1,249 @@
+import os
+import sys
+import json
+import time
+import zlib
+import random
+import shutil
+import argparse
+import tempfile
+import threading
+import multiprocessing as mp
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# ==============================================================================
+# 检索 sidecar 压测：worker 数逐步增加，对比两种部署的每个 worker 内存 (RSS / PSS) 与总吞吐：
+#   local   每个 worker 自己加载嵌入模型和索引 (现状)
+#   sidecar 一个 sidecar 进程持有模型和内存映射索引，worker 通过 Unix socket 批量调用
+# 默认用合成数据 (哈希嵌入 + 随机投影表模拟模型权重)，--real 使用导出的真实索引和 bge 模型。
+# sidecar 模式下 worker 的导入链不能带上 torch / llama-index；跑完会检查这一点，
+# 并要求 sidecar worker 的 RSS 比 local worker 至少小 --min-saving-mb，否则以非零状态退出。
+# ==============================================================================
+
+CHARS = "佛法僧戒定慧空有色心性因果缘起无常苦集灭道般若菩提涅槃众生如来智慧慈悲布施忍辱精进禅"
+HEAVY_MODULES = ("torch", "llama_index", "transformers", "sentence_transformers", "chromadb")
+
+
+class HashEmbedder:
+    """
+    合成嵌入：字符二元组哈希到随机投影表的行后求和。投影表大小可调，用来模拟嵌入模型的权重内存。
+    """
+
+    def __init__(self, dim: int = 512, table_mb: int = 128, seed: int = 0):
+        rows = max(1024, table_mb * 2 ** 20 // (4 * dim))
+        self.table = np.random.default_rng(seed).standard_normal((rows, dim), dtype=np.float32)
+
+    def __call__(self, texts: list):
+        out = np.zeros((len(texts), self.table.shape[1]), dtype=np.float32)
+        for i, text in enumerate(texts):
+            rows = [zlib.crc32(text[j:j + 2].encode("utf-8")) % len(self.table) for j in range(len(text) - 1)]
+            if rows:
+                out[i] = self.table[rows].sum(axis=0)
+        return out
+
+
+class LocalRetriever:
+    """
+    进程内检索：自带一份嵌入模型和一份常驻内存的索引，模拟每个 worker 各自加载 BuddhistRecursiveRetriever。
+    """
+
+    def __init__(self, index, embed, top_k: int = 3):
+        self.index = index
+        self.embed = embed
+        self.top_k = top_k
+
+    def retrieve(self, text: str):
+        return self.index.search(self.embed([text]), self.top_k)[0]
+
+    def get_texts(self, node_ids: list):
+        return self.index.get_texts(node_ids)
+
+
+def build_synthetic_index(index_dir: str, parents: int, children: int, dim: int, table_mb: int):
+    from src.retrieval_service import write_mmap_index
+
+    rng = random.Random(0)
+    embed = HashEmbedder(dim, table_mb)
+    texts = ["".join(rng.choice(CHARS) for _ in range(1024)) for _ in range(parents)]
+    child_texts, owners = [], []
+    for p, text in enumerate(texts):
+        for c in range(children):
+            child_texts.append(text[c * 128:(c + 1) * 128])
+            owners.append(p)
+    vectors = np.concatenate([embed(child_texts[i:i + 512]) for i in range(0, len(child_texts), 512)])
+    write_mmap_index(index_dir, vectors, owners, [f"parent-{p}" for p in range(parents)], texts, "synthetic")
+    return [texts[rng.randrange(parents)][s:s + 40] for s in (rng.randrange(900) for _ in range(500))]
+
+
+def make_embedder(args):
+    if args.real:
+        from src.retrieval_service import load_query_embedder
+        return load_query_embedder()
+    return HashEmbedder(args.dim, args.table_mb)
+
+
+def memory() -> dict:
+    import psutil
+
+    info = psutil.Process().memory_full_info()
+    return {"rss_mb": info.rss / 2 ** 20, "pss_mb": getattr(info, "pss", info.rss) / 2 ** 20}
+
+
+def sidecar_main(args, index_dir: str, socket_path: str, ready, control):
+    from src.retrieval_service import MmapIndex, RetrievalServer
+
+    server = RetrievalServer(MmapIndex(index_dir), make_embedder(args), socket_path=socket_path,
+                             max_batch=args.max_batch, max_wait_ms=args.max_wait_ms)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    ready.set()
+    # 主线程等父进程来要内存数据，回复后退出
+    control.recv()
+    control.send({**memory(), **server.counters})
+    server.close()
+
+
+def worker_main(args, mode: str, index_dir: str, socket_path: str, queries: list, barrier, results_q):
+    os.environ["ZENGRAPH_RETRIEVER"] = "sidecar" if mode == "sidecar" else "local"
+    os.environ["ZENGRAPH_RETRIEVER_SOCKET"] = socket_path
+    # worker 和线上一样导入 src.nodes (带上 camel / langgraph 的常驻内存)
+    from src import nodes
+
+    if mode == "local" and not args.real:
+        # 和 BuddhistRecursiveRetriever 一样导入 llama-index / torch，合成模式下两种部署的导入开销才可比
+        import src.retriever  # noqa: F401
+        from src.retrieval_service import MmapIndex
+        index = MmapIndex(index_dir)
+        # 常驻内存的私有副本，对应 llama-index 把 docstore 和向量整份读进进程
+        index.vectors, index._texts = np.array(index.vectors), np.array(index._texts)
+        nodes.set_retriever(LocalRetriever(index, make_embedder(args)))
+    retriever = nodes.get_retriever()
+    retriever.retrieve(queries[0])
+
+    barrier.wait()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.threads) as pool:
+        list(pool.map(retriever.retrieve, queries))
+    elapsed = time.perf_counter() - start
+    heavy = sorted({name.split(".")[0] for name in sys.modules} & set(HEAVY_MODULES))
+    results_q.put({"queries": len(queries), "seconds": elapsed, "heavy_modules": heavy, **memory()})
+
+
+def run(args, mode: str, workers: int, index_dir: str, queries: list) -> dict:
+    ctx = mp.get_context("spawn")
+    # mkdtemp 建的目录是 0700，满足 sidecar 对 socket 目录的要求
+    socket_path = os.path.join(tempfile.mkdtemp(prefix="zengraph-bench-"), "retriever.sock")
+    sidecar, control = None, None
+    if mode == "sidecar":
+        ready = ctx.Event()
+        control, child_control = ctx.Pipe()
+        sidecar = ctx.Process(target=sidecar_main, args=(args, index_dir, socket_path, ready, child_control))
+        sidecar.start()
+        ready.wait()
+
+    barrier, results_q = ctx.Barrier(workers), ctx.Queue()
+    procs = []
+    for w in range(workers):
+        share = [queries[(w * 7 + i) % len(queries)] for i in range(args.queries)]
+        procs.append(ctx.Process(target=worker_main, args=(args, mode, index_dir, socket_path, share, barrier, results_q)))
+    for p in procs:
+        p.start()
+    results = [results_q.get() for _ in procs]
+    for p in procs:
+        p.join()
+
+    sidecar_stats = None
+    if sidecar is not None:
+        control.send("stats")
+        sidecar_stats = control.recv()
+        sidecar.join(timeout=10)
+    shutil.rmtree(os.path.dirname(socket_path), ignore_errors=True)
+
+    wall = max(r["seconds"] for r in results)
+    total_pss = sum(r["pss_mb"] for r in results) + (sidecar_stats["pss_mb"] if sidecar_stats else 0)
+    return {
+        "mode": mode,
+        "workers": workers,
+        "qps": sum(r["queries"] for r in results) / wall,
+        "worker_rss_mb": sum(r["rss_mb"] for r in results) / workers,
+        "worker_pss_mb": sum(r["pss_mb"] for r in results) / workers,
+        "total_pss_mb": total_pss,
+        "heavy_modules": sorted({m for r in results for m in r["heavy_modules"]}),
+        "sidecar": sidecar_stats,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="检索 sidecar 与进程内检索的内存 / 吞吐对比")
+    parser.add_argument("--workers", default="1,2,4,8")
+    parser.add_argument("--modes", default="local,sidecar")
+    parser.add_argument("--queries", type=int, default=300, help="每个 worker 的查询数")
+    parser.add_argument("--threads", type=int, default=4, help="每个 worker 内的并发查询线程")
+    parser.add_argument("--real", action="store_true", help="使用导出的真实索引 (--index-dir) 和 bge 模型")
+    parser.add_argument("--index-dir", default=None)
+    parser.add_argument("--parents", type=int, default=20000, help="合成索引的父块数")
+    parser.add_argument("--children", type=int, default=4, help="合成索引每个父块的子块数")
+    parser.add_argument("--dim", type=int, default=512)
+    parser.add_argument("--table-mb", type=int, default=128, help="合成嵌入模型的权重大小")
+    parser.add_argument("--max-batch", type=int, default=32)
+    parser.add_argument("--max-wait-ms", type=float, default=5)
+    parser.add_argument("--min-saving-mb", type=float, default=200, help="sidecar worker 的 RSS 至少要比 local 小这么多")
+    parser.add_argument("--output", default=None)
+    args = parser.parse_args()
+
+    if args.real:
+        from src.config import RETRIEVER_MMAP_DIR
+        from bench_graph import QUERIES
+        index_dir, queries = args.index_dir or RETRIEVER_MMAP_DIR, QUERIES
+    else:
+        index_dir = args.index_dir or tempfile.mkdtemp(prefix="zengraph-mmap-")
+        queries = build_synthetic_index(index_dir, args.parents, args.children, args.dim, args.table_mb)
+        print(f"--- 🧪 合成索引: {args.parents} 父块 × {args.children} 子块, dim={args.dim} -> {index_dir} ---")
+
+    rows = []
+    print(f"{'模式':<9}{'worker':>7}{'QPS':>9}{'RSS/worker':>13}{'PSS/worker':>13}{'总 PSS':>10}")
+    for workers in (int(w) for w in args.workers.split(",")):
+        for mode in args.modes.split(","):
+            row = run(args, mode, workers, index_dir, queries)
+            rows.append(row)
+            print(f"{mode:<9}{workers:>7}{row['qps']:>9.0f}{row['worker_rss_mb']:>11.0f}MB"
+                  f"{row['worker_pss_mb']:>11.0f}MB{row['total_pss_mb']:>8.0f}MB")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(rows, f, ensure_ascii=False, indent=2)
+        print(f"--- ✅ 结果已写入: {args.output} ---")
+
+    failures = check_footprint(rows, args.min_saving_mb)
+    for failure in failures:
+        print(f"--- ❌ {failure} ---")
+    if failures:
+        sys.exit(1)
+
+
+def check_footprint(rows: list, min_saving_mb: float) -> list:
+    """
+    sidecar worker 不能加载 torch / llama-index，且同样 worker 数下 RSS 要比 local 至少小 min_saving_mb。
+    """
+    failures = []
+    local = {row["workers"]: row for row in rows if row["mode"] == "local"}
+    for row in rows:
+        if row["mode"] != "sidecar":
+            continue
+        if row["heavy_modules"]:
+            failures.append(f"sidecar worker 加载了 {', '.join(row['heavy_modules'])}")
+        base = local.get(row["workers"])
+        if base is None:
+            continue
+        saving = base["worker_rss_mb"] - row["worker_rss_mb"]
+        print(f"--- 📉 {row['workers']} 个 worker: sidecar 每个 worker 少占 RSS {saving:.0f}MB ---")
+        if saving < min_saving_mb:
+            failures.append(f"{row['workers']} 个 worker 时 sidecar 只省下 {saving:.0f}MB RSS (要求 >= {min_saving_mb:.0f}MB)")
+    return failures
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,237 @@
+import os
+import sys
+import json
+import time
+import bisect
+import random
+import argparse
+import tempfile
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src.config import DATA_PATH, CHUNK_SIZE, CHUNK_OVERLAP
+from src.splitter import make_splitter, verse_spans
+
+# ==============================================================================
+# 切分器基准：对比 SentenceSplitter 与 ClassicalChineseSplitter 在经文上的
+#   - 吞吐：只切分 (split_text) 与完整父子两级建节点 (build_hierarchical_nodes) 的 MB/s；
+#   - 块质量：块数与平均长度、块尾落在句中的比例、偈颂被切断的比例、金标准片段被单个块完整覆盖的比例；
+#   - 检索召回 (--recall)：两种切分各建一个内存索引，用 bench_retrieval 的打分逻辑计算 recall@k / MRR。
+# 语料一律经 SimpleDirectoryReader 读入 (和建索引时一样带 file_path 等 metadata)；
+# 没有经文数据时用 --synthetic 生成散文夹偈颂的合成语料，写到和 CBETA 目录层级相同的临时目录再读回来。
+# ==============================================================================
+
+SENTENCE_ENDS = "。！？；」』”’）"
+_CHARS = "如是我闻一时佛在舍卫国祇树给孤独园与大比丘众千二百五十人俱尔时世尊食著衣持钵入城乞食菩萨摩诃萨应无所住而生其心色即是空空即是色受想行识亦复"
+
+
+def synthetic_corpus(mb: float, seed: int = 0) -> list:
+    """
+    合成经文：散文句 (长短不一的逗号分句) 与四句一首的五言/七言偈颂交替，每篇约 20 万字。
+    """
+    rng = random.Random(seed)
+    word = lambda n: "".join(rng.choice(_CHARS) for _ in range(n))
+    docs, total, target = [], 0, int(mb * 1024 * 1024 / 3)
+    while total < target:
+        parts = []
+        while sum(map(len, parts)) < 200_000:
+            if rng.random() < 0.2:
+                n = rng.choice((5, 7))
+                parts.append("尔时世尊而说偈言：\n")
+                for _ in range(rng.randint(1, 6)):
+                    parts.append(f"{word(n)}，{word(n)}；\n{word(n)}，{word(n)}。\n")
+            else:
+                clauses = [word(rng.randint(2, 14)) for _ in range(rng.randint(1, 6))]
+                parts.append("，".join(clauses) + rng.choice("。。。！？；") + ("\n" if rng.random() < 0.3 else ""))
+        docs.append("".join(parts))
+        total += len(docs[-1])
+    return docs
+
+
+def write_synthetic(mb: float, root: str) -> str:
+    """
+    把合成语料写成 CBETA 那样的多级目录 (路径长度与真实入库时相当)，返回数据目录。
+    """
+    data_dir = os.path.join(root, "data", "sutras", "cbeta-text-cleaned")
+    for i, text in enumerate(synthetic_corpus(mb)):
+        sub = os.path.join(data_dir, "T", f"T{i % 85 + 1:02d}")
+        os.makedirs(sub, exist_ok=True)
+        with open(os.path.join(sub, f"T{i:04d}_合成经文卷第{i + 1}.txt"), "w", encoding="utf-8") as f:
+            f.write(text)
+    return data_dir
+
+
+def load_documents(path: str, max_mb: float) -> list:
+    """
+    和 BuddhistRecursiveRetriever 建索引时相同的读取方式：SimpleDirectoryReader + 繁转简。
+    """
+    from llama_index.core import SimpleDirectoryReader
+    from src.utils import convert_to_simplified
+
+    files, total = [], 0
+    for root, _, names in sorted(os.walk(path)):
+        for name in sorted(names):
+            if name.endswith(".txt") and total < max_mb * 1024 * 1024:
+                files.append(os.path.join(root, name))
+                total += os.path.getsize(files[-1])
+    if not files:
+        return []
+    documents = SimpleDirectoryReader(input_files=files).load_data()
+    for doc in documents:
+        doc.set_content(convert_to_simplified(doc.get_content()))
+    return documents
+
+
+def contained(spans: list, start: int, end: int) -> bool:
+    """spans 按起点排序；是否有某个块完整包含 [start, end)。"""
+    i = bisect.bisect_right(spans, (start, float("inf")))
+    return any(s <= start and end <= e for s, e in spans[max(0, i - 8):i])
+
+
+def node_spans(nodes) -> list:
+    return sorted((n.start_char_idx, n.end_char_idx) for n in nodes if n.start_char_idx is not None)
+
+
+def measure(kind: str, documents: list, golds: list) -> dict:
+    from llama_index.core.schema import IndexNode
+    from src.retriever import build_hierarchical_nodes
+
+    parent = make_splitter(CHUNK_SIZE, CHUNK_OVERLAP, kind=kind)
+    child = make_splitter(128, 20, kind=kind)
+    docs = [d.get_content() for d in documents]
+    size_mb = sum(len(d.encode("utf-8")) for d in docs) / 1024 / 1024
+
+    start = time.perf_counter()
+    for text in docs:
+        parent.split_text(text)
+    split_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    nodes = build_hierarchical_nodes(documents, parent, child)
+    build_s = time.perf_counter() - start
+
+    parents = [n for n in nodes if not isinstance(n, IndexNode)]
+    children = [n for n in nodes if isinstance(n, IndexNode)]
+    by_doc = {}
+    for n in parents:
+        by_doc.setdefault(n.ref_doc_id, []).append(n)
+
+    # 块尾落在句中：块的最后一个字不是句末标点，且原文后面紧接着还有正文
+    mid_sentence = 0
+    verse_total = verse_cut = 0
+    for doc, text in zip(documents, docs):
+        spans = node_spans(by_doc.get(doc.doc_id, []))
+        for s, e in spans:
+            if e < len(text) and text[e - 1] not in SENTENCE_ENDS and not text[e].isspace():
+                mid_sentence += 1
+        for s, e in verse_spans(text):
+            if e - s <= CHUNK_SIZE // 2:
+                verse_total += 1
+                verse_cut += not contained(spans, s, e)
+
+    child_texts = ["".join(n.get_content().split()) for n in children]
+    parent_texts = ["".join(n.get_content().split()) for n in parents]
+    gold_child = sum(any(g in t for t in child_texts) for g in golds)
+    gold_parent = sum(any(g in t for t in parent_texts) for g in golds)
+
+    return {
+        "splitter": kind,
+        "corpus_mb": round(size_mb, 2),
+        "split_mb_per_s": round(size_mb / split_s, 2),
+        "build_mb_per_s": round(size_mb / build_s, 2),
+        "parents": len(parents),
+        "children": len(children),
+        "parent_mean_chars": round(sum(map(len, parent_texts)) / max(len(parents), 1), 1),
+        "child_mean_chars": round(sum(map(len, child_texts)) / max(len(children), 1), 1),
+        "parent_mid_sentence_ratio": round(mid_sentence / max(len(parents), 1), 4),
+        "stanzas": verse_total,
+        "stanza_cut_ratio": round(verse_cut / verse_total, 4) if verse_total else None,
+        "gold_in_one_child": round(gold_child / len(golds), 4) if golds else None,
+        "gold_in_one_parent": round(gold_parent / len(golds), 4) if golds else None,
+        "_nodes": nodes,
+    }
+
+
+def measure_recall(nodes: list, samples: list, ks: list, min_overlap: float) -> dict:
+    """
+    用和线上相同的父子索引结构建一个内存索引，按 bench_retrieval 的打分规则计算召回。
+    """
+    from llama_index.core import VectorStoreIndex, Settings
+    from llama_index.core.retrievers import RecursiveRetriever
+    from llama_index.embeddings.huggingface import HuggingFaceEmbedding
+    from src.config import get_device
+    from src.schema import RetrievedChunk
+    from bench_retrieval import score_query
+
+    Settings.embed_model = HuggingFaceEmbedding(model_name="BAAI/bge-small-zh-v1.5", device=get_device(), embed_batch_size=128)
+    Settings.llm = None
+    index = VectorStoreIndex(nodes)
+    retriever = RecursiveRetriever(
+        "vector",
+        retriever_dict={"vector": index.as_retriever(similarity_top_k=max(ks))},
+        node_dict={n.node_id: n for n in nodes},
+    )
+    per_query = []
+    for query, golds in samples:
+        chunks = [RetrievedChunk(n.node.node_id, n.node.get_content(), n.score or 0.0) for n in retriever.retrieve(query)]
+        per_query.append(score_query(golds, chunks, ks, min_overlap))
+    return {m: round(sum(q[m] for q in per_query) / len(per_query), 4) for m in per_query[0]} if per_query else {}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="对比 SentenceSplitter 与古籍切分器的吞吐、块质量与检索召回")
+    parser.add_argument("--data", default=DATA_PATH, help="经文目录 (递归读取 .txt)")
+    parser.add_argument("--max-mb", type=float, default=20.0, help="最多读取的语料大小")
+    parser.add_argument("--synthetic", type=float, default=0.0, help="改用合成语料 (MB)，不读取经文目录")
+    parser.add_argument("--splitters", default="sentence,classical")
+    parser.add_argument("--testset", default=None, help="标注文件 (同 bench_retrieval.py)，用于金标准覆盖率与召回")
+    parser.add_argument("--recall", action="store_true", help="建内存索引计算 recall@k (需要嵌入模型)")
+    parser.add_argument("--ks", default="1,3,5")
+    parser.add_argument("--min-overlap", type=float, default=0.6)
+    parser.add_argument("--output", default=None)
+    args = parser.parse_args()
+
+    tmp = tempfile.TemporaryDirectory() if args.synthetic else None
+    data_dir = write_synthetic(args.synthetic, tmp.name) if tmp else args.data
+    documents = load_documents(data_dir, args.max_mb if not tmp else float("inf"))
+    docs = [d.get_content() for d in documents]
+    if not docs:
+        print(f"--- ⚠️ {args.data} 下没有 .txt 经文，可以加 --synthetic 10 用合成语料 ---")
+        return
+
+    samples, golds = [], []
+    if args.testset:
+        from bench_retrieval import load_labelled_set, _normalize
+
+        samples = load_labelled_set(args.testset)
+        corpus = "".join("".join(d.split()) for d in docs)
+        # 只保留金标准确实出自本次语料的样本，否则召回与切分无关
+        samples = [(q, g) for q, g in samples if all(_normalize(x) in corpus for x in g)]
+        golds = [_normalize(x) for _, g in samples for x in g]
+        print(f"--- 📂 {len(samples)} 条标注查询的金标准落在本次语料中 ---")
+
+    ks = sorted(int(k) for k in args.ks.split(","))
+    print(f"--- 🧪 语料 {len(docs)} 篇，{sum(len(d.encode('utf-8')) for d in docs) / 1024 / 1024:.1f} MB ---")
+    report = {}
+    for kind in args.splitters.split(","):
+        row = measure(kind.strip(), documents, golds)
+        nodes = row.pop("_nodes")
+        if args.recall and samples:
+            row["recall"] = measure_recall(nodes, samples, ks, args.min_overlap)
+        report[row["splitter"]] = row
+        print(f"\n=== {row['splitter']} ===")
+        print(f"吞吐: 切分 {row['split_mb_per_s']} MB/s | 父子建节点 {row['build_mb_per_s']} MB/s")
+        print(f"父块 {row['parents']} 个 (平均 {row['parent_mean_chars']} 字) | 子块 {row['children']} 个 (平均 {row['child_mean_chars']} 字)")
+        print(f"父块尾落在句中: {row['parent_mid_sentence_ratio']:.1%} | 偈颂 {row['stanzas']} 首，被切断 {row['stanza_cut_ratio']}")
+        if golds:
+            print(f"金标准完整落在单个子块 {row['gold_in_one_child']:.1%} / 单个父块 {row['gold_in_one_parent']:.1%}")
+        if row.get("recall"):
+            print("召回: " + " | ".join(f"{k} {v:.3f}" for k, v in row["recall"].items()))
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"--- ✅ 结果已写入: {args.output} ---")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+import os
+import sys
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+from mock_llm_server import LatencyModel, start_in_background
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def run_batch(requests: int, concurrency: int, node: str):
+    from src.utils import get_deepseek_model
+    from src.resilience import LLMUnavailable
+
+    def one(i):
+        model = get_deepseek_model(temperature=0.1, node=node)
+        # 每个请求内容不同，避免被请求合并吃掉，单纯测对冲与超时
+        start = time.perf_counter()
+        try:
+            model.run([{"role": "user", "content": f"你是一名严格的阅卷员。第{i}题"}])
+            return time.perf_counter() - start, None
+        except LLMUnavailable as e:
+            return time.perf_counter() - start, type(e).__name__
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        return list(pool.map(one, range(requests)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="用注入慢尾的 Mock LLM 对比对冲开/关时的尾延迟")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--latency-ms", type=float, default=80)
+    parser.add_argument("--jitter-ms", type=float, default=40)
+    parser.add_argument("--slow-rate", type=float, default=0.03)
+    parser.add_argument("--slow-ms", type=float, default=2500)
+    args = parser.parse_args()
+
+    server, base_url = start_in_background(
+        latency=LatencyModel(args.latency_ms, args.jitter_ms, args.slow_rate, args.slow_ms)
+    )
+    os.environ["DEEPSEEK_BASE_URL"] = base_url
+    os.environ.setdefault("OPENAI_API_KEY", "mock-key")
+
+    from src import resilience
+    from src.stats import summarize
+
+    print(f"--- 🧪 Mock LLM: {base_url} | 慢尾 {args.slow_rate:.0%} × {args.slow_ms:.0f}ms ---")
+    for hedging in (False, True):
+        resilience.LLM_HEDGE_ENABLED = hedging
+        resilience.llm_caller.counters.clear()
+        # 先热身，让 p95 估计有足够样本
+        run_batch(resilience.LLM_HEDGE_MIN_SAMPLES, args.concurrency, "grade")
+        before = server.stats["requests"]
+        results = run_batch(args.requests, args.concurrency, "grade")
+        latencies = [r[0] * 1000 for r in results]
+        errors = sum(1 for r in results if r[1])
+        s = summarize(latencies)
+        print(f"\n=== 对冲{'开启' if hedging else '关闭'} ===")
+        print(f"p50 {s['p50']:.0f}ms | p95 {s['p95']:.0f}ms | p99 {s['p99']:.0f}ms | max {s['max']:.0f}ms | 失败 {errors}")
+        print(f"上游请求数 {server.stats['requests'] - before} (调用 {args.requests}) | {resilience.llm_caller.stats()}")
+
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
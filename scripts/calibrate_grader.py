@@ -0,0 +1,153 @@
+import os
+import sys
+import json
+import argparse
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src.config import GRADER_LOG_PATH, GRADER_THRESHOLDS_PATH, GRADER_AUDIT_RATE
+
+# ==============================================================================
+# 根据线上记录的 (检索最高分, LLM 评分) 离线标定 Grader 短路阈值，
+# 并在留出集上报告能省下多少次 LLM 评分、短路结论与 LLM 的一致率。
+# 日志里中间地带的请求全部有记录，短路区间只有抽查的那一小部分；统计时按记录的 weight
+# (= 1 / 抽查比例) 加权，还原成全部请求的分布，否则短路区间会被严重低估。
+# ==============================================================================
+
+
+def record_weight(record: dict) -> float:
+    """
+    这条记录代表的请求数。旧日志没有 weight 字段：审计样本 (带 shortcut) 按当前抽查比例还原，其余记 1。
+    """
+    if "weight" in record:
+        return float(record["weight"])
+    if record.get("shortcut") is not None and GRADER_AUDIT_RATE > 0:
+        return 1.0 / GRADER_AUDIT_RATE
+    return 1.0
+
+
+def load_records(path: str) -> list:
+    records = []
+    # 先读轮转出去的旧文件，再读当前文件
+    for p in (path + ".1", path):
+        if not os.path.exists(p):
+            continue
+        with open(p, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                record = json.loads(line)
+                if record.get("top_score") is not None and record.get("grade") in ("yes", "no"):
+                    record["weight"] = record_weight(record)
+                    records.append(record)
+    records.sort(key=lambda r: r["ts"])
+    return records
+
+
+def fit_high(records: list, precision: float, min_support: int) -> float:
+    """
+    找最低的 high，使得 top_score >= high 的样本里 LLM 判 yes 的加权比例不低于 precision。
+    min_support 按实际记录条数计，权重大的审计样本不能凭一两条撑起一个区间。
+    """
+    ordered = sorted(records, key=lambda r: r["top_score"], reverse=True)
+    best, yes, total = float("inf"), 0.0, 0.0
+    for i, record in enumerate(ordered, start=1):
+        yes += record["weight"] * (record["grade"] == "yes")
+        total += record["weight"]
+        # 同分的样本要一起纳入，阈值只能落在分数变化处
+        if i < len(ordered) and ordered[i]["top_score"] == record["top_score"]:
+            continue
+        if i >= min_support and yes / total >= precision:
+            best = record["top_score"]
+    return best
+
+
+def fit_low(records: list, precision: float, min_support: int) -> float:
+    """
+    找最高的 low，使得 top_score <= low 的样本里 LLM 判 no 的加权比例不低于 precision。
+    """
+    ordered = sorted(records, key=lambda r: r["top_score"])
+    best, no, total = float("-inf"), 0.0, 0.0
+    for i, record in enumerate(ordered, start=1):
+        no += record["weight"] * (record["grade"] == "no")
+        total += record["weight"]
+        if i < len(ordered) and ordered[i]["top_score"] == record["top_score"]:
+            continue
+        if i >= min_support and no / total >= precision:
+            best = record["top_score"]
+    return best
+
+
+def evaluate(records: list, high: float, low: float) -> dict:
+    """
+    各项比例都按 weight 加权，即估计的是全部请求 (含未被抽查的短路请求) 上的效果。
+    """
+    weight = lambda rows: sum(r["weight"] for r in rows)
+    shortcut_yes = [r for r in records if r["top_score"] >= high]
+    shortcut_no = [r for r in records if r["top_score"] <= low and r["top_score"] < high]
+    disagree = weight(r for r in shortcut_yes if r["grade"] != "yes") + weight(r for r in shortcut_no if r["grade"] != "no")
+    saved = weight(shortcut_yes) + weight(shortcut_no)
+    total = weight(records)
+    return {
+        "samples": len(records),
+        "weighted_requests": round(total, 1),
+        "saved_calls": round(saved, 1),
+        "saved_ratio": saved / total if total else 0.0,
+        "shortcut_yes": len(shortcut_yes),
+        "shortcut_no": len(shortcut_no),
+        "shortcut_agreement": 1 - disagree / saved if saved else 1.0,
+        # 以 LLM 评分为基准，整体判定一致率 (中间地带仍由 LLM 评分，视为一致)
+        "overall_agreement": 1 - disagree / total if total else 1.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="离线标定 Grader 的相似度短路阈值")
+    parser.add_argument("--log", default=GRADER_LOG_PATH)
+    parser.add_argument("--output", default=GRADER_THRESHOLDS_PATH)
+    parser.add_argument("--precision", type=float, default=0.95, help="短路区间内要求与 LLM 一致的比例")
+    parser.add_argument("--min-support", type=int, default=30, help="每个短路区间至少需要的样本数")
+    parser.add_argument("--holdout", type=float, default=0.3, help="按时间顺序留出最后这部分样本做评估")
+    args = parser.parse_args()
+
+    if not any(os.path.exists(p) for p in (args.log, args.log + ".1")):
+        print(f"❌ 找不到评分日志 {args.log}，请先在线上跑一段时间积累数据")
+        return
+
+    records = load_records(args.log)
+    split = int(len(records) * (1 - args.holdout))
+    train, test = records[:split], records[split:] or records
+    audits = sum(r.get("shortcut") is not None for r in records)
+    print(f"--- 📂 载入 {len(records)} 条 LLM 评分记录 (其中审计样本 {audits}，标定 {len(train)} / 评估 {len(test)}) ---")
+
+    high = fit_high(train, args.precision, args.min_support)
+    low = fit_low(train, args.precision, args.min_support)
+    if low >= high:
+        # 两个区间重叠说明得分区分度不够，宁可只保留高分短路
+        low = float("-inf")
+
+    report = evaluate(test, high, low)
+    print(f"--- 🎯 阈值: high={high} | low={low} ---")
+    print(f"--- 💰 留出集上可省 LLM 评分 {report['saved_calls']}/{report['weighted_requests']} 次 (按权重还原，{report['saved_ratio']:.1%}) ---")
+    print(f"--- ⚖️ 短路结论与 LLM 一致率 {report['shortcut_agreement']:.1%} | 整体一致率 {report['overall_agreement']:.1%} ---")
+
+    if os.path.dirname(args.output):
+        os.makedirs(os.path.dirname(args.output), exist_ok=True)
+    with open(args.output, "w", encoding="utf-8") as f:
+        # JSON 不支持 inf，未生效的阈值写成 null 再由 GradePolicy 回落为默认
+        json.dump(
+            {
+                "high": high if high != float("inf") else None,
+                "low": low if low != float("-inf") else None,
+                "precision": args.precision,
+                "report": report,
+            },
+            f,
+            ensure_ascii=False,
+            indent=2,
+        )
+    print(f"--- ✅ 阈值已写入: {args.output} ---")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,12 @@
 import os
 import sys
+import json
+import asyncio
+import hashlib
+import argparse
+import threading
 import pandas as pd
+from tqdm import tqdm
 import warnings
 from datasets import Dataset 
 from openai import OpenAI
@@ -28,13 +34,16 @@ warnings.filterwarnings("ignore", category=UserWarning, module="ragas")
 
 # --- 路径配置 ---
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from src.config import PERSIST_PATH, DEVICE
+from src.config import PERSIST_PATH, get_device
 from src.retriever import BuddhistRecursiveRetriever
-from src.agents import get_buddhist_master_response 
+from src.agents import get_buddhist_master_response
+from src.prompts import MASTER_PROMPT_VERSION
 
 # 配置输入输出路径
 TESTSET_PATH = "./testdata/dharma_db_testset.csv" # 使用我们刚才生成的中文测试集
 OUTPUT_REPORT = "./testdata/evaluation_report.csv"
+ANSWER_CACHE_PATH = "./testdata/answer_cache.jsonl" # 生成结果缓存，断点续跑与增量重跑都靠它
+OUTPUT_SUMMARY = "./testdata/evaluation_summary.json" # 本次参评 / 生成失败的题数，不同批次对比时先看这里
 # ==============================================================================
 # 🛠️ 临时补丁：定义一个直连 Chroma 的检索器
 # ==============================================================================
@@ -47,7 +56,7 @@ class DirectChromaRetriever:
         # 如果你入库时用的是 BAAI/bge-small-zh-v1.5，这里必须一样
         self.embedding_func = LangChainHFEmbeddings(
             model_name="BAAI/bge-small-zh-v1.5",
-            model_kwargs={'device': DEVICE}
+            model_kwargs={'device': get_device()}
         )
         
         # 2. 连接到现有的 Chroma (只读模式)
@@ -66,6 +75,65 @@ class DirectChromaRetriever:
         # 拼接内容
         context_str = "\n\n".join([d.page_content for d in docs])
         return context_str
+
+    def query_batch(self, questions: list, k=3, batch_size=64) -> list:
+        """
+        批量检索：整批问题一次性做 Embedding (这是检索里最慢的一步)，再逐条查向量库。
+        bge 的 query / document 向量化方式一致，所以 embed_documents 与逐条 similarity_search 结果相同。
+        """
+        contexts = []
+        for i in tqdm(range(0, len(questions), batch_size), desc="批量检索"):
+            vectors = self.embedding_func.embed_documents(questions[i:i + batch_size])
+            for vector in vectors:
+                docs = self.vectorstore.similarity_search_by_vector(vector, k=k)
+                contexts.append("\n\n".join([d.page_content for d in docs]))
+        return contexts
+
+
+# ==============================================================================
+# 🗄️ 生成结果缓存：key = (问题, 上下文哈希, 提示词版本)
+# ==============================================================================
+class AnswerCache:
+    """
+    追加写的 JSONL 缓存。每生成一条就落盘一条，中途中断后重跑会自动跳过已完成的题目；
+    问题、检索上下文或提示词版本任一变化，key 就会变化，只重算受影响的题目。
+    """
+
+    def __init__(self, path: str, enabled: bool = True):
+        self.path = path
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._data = {}
+        if enabled and os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue  # 上次中断时写了半行
+                    self._data[record["key"]] = record["answer"]
+
+    @staticmethod
+    def make_key(question: str, context: str) -> str:
+        context_hash = hashlib.sha256(context.encode("utf-8")).hexdigest()
+        raw = json.dumps([question, context_hash, MASTER_PROMPT_VERSION], ensure_ascii=False)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key: str):
+        return self._data.get(key)
+
+    def put(self, key: str, answer: str):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._data[key] = answer
+            if os.path.dirname(self.path):
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps({"key": key, "answer": answer}, ensure_ascii=False) + "\n")
+
+    def __len__(self):
+        return len(self._data)
     
 # ==============================================================================
 # 1. 定义 RAG 交互逻辑 (让法师参加考试)
@@ -82,16 +150,64 @@ def call_agent(question, context):
     )
     return response
 
+async def generate_answers(questions: list, contexts: list, cache: AnswerCache, workers: int) -> list:
+    """
+    有界的异步工作池：最多 workers 道题同时生成，命中缓存的题目直接跳过。
+    法师 Agent 是同步调用，放进线程里跑；进程级的并发上限与限流仍由 src.resilience 统一把关。
+    生成失败的题目返回 None (不是空回答)，由调用方剔除后再交给裁判。
+    """
+    answers = [None] * len(questions)
+    todo = []
+    for i, (question, context) in enumerate(zip(questions, contexts)):
+        key = AnswerCache.make_key(question, context)
+        cached = cache.get(key)
+        if cached is not None:
+            answers[i] = cached
+        else:
+            todo.append((i, key))
+    print(f"--- 🗄️ 缓存命中 {len(questions) - len(todo)} 题，需要生成 {len(todo)} 题 (并发 {workers}) ---")
+
+    semaphore = asyncio.Semaphore(workers)
+    progress = tqdm(total=len(todo), desc="生成回答")
+    failures = 0
+
+    async def worker(i, key):
+        nonlocal failures
+        async with semaphore:
+            try:
+                answer = await asyncio.to_thread(call_agent, questions[i], contexts[i])
+                cache.put(key, answer)
+            except Exception as e:
+                # 失败的题目不写缓存，下次重跑会自动补上
+                failures += 1
+                answer = None
+                tqdm.write(f"--- ⚠️ 第 {i} 题生成失败: {e} ---")
+            answers[i] = answer
+            progress.update(1)
+
+    await asyncio.gather(*(worker(i, key) for i, key in todo))
+    progress.close()
+    if failures:
+        print(f"--- ⚠️ {failures} 题生成失败，不参与评分，重跑即可续上 ---")
+    return answers
+
+
 # ==============================================================================
 # 2. 核心评估主程序
 # ==============================================================================
-def run_evaluation():
+def run_evaluation(workers: int = 16, limit: int = None, use_cache: bool = True, judge_workers: int = 5,
+                   max_failure_rate: float = 0.05):
     if not os.path.exists(TESTSET_PATH):
         print(f"❌ 找不到测试集 {TESTSET_PATH}")
         return
 
     test_df = pd.read_csv(TESTSET_PATH)
+    if limit:
+        test_df = test_df.head(limit)
     print(f"--- 📂 加载测试集成功，共 {len(test_df)} 题 ---")
+    if test_df.empty:
+        print("❌ 测试集里没有题目，本次不评分")
+        return
 
     # ✅ 关键修改：使用上面的 DirectChromaRetriever 替代 BuddhistRecursiveRetriever
     # 这样就不会去读那个不存在的 json 文件了
@@ -103,28 +219,42 @@ def run_evaluation():
         return
 
     print("--- 🚀 开始应试... ---")
+    questions = test_df['user_input'].tolist()
     
-    answers = []
-    contexts = []
+    # 1. 检索 (使用的是子文档切片，而非完整父文档)
+    # 虽然这会导致上下文变短，但足够跑通评估流程；整批一次性检索
+    raw_contexts = retriever.query_batch(questions)
     
-    for idx, row in test_df.iterrows():
-        question = row['user_input']
-        
-        # 1. 检索 (使用的是子文档切片，而非完整父文档)
-        # 虽然这会导致上下文变短，但足够跑通评估流程
-        raw_context = retriever.query(question)
-        
-        # 2. 生成
-        answer = call_agent(question, raw_context)
-        
-        answers.append(answer)
-        contexts.append([raw_context])
+    # 2. 生成 (并发 + 缓存 + 断点续跑)
+    cache = AnswerCache(ANSWER_CACHE_PATH, enabled=use_cache)
+    answers = asyncio.run(generate_answers(questions, raw_contexts, cache, workers))
+
+    # 生成失败的题目不能当作零分回答送去评分：剔除并计数，失败太多则整批作废
+    kept = [i for i, answer in enumerate(answers) if answer is not None]
+    failed = len(answers) - len(kept)
+    summary = {
+        "total": len(answers),
+        "evaluated": len(kept),
+        "generation_failures": failed,
+        "failed_questions": [questions[i] for i, answer in enumerate(answers) if answer is None],
+    }
+    os.makedirs(os.path.dirname(OUTPUT_SUMMARY), exist_ok=True)
+    with open(OUTPUT_SUMMARY, "w", encoding="utf-8") as f:
+        json.dump(summary, f, ensure_ascii=False, indent=2)
+    print(f"--- 📊 参评 {len(kept)} 题，生成失败 {failed} 题 (已剔除，明细见 {OUTPUT_SUMMARY}) ---")
+    if not answers:
+        print("❌ 没有生成任何回答，本次不评分")
+        return
+    if not kept or failed / len(answers) > max_failure_rate:
+        print(f"❌ 生成失败率 {failed / len(answers):.1%} 超过上限 {max_failure_rate:.1%}，本次不评分，请重跑补齐")
+        return
 
+    references = test_df['reference'].tolist()
     ragas_data = {
-        'question': test_df['user_input'].tolist(),  # 👈 映射 user_input -> question
-        'answer': answers,
-        'contexts': contexts,
-        'ground_truth': test_df['reference'].tolist() # 👈 映射 reference -> ground_truth
+        'question': [questions[i] for i in kept],  # 👈 映射 user_input -> question
+        'answer': [answers[i] for i in kept],
+        'contexts': [[raw_contexts[i]] for i in kept],
+        'ground_truth': [references[i] for i in kept] # 👈 映射 reference -> ground_truth
     }
     ragas_dataset = Dataset.from_dict(ragas_data)
 
@@ -144,7 +274,7 @@ def run_evaluation():
 
     judge_embeddings = LangChainHFEmbeddings(
         model="BAAI/bge-small-zh-v1.5",
-        model_kwargs={'device': DEVICE}
+        model_kwargs={'device': get_device()}
     )
 
     metrics = [
@@ -155,7 +285,7 @@ def run_evaluation():
     ]
 
     print("--- 📝 开始评分... ---")
-    run_config = RunConfig(max_workers=5, timeout=180, max_retries=3)
+    run_config = RunConfig(max_workers=judge_workers, timeout=180, max_retries=3)
 
     results = evaluate(
         dataset=ragas_dataset,
@@ -167,8 +297,16 @@ def run_evaluation():
 
     print("\n🏆 评估完成 🏆")
     results.to_pandas().to_csv(OUTPUT_REPORT, index=False, encoding="utf-8-sig")
-    print(f"--- ✅ 报告保存: {OUTPUT_REPORT} ---")
+    print(f"--- ✅ 报告保存: {OUTPUT_REPORT} (参评 {len(kept)} / {len(answers)} 题，生成失败 {failed} 题) ---")
 
 if __name__ == "__main__":
-    run_evaluation()
+    parser = argparse.ArgumentParser(description="并发 + 缓存的 Ragas 评估")
+    parser.add_argument("--workers", type=int, default=16, help="同时生成回答的题目数")
+    parser.add_argument("--judge-workers", type=int, default=5, help="Ragas 裁判的并发数")
+    parser.add_argument("--limit", type=int, default=None, help="只评估前 N 题")
+    parser.add_argument("--no-cache", action="store_true", help="忽略并且不写入生成缓存")
+    parser.add_argument("--max-failure-rate", type=float, default=0.05,
+                        help="生成失败的题目占比超过该值则不评分 (失败题总是剔除，不按零分计)")
+    args = parser.parse_args()
+    run_evaluation(args.workers, args.limit, not args.no_cache, args.judge_workers, args.max_failure_rate)
 
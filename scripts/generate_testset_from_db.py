@@ -1,82 +1,332 @@
 import os
+import sys
+import time
 import random
-import pandas as pd
+import hashlib
+import argparse
+import multiprocessing as mp
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
 import chromadb
-from openai import OpenAI
-from ragas.llms import llm_factory
-from ragas.embeddings import HuggingFaceEmbeddings
-# from ragas.embeddings import embedding_factory
-# from ragas import Document as RagasDocument
-from langchain_core.documents import Document as RagasDocument
-from ragas.testset import TestsetGenerator
-from ragas.run_config import RunConfig
 
-import sys
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from src.config import PERSIST_PATH, DEVICE
+from src.config import PERSIST_PATH, DATA_PATH, get_device
+
+# ==============================================================================
+# 从向量库采样经文块，用 Ragas 生成测试集。
+# - 采样：按 offset / limit 分页扫描集合 (只取 ID，分层时再带上元数据)，蓄水池抽样，
+#   选中的块再按 ID 取回原文。内存只和样本量有关，与库的大小无关。
+# - 分层：按部类 (元数据里的 category，没有时取 file_path 在数据目录下的第一级目录) 分配样本。
+# - 并行：样本切成若干分片，每个分片一个进程、一个由 (seed, 分片号) 派生的种子，
+#   分片结果单独落盘，中断后重跑只补未完成的分片，最后按分片号顺序合并。
+# 同一个库、同样的 seed 和参数，抽到的块和分片划分完全一致 (LLM 的输出本身仍有随机性)。
+# ==============================================================================
+
+COLLECTION_NAME = "buddhist_sutras"
+OUTPUT_PATH = "./testdata/dharma_db_testset.csv"
+SHARD_DIR = "./testdata/testset_shards"
+UNCATEGORIZED = "未分类"
+
+
+def derive_seed(seed: int, *parts) -> int:
+    raw = ":".join(str(p) for p in (seed, *parts))
+    return int.from_bytes(hashlib.sha256(raw.encode("utf-8")).digest()[:8], "big")
+
+
+def iter_pages(collection, page_size: int = 1000, include=()):
+    """
+    按 offset / limit 分页读取集合，每次只有一页在内存里。
+    """
+    offset = 0
+    while True:
+        page = collection.get(limit=page_size, offset=offset, include=list(include))
+        if not page["ids"]:
+            return
+        yield page
+        offset += len(page["ids"])
+
+
+def category_of(metadata: dict, key: str = "category", data_root: str = DATA_PATH) -> str:
+    """
+    部类：优先取元数据里的 key；入库时没有写的话，由 file_path 在数据目录下的第一级目录推出。
+    """
+    metadata = metadata or {}
+    if metadata.get(key):
+        return str(metadata[key])
+    file_path = metadata.get("file_path")
+    if file_path:
+        rel = os.path.relpath(os.path.abspath(file_path), os.path.abspath(data_root))
+        if not rel.startswith(".."):
+            head = rel.split(os.sep)[0]
+            if head != os.path.basename(rel):
+                return head
+    return UNCATEGORIZED
+
+
+class Reservoir:
+    """
+    蓄水池抽样 (Algorithm R)：流式看过任意多个元素后，保留的 k 个是等概率的简单随机样本。
+    """
+
+    def __init__(self, k: int, rng: random.Random):
+        self.k = k
+        self.rng = rng
+        self.seen = 0
+        self.items = []
+
+    def add(self, item):
+        self.seen += 1
+        if len(self.items) < self.k:
+            self.items.append(item)
+        else:
+            j = self.rng.randrange(self.seen)
+            if j < self.k:
+                self.items[j] = item
+
+
+def allocate(counts: dict, n: int, mode: str = "proportional") -> dict:
+    """
+    把 n 个样本分给各层：proportional 按层大小比例 (最大余数法)，equal 各层均分；
+    都不超过该层的实际数量，分不完的名额依次补给还有余量的层。
+    """
+    total = sum(counts.values())
+    n = min(n, total)
+    keys = sorted(counts)
+    if mode == "equal":
+        quotas = {k: n / len(keys) for k in keys}
+    else:
+        quotas = {k: n * counts[k] / total for k in keys}
+
+    alloc = {k: min(int(quotas[k]), counts[k]) for k in keys}
+    by_remainder = sorted(keys, key=lambda k: (-(quotas[k] - int(quotas[k])), k))
+    while sum(alloc.values()) < n:
+        progressed = False
+        for k in by_remainder:
+            if sum(alloc.values()) >= n:
+                break
+            if alloc[k] < counts[k]:
+                alloc[k] += 1
+                progressed = True
+        if not progressed:
+            break
+    return alloc
+
+
+def sample_ids(collection, n: int, seed: int = 42, stratify_key: str = None,
+               allocation: str = "proportional", page_size: int = 1000):
+    """
+    返回 (抽中的 ID 列表, 各层总数)。不分层时只读 ID；分层时每层各留一个容量为 n 的蓄水池
+    (任何分配方案下单层都不会超过 n)，扫描完再按各层总数分配名额、从蓄水池里取。
+    """
+    rng = random.Random(seed)
+    include = ("metadatas",) if stratify_key else ()
+    reservoirs = {}
+    for page in iter_pages(collection, page_size, include):
+        metadatas = page.get("metadatas") or [None] * len(page["ids"])
+        for node_id, metadata in zip(page["ids"], metadatas):
+            stratum = category_of(metadata, stratify_key) if stratify_key else "all"
+            if stratum not in reservoirs:
+                reservoirs[stratum] = Reservoir(n, random.Random(derive_seed(seed, stratum)))
+            reservoirs[stratum].add(node_id)
+
+    counts = {k: r.seen for k, r in reservoirs.items()}
+    if not counts:
+        return [], counts
+    ids = []
+    for stratum, quota in allocate(counts, n, allocation).items():
+        ids.extend(reservoirs[stratum].items[:quota])
+    rng.shuffle(ids)
+    return ids, counts
+
+
+def load_chunks(collection, ids: list, max_chars: int = 800, batch_size: int = 500) -> list:
+    """
+    按 ID 取回原文，保持 ids 的顺序。llama-index 写进元数据的内部字段 (以 _ 开头，含整段节点 JSON) 去掉。
+    """
+    chunks = {}
+    for i in range(0, len(ids), batch_size):
+        page = collection.get(ids=ids[i:i + batch_size], include=["documents", "metadatas"])
+        for node_id, text, metadata in zip(page["ids"], page["documents"], page["metadatas"]):
+            clean = {k: v for k, v in (metadata or {}).items() if not k.startswith("_")}
+            chunks[node_id] = {"id": node_id, "text": (text or "")[:max_chars], "metadata": clean}
+    return [chunks[i] for i in ids if i in chunks]
+
+
+def shard_tag(collection, chunks: list, *params) -> str:
+    """
+    分片缓存目录名：生成参数之外还要带上库路径、集合名、集合大小和抽中块的内容摘要，
+    换库、重建索引或块内容变了都会换一个目录，不会把旧库生成的分片当成已完成。
+    """
+    digest = hashlib.sha256()
+    for c in chunks:
+        digest.update(f"{c['id']}\0{c['text']}\0".encode("utf-8"))
+    identity = f"{os.path.abspath(PERSIST_PATH)}:{collection.name}:{collection.count()}:{digest.hexdigest()}"
+    return hashlib.sha256(":".join(map(str, (identity, *params))).encode("utf-8")).hexdigest()[:10]
+
+
+def split_sizes(total: int, parts: int) -> list:
+    base, extra = divmod(total, parts)
+    return [base + (1 if i < extra else 0) for i in range(parts)]
+
+
+def build_generator():
+    from openai import OpenAI
+    from ragas.llms import llm_factory
+    from ragas.embeddings import HuggingFaceEmbeddings
+    from ragas.testset import TestsetGenerator
 
-def generate_from_db():
-    print(f"--- 🔌 正在连接数据库: {PERSIST_PATH} ---")
-    db_client = chromadb.PersistentClient(path=PERSIST_PATH)
-    collection = db_client.get_collection("buddhist_sutras")
-    
-    # 1. 采样并转换为 Ragas Chunks
-    all_data = collection.get()
-    sample_indices = random.sample(range(len(all_data['documents'])), min(30, len(all_data['documents'])))
-    
-    chunks = [
-        RagasDocument(
-            page_content=all_data['documents'][idx][:800], 
-            metadata=all_data['metadatas'][idx]
-        ) for idx in sample_indices
-    ]
-
-    # 2. ✅ 使用 2026 现代工厂模式初始化 LLM
     # 直接使用原生 OpenAI 客户端对接 DeepSeek，绕过所有框架层校验
     openai_client = OpenAI(
         api_key=os.getenv("OPENAI_API_KEY"),
         base_url="https://api.deepseek.com/v1",
         timeout=60.0, # 增加超时时间到 60 秒
         max_retries=3  # 增加自动重试次数
-        
     )
-    
+
     # llm_factory 会自动处理模型协议并注入 Ragas
     modern_llm = llm_factory(
-        model='deepseek-chat', 
+        model='deepseek-chat',
         client=openai_client,
         system_prompt="请用简体中文生成测试题，保持学术风格。"
     )
-    
-    run_config = RunConfig(
-        max_workers=8,       # 同时进行的 API 调用数
-        timeout=180,         # 总任务超时
-        max_retries=5        # Ragas 内部重试次数
-    )
 
-    # 3. ✅ 使用现代工厂模式初始化 Embedding
     # Ragas 现在推荐直接通过名称或工厂方法加载本地模型
     modern_embeddings = HuggingFaceEmbeddings(
         model="BAAI/bge-small-zh-v1.5"
-        # model_kwargs={'device': DEVICE}
+        # model_kwargs={'device': get_device()}
     )
+    return TestsetGenerator(llm=modern_llm, embedding_model=modern_embeddings)
 
-    # 4. 初始化生成器
-    generator = TestsetGenerator(
-        llm=modern_llm,
-        embedding_model=modern_embeddings
-    )
 
-    print("--- 🚀 正在生成测试集 (使用 0.4.3+ 知识图谱范式) ---")
-    # ✅ 最终的方法名确定为 generate_with_chunks
-    testset = generator.generate_with_chunks(
-        chunks=chunks,
-        testset_size=10,
+def generate_shard(shard: int, chunks: list, testset_size: int, seed: int, out_path: str, max_workers: int = 8) -> str:
+    """
+    在独立进程里生成一个分片：进程内的全局随机源都用分片种子初始化，Ragas 的场景抽样因此可复现。
+    """
+    import numpy as np
+    from langchain_core.documents import Document as RagasDocument
+    from ragas.run_config import RunConfig
+
+    random.seed(seed)
+    np.random.seed(seed % 2 ** 32)
+
+    documents = [RagasDocument(page_content=c["text"], metadata={**c["metadata"], "node_id": c["id"]}) for c in chunks]
+    run_config = RunConfig(
+        max_workers=max_workers,  # 同时进行的 API 调用数
+        timeout=180,              # 总任务超时
+        max_retries=5,            # Ragas 内部重试次数
+        seed=seed % 2 ** 32,
+    )
+    testset = build_generator().generate_with_chunks(
+        chunks=documents,
+        testset_size=testset_size,
         run_config=run_config
     )
 
-    testset.to_pandas().to_csv("./testdata/dharma_db_testset.csv", index=False, encoding="utf-8-sig")
-    print("--- ✅ 生成成功：dharma_db_testset.csv ---")
+    df = testset.to_pandas()
+    df["shard"] = shard
+    tmp_path = out_path + ".tmp"
+    df.to_csv(tmp_path, index=False, encoding="utf-8-sig")
+    os.replace(tmp_path, out_path)  # 写完再改名，半截文件不会被当成已完成
+    return out_path
+
+
+def generate_from_db(testset_size: int = 10, sample_size: int = 30, seed: int = 42, stratify_key: str = None,
+                     allocation: str = "proportional", workers: int = 1, shard_chunks: int = 30,
+                     page_size: int = 1000, output: str = OUTPUT_PATH, dry_run: bool = False, max_shards: int = None):
+    print(f"--- 🔌 正在连接数据库: {PERSIST_PATH} ---")
+    db_client = chromadb.PersistentClient(path=PERSIST_PATH)
+    collection = db_client.get_collection(COLLECTION_NAME)
+
+    # 1. 分页扫描 + 蓄水池抽样，只把抽中的块取回来
+    start = time.perf_counter()
+    ids, counts = sample_ids(collection, sample_size, seed, stratify_key, allocation, page_size)
+    chunks = load_chunks(collection, ids)
+    picked = Counter(category_of(c["metadata"], stratify_key) for c in chunks) if stratify_key else None
+    print(f"--- 🎲 从 {sum(counts.values())} 个块中抽取 {len(chunks)} 个，用时 {time.perf_counter() - start:.1f}s ---")
+    if picked:
+        for stratum in sorted(counts):
+            print(f"    {stratum:<16} 库内 {counts[stratum]:>8} | 抽中 {picked.get(stratum, 0):>5}")
+    if dry_run or not chunks:
+        return chunks
+
+    # 2. 切分片：块数和题量都按分片均分，分片种子由 (seed, 分片号) 派生
+    num_shards = max(1, -(-len(chunks) // shard_chunks))
+    sizes = split_sizes(testset_size, num_shards)
+    tag = shard_tag(collection, chunks, seed, stratify_key, allocation, sample_size, testset_size, shard_chunks)
+    shard_dir = os.path.join(SHARD_DIR, tag)
+    os.makedirs(shard_dir, exist_ok=True)
+
+    jobs = []
+    for shard, size in enumerate(sizes):
+        out_path = os.path.join(shard_dir, f"shard-{shard:04d}.csv")
+        if size == 0 or os.path.exists(out_path):
+            continue
+        shard_chunk_list = chunks[shard * shard_chunks:(shard + 1) * shard_chunks]
+        jobs.append((shard, shard_chunk_list, size, derive_seed(seed, "shard", shard), out_path))
+    if max_shards is not None:
+        jobs = jobs[:max_shards]  # 试跑：只补前几个未完成的分片，其余留给下次
+    print(f"--- 🚀 正在生成测试集: {testset_size} 题 / {num_shards} 个分片 (待生成 {len(jobs)})，{workers} 个进程 ---")
+
+    # 3. 分片并行生成 (spawn：每个进程干净地初始化模型和随机源)
+    if workers > 1 and len(jobs) > 1:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=mp.get_context("spawn")) as pool:
+            futures = {pool.submit(generate_shard, *job): job[0] for job in jobs}
+            for future in futures:
+                try:
+                    future.result()
+                    print(f"--- ✅ 分片 {futures[future]} 完成 ---")
+                except Exception as e:
+                    print(f"--- ❌ 分片 {futures[future]} 失败: {e} (重跑会只补这些分片) ---")
+    else:
+        for job in jobs:
+            generate_shard(*job)
+            print(f"--- ✅ 分片 {job[0]} 完成 ---")
+
+    # 4. 按分片号合并
+    import pandas as pd
+    paths = [os.path.join(shard_dir, f"shard-{shard:04d}.csv") for shard, size in enumerate(sizes) if size]
+    done = [p for p in paths if os.path.exists(p)]
+    if len(done) < len(paths):
+        print(f"--- ⚠️ 还有 {len(paths) - len(done)} 个分片未完成，先合并已有结果 ---")
+    if not done:
+        return chunks
+    pd.concat([pd.read_csv(p) for p in done], ignore_index=True).to_csv(output, index=False, encoding="utf-8-sig")
+    print(f"--- ✅ 生成成功：{output} ---")
+    return chunks
+
+
+def main():
+    parser = argparse.ArgumentParser(description="从向量库分层采样经文块并生成 Ragas 测试集")
+    parser.add_argument("--size", type=int, default=10, help="测试题总数")
+    parser.add_argument("--sample", type=int, default=30, help="采样的经文块数")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--stratify", nargs="?", const="category", default=None,
+                        help="按部类分层 (可指定元数据字段，默认 category，缺失时由 file_path 推出)")
+    parser.add_argument("--allocation", choices=["proportional", "equal"], default="proportional",
+                        help="分层名额：按部类大小比例，或各部类均分")
+    parser.add_argument("--workers", type=int, default=1, help="并行生成的进程数")
+    parser.add_argument("--shard-chunks", type=int, default=30, help="每个分片的经文块数")
+    parser.add_argument("--page-size", type=int, default=1000, help="扫描集合时每页的条数")
+    parser.add_argument("--output", default=OUTPUT_PATH)
+    parser.add_argument("--dry-run", action="store_true", help="只采样并打印分布，不调用 LLM")
+    parser.add_argument("--max-shards", type=int, default=None, help="本次最多生成的分片数 (试跑用，已完成的分片不计)")
+    args = parser.parse_args()
+
+    generate_from_db(
+        testset_size=args.size,
+        sample_size=args.sample,
+        seed=args.seed,
+        stratify_key=args.stratify,
+        allocation=args.allocation,
+        workers=args.workers,
+        shard_chunks=args.shard_chunks,
+        page_size=args.page_size,
+        output=args.output,
+        dry_run=args.dry_run,
+        max_shards=args.max_shards,
+    )
+
 
 if __name__ == "__main__":
-    generate_from_db()
\ No newline at end of file
+    main()
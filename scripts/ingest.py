@@ -1,4 +1,5 @@
 import os
+import sys
 import torch
 import chromadb
 from tqdm import tqdm
@@ -6,6 +7,9 @@ from llama_index.core import SimpleDirectoryReader, VectorStoreIndex, Settings,
 from llama_index.embeddings.huggingface import HuggingFaceEmbedding
 from llama_index.vector_stores.chroma import ChromaVectorStore
 
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src.splitter import make_splitter, exclude_path_metadata
+
 # --- 配置 ---
 CLEANED_DATA_PATH = "./data/sutras/cbeta-text-cleaned"
 CHROMA_DB_PATH = "./chroma_db"
@@ -20,7 +24,8 @@ def init_settings():
         embed_batch_size=128
     )
     Settings.llm = None
-    Settings.chunk_size = 1024
+    # 古籍切分器：按 。！？； 与偈颂断句，按字符计长度，不跑 tiktoken (ZENGRAPH_SPLITTER=sentence 可切回原生切分)
+    Settings.node_parser = make_splitter(chunk_size=1024, chunk_overlap=200)
 
 def run_ingest():
     init_settings()
@@ -58,7 +63,7 @@ def run_ingest():
         
         # 加载这 100 个文件
         reader = SimpleDirectoryReader(input_files=batch)
-        documents = reader.load_data()
+        documents = exclude_path_metadata(reader.load_data())
         
         # 逐个插入并记录日志
         for doc in documents:
@@ -0,0 +1,309 @@
+import json
+import math
+import hashlib
+import time
+import random
+import argparse
+import itertools
+import threading
+from collections import OrderedDict, defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# ==============================================================================
+# 本地 OpenAI 兼容 Mock 服务：只实现 /v1/chat/completions (含 stream=true 的 SSE)，
+# 用于在不花 DeepSeek 额度的前提下压测整张图。把 DEEPSEEK_BASE_URL 指向 http://127.0.0.1:<port>/v1 即可。
+#
+# - 按提示词特征识别调用方 (router / grader / contextualize / hyde / summary / answer)；
+# - 每类调用可以配置独立的延迟分布，以及按顺序循环输出的脚本 (强制走某条图路径)；
+# - 模拟 DeepSeek 的前缀缓存，在 usage 里返回 prompt_cache_hit_tokens / prompt_cache_miss_tokens。
+# ==============================================================================
+
+KINDS = ("router", "grader", "contextualize", "hyde", "summary", "answer")
+
+DEFAULT_OUTPUTS = {
+    "router": "hyde",
+    "grader": "yes",
+    "contextualize": "如何克服焦虑？",
+    "hyde": "诸行无常，因缘和合而生，缘散则灭。放下执着，般若自现。",
+    "summary": "信众为焦虑所困，法师劝其观照当下。",
+    "answer": "阿弥陀佛，施主。心随境转是凡夫，境随心转是圣贤。",
+}
+
+
+def classify(messages) -> str:
+    """
+    按提示词里的特征词猜出是哪个节点在调用。
+    """
+    prompt = "\n".join(str(m.get("content", "")) for m in messages)
+    if "严格从以下三个选项" in prompt:
+        return "router"
+    if "阅卷员" in prompt:
+        return "grader"
+    if "重写为一个独立、完整的问句" in prompt:
+        return "contextualize"
+    if "相似性检索" in prompt:
+        return "hyde"
+    if "对话记录员" in prompt:
+        return "summary"
+    return "answer"
+
+
+class LatencyModel:
+    """
+    注入延迟 (毫秒)：
+    - fixed     : 恒为 base_ms
+    - uniform   : base_ms + U(0, jitter_ms)
+    - lognormal : 中位数为 base_ms、形状参数为 sigma 的对数正态
+    另有 slow_rate 的概率落入慢尾 (slow_ms)。
+    """
+
+    def __init__(self, base_ms: float = 50, jitter_ms: float = 0, slow_rate: float = 0.0, slow_ms: float = 0,
+                 dist: str = "uniform", sigma: float = 0.5):
+        self.base_ms = base_ms
+        self.jitter_ms = jitter_ms
+        self.slow_rate = slow_rate
+        self.slow_ms = slow_ms
+        self.dist = dist
+        self.sigma = sigma
+
+    @classmethod
+    def from_spec(cls, spec: dict):
+        return cls(
+            base_ms=spec.get("base_ms", 50),
+            jitter_ms=spec.get("jitter_ms", 0),
+            slow_rate=spec.get("slow_rate", 0.0),
+            slow_ms=spec.get("slow_ms", 0),
+            dist=spec.get("dist", "uniform"),
+            sigma=spec.get("sigma", 0.5),
+        )
+
+    def sample(self) -> float:
+        if self.slow_rate and random.random() < self.slow_rate:
+            return self.slow_ms / 1000
+        if self.dist == "fixed":
+            return self.base_ms / 1000
+        if self.dist == "lognormal":
+            return self.base_ms * math.exp(random.gauss(0, self.sigma)) / 1000
+        return (self.base_ms + random.uniform(0, self.jitter_ms)) / 1000
+
+
+class PrefixCache:
+    """
+    前缀缓存模拟：消息按顺序拼接后 (一个字符记一个 token，与下面的 usage 口径一致) 切成 block 大小的块，
+    每个块的键是“它之前整个前缀”的链式哈希。只有从头开始连续命中的块才算缓存命中，和 DeepSeek 的规则一致。
+    """
+
+    def __init__(self, block: int = 64, capacity: int = 200000):
+        self.block = block
+        self.capacity = capacity
+        self._keys = OrderedDict()
+        self._lock = threading.Lock()
+
+    def lookup(self, messages) -> int:
+        text = "".join(f"<{m.get('role')}>{m.get('content', '')}" for m in messages)
+        digest, keys = b"", []
+        for i in range(self.block, len(text) + 1, self.block):
+            digest = hashlib.blake2b(digest + text[i - self.block:i].encode("utf-8"), digest_size=16).digest()
+            keys.append(digest)
+
+        with self._lock:
+            hit = 0
+            for key in keys:
+                if key not in self._keys:
+                    break
+                hit += 1
+            for key in keys:
+                self._keys[key] = True
+                self._keys.move_to_end(key)
+            while len(self._keys) > self.capacity:
+                self._keys.popitem(last=False)
+        return hit * self.block
+
+
+class ScriptedResponder:
+    """
+    每类调用按脚本顺序循环输出，例如 grader=["no", "yes"] 会让每轮先重写一次再作答。
+    并发压测时脚本是全局轮转的，所以路径比例是确定的，但具体哪个会话走哪条路径不确定。
+    """
+
+    def __init__(self, scripts: dict = None):
+        self._cycles = {kind: itertools.cycle(outputs) for kind, outputs in (scripts or {}).items() if outputs}
+        self._lock = threading.Lock()
+
+    def __call__(self, kind: str, messages) -> str:
+        with self._lock:
+            if kind in self._cycles:
+                return next(self._cycles[kind])
+        return DEFAULT_OUTPUTS[kind]
+
+
+def default_responder(kind: str, messages) -> str:
+    return DEFAULT_OUTPUTS[kind]
+
+
+def make_server(host="127.0.0.1", port=0, latency=None, responder=default_responder,
+                kind_latency: dict = None, token_delay_ms: float = 5, chars_per_chunk: int = 4,
+                prefix_cache: PrefixCache = None):
+    """
+    latency       : 默认延迟模型 (首包前的等待)
+    kind_latency  : {调用类别: LatencyModel}，覆盖默认延迟
+    token_delay_ms: 流式输出时每个分片之间的间隔
+    prefix_cache  : 前缀缓存模拟，默认 64 token 一块
+    """
+    latency = latency or LatencyModel()
+    kind_latency = kind_latency or {}
+    prefix_cache = prefix_cache or PrefixCache()
+    stats = {"requests": 0, "by_kind": defaultdict(int), "prompt_tokens": 0, "cache_hit_tokens": 0}
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def do_POST(self):
+            if not self.path.rstrip("/").endswith("/chat/completions"):
+                self.send_error(404)
+                return
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            messages = body.get("messages", [])
+            kind = classify(messages)
+            with lock:
+                stats["requests"] += 1
+                stats["by_kind"][kind] += 1
+
+            time.sleep(kind_latency.get(kind, latency).sample())
+            content = responder(kind, messages)
+            prompt_tokens = sum(len(str(m.get("content", ""))) for m in messages)
+            cache_hit = min(prefix_cache.lookup(messages), prompt_tokens)
+            with lock:
+                stats["prompt_tokens"] += prompt_tokens
+                stats["cache_hit_tokens"] += cache_hit
+            usage = {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": len(content),
+                "total_tokens": prompt_tokens + len(content),
+                "prompt_cache_hit_tokens": cache_hit,
+                "prompt_cache_miss_tokens": prompt_tokens - cache_hit,
+            }
+            if body.get("stream"):
+                self._stream(body, content, usage)
+            else:
+                self._respond(body, content, usage)
+
+        def _base(self, body, obj: str) -> dict:
+            return {
+                "id": f"mock-{time.time_ns()}",
+                "object": obj,
+                "created": int(time.time()),
+                "model": body.get("model", "deepseek-chat"),
+            }
+
+        def _respond(self, body, content, usage):
+            payload = {
+                **self._base(body, "chat.completion"),
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": content},
+                    "finish_reason": "stop",
+                }],
+                "usage": usage,
+            }
+            data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _stream(self, body, content, usage):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Cache-Control", "no-cache")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            self.close_connection = True
+
+            def send(chunk: dict):
+                self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+                self.wfile.flush()
+
+            base = self._base(body, "chat.completion.chunk")
+            send({**base, "choices": [{"index": 0, "delta": {"role": "assistant", "content": ""}, "finish_reason": None}]})
+            for i in range(0, len(content), chars_per_chunk):
+                time.sleep(token_delay_ms / 1000)
+                send({**base, "choices": [{"index": 0, "delta": {"content": content[i:i + chars_per_chunk]}, "finish_reason": None}]})
+            final = {**base, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}
+            if body.get("stream_options", {}).get("include_usage"):
+                final["usage"] = usage
+            send(final)
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    server.stats = stats
+    return server
+
+
+def start_in_background(**kwargs):
+    """
+    在后台线程启动 Mock 服务，返回 (server, base_url)。压测脚本用它在同一进程里起服务。
+    """
+    server = make_server(**kwargs)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    host, port = server.server_address[:2]
+    return server, f"http://{host}:{port}/v1"
+
+
+def load_config(path: str) -> dict:
+    """
+    JSON 配置示例：
+    {
+      "latency": {"answer": {"dist": "lognormal", "base_ms": 800, "sigma": 0.4},
+                  "grader": {"base_ms": 150, "jitter_ms": 50}},
+      "script":  {"router": ["contextualize", "hyde", "direct"], "grader": ["no", "yes"]}
+    }
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        config = json.load(f)
+    return {
+        "kind_latency": {k: LatencyModel.from_spec(v) for k, v in config.get("latency", {}).items()},
+        "responder": ScriptedResponder(config.get("script")),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地 OpenAI 兼容 Mock LLM 服务 (可注入延迟、支持流式、可脚本化输出)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--dist", choices=["fixed", "uniform", "lognormal"], default="uniform")
+    parser.add_argument("--latency-ms", type=float, default=50)
+    parser.add_argument("--jitter-ms", type=float, default=0)
+    parser.add_argument("--sigma", type=float, default=0.5, help="lognormal 的形状参数")
+    parser.add_argument("--slow-rate", type=float, default=0.0, help="落入慢尾的概率")
+    parser.add_argument("--slow-ms", type=float, default=0, help="慢尾请求的延迟")
+    parser.add_argument("--token-delay-ms", type=float, default=5, help="流式分片间隔")
+    parser.add_argument("--router-script", default=None, help="逗号分隔的路由输出序列，如 contextualize,hyde")
+    parser.add_argument("--grader-script", default=None, help="逗号分隔的评分输出序列，如 no,yes")
+    parser.add_argument("--config", default=None, help="JSON 配置文件 (按调用类别的延迟与脚本)")
+    args = parser.parse_args()
+
+    latency = LatencyModel(args.latency_ms, args.jitter_ms, args.slow_rate, args.slow_ms, args.dist, args.sigma)
+    options = load_config(args.config) if args.config else {}
+    if not args.config and (args.router_script or args.grader_script):
+        options["responder"] = ScriptedResponder({
+            "router": args.router_script.split(",") if args.router_script else None,
+            "grader": args.grader_script.split(",") if args.grader_script else None,
+        })
+    server = make_server(args.host, args.port, latency, token_delay_ms=args.token_delay_ms, **options)
+    print(f"--- 🧪 Mock LLM 已启动: http://{args.host}:{args.port}/v1 ---")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+import os
+import sys
+import json
+import bisect
+import argparse
+from collections import defaultdict
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# ==============================================================================
+# 提示词前缀稳定性分析：读取录制的模型调用 (埋点事件 JSONL，需开启 ZENGRAPH_RECORD_PROMPTS=1，
+# 或 bench_graph.py --events)，按提示词 ID 分组统计：
+#   - 固定前缀：组内所有请求共同的开头有多长、在哪里开始分叉；
+#   - 可复用前缀：按请求到达顺序，每条请求与之前任意一条请求的最长公共前缀 (按 block 向下取整)，
+#     即理想情况下上游前缀缓存能命中的比例；
+#   - 上游实际返回的缓存命中 token (事件里有 cache_hit_tokens 时)。
+# 同一提示词 ID 的固定部分被嵌进不同外壳时 (例如 RolePlaying 的助手 / 用户两个 Agent)，按外壳拆成 #1、#2 分别统计。
+# 也接受每行只有 {"messages": [...]} 的通用录制文件。
+# ==============================================================================
+
+
+def serialize(messages: list) -> str:
+    """
+    按上游拼接顺序展开消息，角色边界也算进前缀。
+    """
+    return "".join(f"<{m.get('role')}>{m.get('content') or ''}" for m in messages)
+
+
+def static_head(messages: list, prompt_id: str) -> str:
+    """
+    首条消息里到注册模板固定部分结束为止的内容；认不出模板时取整条首消息。
+    """
+    from src.prompts import PROMPTS
+
+    content = messages[0].get("content") or ""
+    for template in PROMPTS.values():
+        if template.id == prompt_id and template.system in content:
+            return content[:content.index(template.system) + len(template.system)]
+    return content
+
+
+def common_prefix_len(a: str, b: str) -> int:
+    n = min(len(a), len(b))
+    i = 0
+    while i < n and a[i] == b[i]:
+        i += 1
+    return i
+
+
+def load_records(path: str) -> list:
+    records = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                event = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if event.get("type", "llm") != "llm" or not event.get("messages") or event.get("coalesced"):
+                continue
+            records.append(event)
+    return records
+
+
+def analyze_group(texts: list, block: int) -> dict:
+    """
+    texts 按到达顺序排列。已到达的请求保持有序，与新请求前缀最长的一定是它在有序表里的相邻项。
+    """
+    seen, reusable, reusable_blocked = [], 0, 0
+    for text in texts:
+        best = 0
+        pos = bisect.bisect_left(seen, text)
+        for neighbour in seen[max(0, pos - 1):pos + 1]:
+            best = max(best, common_prefix_len(text, neighbour))
+        reusable += best
+        reusable_blocked += best // block * block if block > 0 else best
+        seen.insert(pos, text)
+
+    static = texts[0]
+    for text in texts[1:]:
+        static = static[:common_prefix_len(static, text)]
+    total = sum(len(t) for t in texts)
+    return {
+        "requests": len(texts),
+        "mean_chars": total / len(texts),
+        "static_prefix_chars": len(static),
+        "static_ratio": len(static) * len(texts) / total if total else 0.0,
+        "reusable_ratio": reusable / total if total else 0.0,
+        "cacheable_ratio": reusable_blocked / total if total else 0.0,
+        # 固定前缀结束处，方便看出是哪段变量打断了前缀
+        "diverges_after": static[-30:],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="按提示词 ID 统计录制流量的前缀稳定性与缓存命中")
+    parser.add_argument("events", help="埋点事件 JSONL (含 messages 字段)")
+    parser.add_argument("--block", type=int, default=64, help="上游缓存的粒度 (字符近似 token)，0 表示不取整")
+    parser.add_argument("--output", default=None)
+    args = parser.parse_args()
+
+    records = load_records(args.events)
+    if not records:
+        print("--- ⚠️ 没有找到带 messages 的模型调用事件，请设置 ZENGRAPH_RECORD_PROMPTS=1 后重新录制 ---")
+        return
+
+    by_id = defaultdict(lambda: defaultdict(list))
+    for event in records:
+        prompt_id = event.get("prompt_id") or f"unknown:{event.get('node')}"
+        by_id[prompt_id][static_head(event["messages"], event.get("prompt_id"))].append(event)
+    groups = {}
+    for prompt_id, heads in by_id.items():
+        for i, events in enumerate(sorted(heads.values(), key=len, reverse=True), 1):
+            groups[prompt_id if len(heads) == 1 else f"{prompt_id}#{i}"] = events
+
+    report = {}
+    print(f"{'提示词':<18}{'请求':>6}{'平均字数':>9}{'固定前缀':>9}{'固定占比':>9}{'可复用':>8}{'可缓存':>8}{'上游命中':>9}")
+    for prompt_id, events in sorted(groups.items()):
+        row = analyze_group([serialize(e["messages"]) for e in events], args.block)
+        reported = [e for e in events if e.get("cache_hit_tokens") is not None and e.get("prompt_tokens")]
+        row["reported_hit_ratio"] = (
+            sum(e["cache_hit_tokens"] for e in reported) / sum(e["prompt_tokens"] for e in reported)
+            if reported else None
+        )
+        report[prompt_id] = row
+
+        hit = f"{row['reported_hit_ratio']:.1%}" if row["reported_hit_ratio"] is not None else "-"
+        print(f"{prompt_id:<18}{row['requests']:>6}{row['mean_chars']:>9.0f}{row['static_prefix_chars']:>9}"
+              f"{row['static_ratio']:>9.1%}{row['reusable_ratio']:>8.1%}{row['cacheable_ratio']:>8.1%}{hit:>9}")
+
+    print("\n固定前缀在此处分叉 (之后即为变量部分)：")
+    for prompt_id, row in sorted(report.items()):
+        print(f"  {prompt_id:<18}…{row['diverges_after']!r}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"--- ✅ 结果已写入: {args.output} ---")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+import os
+import sys
+import signal
+import argparse
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src.config import RETRIEVER_MMAP_DIR, RETRIEVER_SOCKET, RETRIEVER_MAX_BATCH, RETRIEVER_MAX_WAIT_MS, TOP_K
+from src.instrumentation import configure_logging
+
+# ==============================================================================
+# 检索 sidecar：
+#   1. export：从现有 llama-index 持久化目录导出内存映射索引 (只需做一次，索引更新后重做)
+#   2. serve ：加载嵌入模型 + 内存映射索引，在 Unix socket 上提供批量检索
+# worker 侧设置 ZENGRAPH_RETRIEVER=sidecar 即改为通过 RetrieverClient 调用。
+# ==============================================================================
+
+
+def cmd_export(args):
+    from src.retriever import BuddhistRecursiveRetriever
+    from src.retrieval_service import export_index
+
+    retriever = BuddhistRecursiveRetriever()
+    result = export_index(retriever, args.index_dir)
+    print(f"--- ✅ 已导出 {result['vectors']} 个向量、{result['parents']} 个父块到 {args.index_dir} ---")
+
+
+def cmd_serve(args):
+    from src.retrieval_service import MmapIndex, RetrievalServer, load_query_embedder
+
+    index = MmapIndex(args.index_dir)
+    server = RetrievalServer(
+        index,
+        load_query_embedder(index.embed_model or "BAAI/bge-small-zh-v1.5"),
+        socket_path=args.socket,
+        top_k=args.top_k,
+        max_batch=args.max_batch,
+        max_wait_ms=args.max_wait_ms,
+    )
+    signal.signal(signal.SIGTERM, lambda *_: server.close())
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="检索 sidecar：一个进程持有嵌入模型和索引，多个 worker 共享")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    export = sub.add_parser("export", help="把 llama-index 索引导出为内存映射文件")
+    export.add_argument("--index-dir", default=RETRIEVER_MMAP_DIR)
+    export.set_defaults(func=cmd_export)
+
+    serve = sub.add_parser("serve", help="启动检索服务")
+    serve.add_argument("--index-dir", default=RETRIEVER_MMAP_DIR)
+    serve.add_argument("--socket", default=RETRIEVER_SOCKET)
+    serve.add_argument("--top-k", type=int, default=TOP_K)
+    serve.add_argument("--max-batch", type=int, default=RETRIEVER_MAX_BATCH)
+    serve.add_argument("--max-wait-ms", type=float, default=RETRIEVER_MAX_WAIT_MS)
+    serve.set_defaults(func=cmd_serve)
+
+    args = parser.parse_args()
+    configure_logging("INFO")
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,16 @@
+import uvicorn
+
+from src.config import SERVER_HOST, SERVER_PORT
+from src.instrumentation import configure_logging
+from src.server import create_app
+
+
+def main():
+    # 节点过程日志默认关闭，ZENGRAPH_LOG_LEVEL=INFO 打开
+    configure_logging()
+    # 单进程：并发由 AdmissionController 控制，检索器与 Checkpointer 在进程内共享
+    uvicorn.run(create_app(), host=SERVER_HOST, port=SERVER_PORT, workers=1)
+
+
+if __name__ == "__main__":
+    main()
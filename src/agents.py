@@ -1,37 +1,32 @@
 from camel.societies import RolePlaying
 from .utils import get_deepseek_model
+from .prompts import MASTER
 
 
-def get_buddhist_master_response(question: str, context: str, chat_history: list):
-    
+def build_master_task_prompt(question: str, context: str, chat_history: list) -> str:
+    """
+    拼装法师的任务提示词 (固定要求在前，历史、经文、问题在后)。单独拆出来，方便压测统计提示词长度。
+    RolePlaying 会把它嵌进助手的系统消息，Camel 自己的角色模板之后紧跟的就是这段固定前缀。
+    """
     # 如果历史为空，初始化为空列表
     if chat_history is None:
         chat_history = []
-        
-    # 将历史列表转为字符串
+
+    # 将历史列表转为字符串 (调用方传入的是 HistoryManager 的紧凑视图，长度有界)
     history_str = "\n".join(chat_history)
+    return MASTER.system + "\n\n" + MASTER.format_user(history=history_str, context=context, question=question)
+
+
+def get_buddhist_master_response(question: str, context: str, chat_history: list):
     
-    # 1. 任务描述：结合检索到的经文
-    task_prompt = (
-        f"你是一位得道高僧，法号‘慧语’。面前是一位迷茫的信众。\n"
-        f"以下是你们之前的对话记录（作为参考，帮助你理解上下文）：\n"
-        f"'''\n{history_str}\n'''\n\n"  # <--- 关键点：注入记忆
-        f"请你根据心中的经文义理（即以下内容）：\n'''{context}'''\n"
-        f"来回答信众的疑惑：'{question}'。\n\n"
-        f"【要求】\n"
-        f"1. 语气要慈悲、平和，多用‘阿弥陀佛’、‘施主’等佛家用语。\n"
-        f"2. 不要说‘根据提供的段落’，要把它内化为你自己的智慧, 并且简要提炼经文中的关键点（不要大段复制原文）\n"
-        f"3. 不要像写论文一样列‘1.2.3.’，要像聊天一样娓娓道来，可以用比喻。\n"
-        f"4. 整个回复严格控制在 150字以内\n"
-        f"5. 严禁输出 'Solution:' 或 'Next request' 这种机器语言。"
-    )    
+    task_prompt = build_master_task_prompt(question, context, chat_history)
     # 2. 配置 DeepSeek 模型
     # 注意：DeepSeek 兼容 OpenAI 格式，在 Camel 中我们可以通过指定 api_key 和 base_url 来调用
     # model_config = ChatGPTConfig(temperature=0.7) # 法师说话需要一点灵性，不要太死板
     
     # 使用 ModelFactory 创建模型实例
     # 虽然 ModelType 可能没写 DeepSeek，但由于接口兼容，我们传对应的参数即可
-    deepseek_model = get_deepseek_model(temperature=0.6)
+    deepseek_model = get_deepseek_model(temperature=0.6, node="answer")
     
     # 3. 启动 CamelAI 角色扮演
     role_play_session = RolePlaying(
@@ -56,4 +51,25 @@ def get_buddhist_master_response(question: str, context: str, chat_history: list
         # 去掉首尾多余的空格
         return content.strip()
     else:
-        return "法师正在入定，未给予言语回应。"
\ No newline at end of file
+        return "法师正在入定，未给予言语回应。"
+
+
+def stream_buddhist_master_response(question: str, context: str, chat_history: list, on_token):
+    """
+    流式版本：不经过 RolePlaying 的双 Agent 对话，单次调用模型，每收到一段文本就回调 on_token。
+    首字更快，也省掉了“求法学生”那一次模型调用。返回完整回答。
+    """
+    deepseek_model = get_deepseek_model(temperature=0.6, node="answer", stream=True)
+    messages = MASTER.render(history="\n".join(chat_history or []), context=context, question=question)
+
+    parts = []
+    for chunk in deepseek_model.run(messages):
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta.content
+        if delta:
+            parts.append(delta)
+            on_token(delta)
+
+    content = "".join(parts).strip()
+    return content or "法师正在入定，未给予言语回应。"
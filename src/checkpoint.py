@@ -0,0 +1,511 @@
+import asyncio
+import json
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+
+from langgraph.checkpoint.base import (
+    WRITES_IDX_MAP,
+    BaseCheckpointSaver,
+    CheckpointTuple,
+    get_checkpoint_id,
+    get_checkpoint_metadata,
+    writes_sort_key,
+)
+
+from .config import (
+    CHECKPOINT_PATH,
+    CHECKPOINT_KEEP_LAST,
+    CHECKPOINT_TTL_SECONDS,
+    CHECKPOINT_FLUSH_INTERVAL,
+    CHECKPOINT_FLUSH_BATCH,
+)
+
+logger = logging.getLogger(__name__)
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS checkpoints (
+    thread_id TEXT NOT NULL,
+    checkpoint_ns TEXT NOT NULL DEFAULT '',
+    checkpoint_id TEXT NOT NULL,
+    parent_checkpoint_id TEXT,
+    channel_versions TEXT NOT NULL,
+    type TEXT,
+    checkpoint BLOB,
+    metadata_type TEXT,
+    metadata BLOB,
+    PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id)
+);
+CREATE TABLE IF NOT EXISTS blobs (
+    thread_id TEXT NOT NULL,
+    checkpoint_ns TEXT NOT NULL DEFAULT '',
+    channel TEXT NOT NULL,
+    version TEXT NOT NULL,
+    type TEXT NOT NULL,
+    blob BLOB,
+    PRIMARY KEY (thread_id, checkpoint_ns, channel, version)
+);
+CREATE TABLE IF NOT EXISTS writes (
+    thread_id TEXT NOT NULL,
+    checkpoint_ns TEXT NOT NULL DEFAULT '',
+    checkpoint_id TEXT NOT NULL,
+    task_id TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    channel TEXT NOT NULL,
+    type TEXT,
+    value BLOB,
+    task_path TEXT NOT NULL DEFAULT '',
+    PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id, task_id, idx)
+);
+CREATE TABLE IF NOT EXISTS threads (
+    thread_id TEXT PRIMARY KEY,
+    last_access REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_threads_last_access ON threads (last_access);
+"""
+
+
+class SqliteCheckpointer(BaseCheckpointSaver[str]):
+    """
+    基于 SQLite 的持久化 Checkpointer，替代 MemorySaver：
+    - WAL 模式 + 批量写：一轮对话里的多次 put 合并成一个事务提交；
+    - 通道值按 (channel, version) 单独存 blob，没变化的字段不会在每个 checkpoint 里重复存一份；
+    - 每个线程只保留最近 keep_last 个 checkpoint，并清理不再被引用的 blob；
+    - 超过 ttl_seconds 未访问的线程整体清除。
+
+    注意：批量写意味着进程崩溃时最多丢失 flush_interval 秒内的写入。
+    """
+
+    def __init__(
+        self,
+        path: str = CHECKPOINT_PATH,
+        *,
+        keep_last: int = CHECKPOINT_KEEP_LAST,
+        ttl_seconds: float = CHECKPOINT_TTL_SECONDS,
+        flush_interval: float = CHECKPOINT_FLUSH_INTERVAL,
+        flush_batch: int = CHECKPOINT_FLUSH_BATCH,
+        serde=None,
+    ):
+        super().__init__(serde=serde)
+        self.path = path
+        self.keep_last = keep_last
+        self.ttl_seconds = ttl_seconds
+        self.flush_interval = flush_interval
+        self.flush_batch = flush_batch
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(_SCHEMA)
+
+        self._lock = threading.RLock()
+        self._pending = []          # 待提交的 (sql, params)
+        self._dirty_threads = set() # 本批次写过的 (thread_id, checkpoint_ns)，提交后做裁剪
+        self._pending_versions = {} # (thread_id, checkpoint_ns) -> 本批次 checkpoint 引用的 {channel: version}
+        self._touched = {}          # thread_id -> 最近访问时间，随批次写入 threads 表
+        self._last_evict = time.time()
+
+        self._closed = threading.Event()
+        self._flusher = threading.Thread(target=self._flush_loop, name="checkpoint-flush", daemon=True)
+        self._flusher.start()
+
+    # ------------------------------------------------------------------
+    # 批量写
+    # ------------------------------------------------------------------
+    def _enqueue(self, statements: list):
+        """
+        一次 put / put_writes 的全部语句作为一个整体入队，入队完成后才检查批量大小；
+        不能在一次 put 写到一半 (blob 已入队、checkpoint 行还没有) 时刷盘，否则裁剪会把这些 blob 当成无人引用删掉。
+        """
+        with self._lock:
+            self._pending.extend(statements)
+            if len(self._pending) >= self.flush_batch:
+                self.flush()
+
+    def _touch(self, thread_id: str):
+        self._touched[thread_id] = time.time()
+
+    def flush(self):
+        """
+        把缓冲区里的写入放进一个事务提交，然后对涉及的线程做裁剪。
+        """
+        with self._lock:
+            if not self._pending and not self._touched:
+                return
+            pending, self._pending = self._pending, []
+            dirty, self._dirty_threads = self._dirty_threads, set()
+            pending_versions, self._pending_versions = self._pending_versions, {}
+            touched, self._touched = self._touched, {}
+
+            cur = self.conn.cursor()
+            cur.execute("BEGIN")
+            try:
+                for sql, params in pending:
+                    cur.execute(sql, params)
+                cur.executemany(
+                    "INSERT INTO threads (thread_id, last_access) VALUES (?, ?) "
+                    "ON CONFLICT(thread_id) DO UPDATE SET last_access = excluded.last_access",
+                    list(touched.items()),
+                )
+                for thread_id, checkpoint_ns in dirty:
+                    self._prune(cur, thread_id, checkpoint_ns, pending_versions.get((thread_id, checkpoint_ns), ()))
+                cur.execute("COMMIT")
+            except Exception:
+                cur.execute("ROLLBACK")
+                raise
+
+    def _flush_loop(self):
+        while not self._closed.wait(self.flush_interval):
+            try:
+                self.flush()
+                if time.time() - self._last_evict >= min(self.ttl_seconds, 60):
+                    self.evict_idle()
+            except Exception as e:
+                logger.warning("--- ⚠️ Checkpoint 后台刷盘失败: %s ---", e)
+
+    def close(self):
+        self._closed.set()
+        self._flusher.join(timeout=self.flush_interval * 2)
+        self.flush()
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    # ------------------------------------------------------------------
+    # 裁剪与过期
+    # ------------------------------------------------------------------
+    def _prune(self, cur, thread_id: str, checkpoint_ns: str, pending_versions=()):
+        """
+        只保留最近 keep_last 个 checkpoint；blob 只要还被保留的 checkpoint 或本批次写入的 checkpoint 引用就不删。
+        """
+        rows = cur.execute(
+            "SELECT checkpoint_id, channel_versions FROM checkpoints "
+            "WHERE thread_id = ? AND checkpoint_ns = ? ORDER BY checkpoint_id DESC",
+            (thread_id, checkpoint_ns),
+        ).fetchall()
+        if len(rows) <= self.keep_last:
+            return
+
+        stale_ids = [row[0] for row in rows[self.keep_last:]]
+        cur.executemany(
+            "DELETE FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?",
+            [(thread_id, checkpoint_ns, cid) for cid in stale_ids],
+        )
+        cur.executemany(
+            "DELETE FROM writes WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?",
+            [(thread_id, checkpoint_ns, cid) for cid in stale_ids],
+        )
+
+        # 只保留仍被剩余 checkpoint 或本批次 checkpoint 引用的 (channel, version)
+        live = set()
+        for _, versions in rows[:self.keep_last]:
+            live.update(json.loads(versions).items())
+        for versions in pending_versions:
+            live.update(versions.items())
+        stored = cur.execute(
+            "SELECT channel, version FROM blobs WHERE thread_id = ? AND checkpoint_ns = ?",
+            (thread_id, checkpoint_ns),
+        ).fetchall()
+        cur.executemany(
+            "DELETE FROM blobs WHERE thread_id = ? AND checkpoint_ns = ? AND channel = ? AND version = ?",
+            [(thread_id, checkpoint_ns, ch, ver) for ch, ver in stored if (ch, ver) not in live],
+        )
+
+    def evict_idle(self, now: float = None) -> int:
+        """
+        清除超过 TTL 未访问的线程，返回清除的线程数。
+        """
+        now = now or time.time()
+        with self._lock:
+            self.flush()
+            self._last_evict = now
+            expired = [
+                row[0] for row in self.conn.execute(
+                    "SELECT thread_id FROM threads WHERE last_access < ?",
+                    (now - self.ttl_seconds,),
+                )
+            ]
+            for thread_id in expired:
+                self._delete_thread_rows(thread_id)
+            return len(expired)
+
+    def _delete_thread_rows(self, thread_id: str):
+        cur = self.conn.cursor()
+        cur.execute("BEGIN")
+        for table in ("checkpoints", "blobs", "writes", "threads"):
+            cur.execute(f"DELETE FROM {table} WHERE thread_id = ?", (thread_id,))
+        cur.execute("COMMIT")
+
+    def delete_thread(self, thread_id: str) -> None:
+        with self._lock:
+            self.flush()
+            self._delete_thread_rows(thread_id)
+
+    # ------------------------------------------------------------------
+    # 通道值编解码
+    # ------------------------------------------------------------------
+    def _dump_blob(self, channel: str, value, channel_values: dict):
+        """
+        单个通道值的序列化，返回 (type, blob)；子类可以按通道换成别的存储形式 (见 scripts/bench_checkpoint.py)。
+        """
+        return self.serde.dumps_typed(value)
+
+    def _load_blobs(self, thread_id: str, checkpoint_ns: str, versions: dict) -> dict:
+        values = {}
+        for channel, version in versions.items():
+            row = self.conn.execute(
+                "SELECT type, blob FROM blobs WHERE thread_id = ? AND checkpoint_ns = ? "
+                "AND channel = ? AND version = ?",
+                (thread_id, checkpoint_ns, channel, str(version)),
+            ).fetchone()
+            if row is None or row[0] == "empty":
+                continue
+            values[channel] = self._load_value(channel, row[0], row[1])
+        return values
+
+    def _load_value(self, channel: str, type_: str, blob: bytes):
+        return self.serde.loads_typed((type_, blob))
+
+    # ------------------------------------------------------------------
+    # BaseCheckpointSaver 接口
+    # ------------------------------------------------------------------
+    def put(self, config, checkpoint, metadata, new_versions):
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        c = checkpoint.copy()
+        values = c.pop("channel_values")
+
+        # 序列化放在锁外；只有版本变化的通道才写新 blob，其余沿用旧版本
+        statements = []
+        for channel, version in new_versions.items():
+            if channel in values:
+                type_, blob = self._dump_blob(channel, values[channel], values)
+            else:
+                type_, blob = "empty", None
+            statements.append((
+                "INSERT OR REPLACE INTO blobs VALUES (?, ?, ?, ?, ?, ?)",
+                (thread_id, checkpoint_ns, channel, str(version), type_, blob),
+            ))
+
+        versions = {k: str(v) for k, v in checkpoint["channel_versions"].items()}
+        type_, blob = self.serde.dumps_typed(c)
+        meta_type, meta_blob = self.serde.dumps_typed(get_checkpoint_metadata(config, metadata))
+        statements.append((
+            "INSERT OR REPLACE INTO checkpoints VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                thread_id,
+                checkpoint_ns,
+                checkpoint["id"],
+                config["configurable"].get("checkpoint_id"),
+                json.dumps(versions),
+                type_,
+                blob,
+                meta_type,
+                meta_blob,
+            ),
+        ))
+
+        with self._lock:
+            self._dirty_threads.add((thread_id, checkpoint_ns))
+            self._pending_versions.setdefault((thread_id, checkpoint_ns), []).append(versions)
+            self._touch(thread_id)
+            self._enqueue(statements)
+
+        return {
+            "configurable": {
+                "thread_id": thread_id,
+                "checkpoint_ns": checkpoint_ns,
+                "checkpoint_id": checkpoint["id"],
+            }
+        }
+
+    def put_writes(self, config, writes, task_id, task_path=""):
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        checkpoint_id = config["configurable"]["checkpoint_id"]
+        write_values = {channel: value for channel, value in writes if isinstance(channel, str)}
+        statements = []
+        for idx, (channel, value) in enumerate(writes):
+            write_idx = WRITES_IDX_MAP.get(channel, idx)
+            # 普通写入只记第一次，特殊写入 (错误、中断等) 以最新为准，和 MemorySaver 一致
+            verb = "INSERT OR IGNORE" if write_idx >= 0 else "INSERT OR REPLACE"
+            type_, blob = self._dump_blob(channel, value, write_values)
+            statements.append((
+                f"{verb} INTO writes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (thread_id, checkpoint_ns, checkpoint_id, task_id, write_idx, channel, type_, blob, task_path),
+            ))
+        with self._lock:
+            self._touch(thread_id)
+            self._enqueue(statements)
+
+    def get_tuple(self, config):
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        checkpoint_id = get_checkpoint_id(config)
+
+        with self._lock:
+            # 读之前先刷盘，保证能读到自己刚写的内容
+            self.flush()
+            if checkpoint_id:
+                row = self.conn.execute(
+                    "SELECT checkpoint_id, parent_checkpoint_id, type, checkpoint, metadata_type, metadata "
+                    "FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?",
+                    (thread_id, checkpoint_ns, checkpoint_id),
+                ).fetchone()
+            else:
+                row = self.conn.execute(
+                    "SELECT checkpoint_id, parent_checkpoint_id, type, checkpoint, metadata_type, metadata "
+                    "FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? "
+                    "ORDER BY checkpoint_id DESC LIMIT 1",
+                    (thread_id, checkpoint_ns),
+                ).fetchone()
+            if row is None:
+                return None
+            self._touch(thread_id)
+            return self._row_to_tuple(thread_id, checkpoint_ns, row)
+
+    def list(self, config, *, filter=None, before=None, limit=None):
+        with self._lock:
+            self.flush()
+            sql = (
+                "SELECT thread_id, checkpoint_ns, checkpoint_id, parent_checkpoint_id, "
+                "type, checkpoint, metadata_type, metadata FROM checkpoints"
+            )
+            clauses, params = [], []
+            if config:
+                clauses.append("thread_id = ?")
+                params.append(config["configurable"]["thread_id"])
+                if config["configurable"].get("checkpoint_ns") is not None:
+                    clauses.append("checkpoint_ns = ?")
+                    params.append(config["configurable"]["checkpoint_ns"])
+                if get_checkpoint_id(config):
+                    clauses.append("checkpoint_id = ?")
+                    params.append(get_checkpoint_id(config))
+            if before and get_checkpoint_id(before):
+                clauses.append("checkpoint_id < ?")
+                params.append(get_checkpoint_id(before))
+            if clauses:
+                sql += " WHERE " + " AND ".join(clauses)
+            sql += " ORDER BY checkpoint_id DESC"
+            rows = self.conn.execute(sql, params).fetchall()
+
+            results = []
+            for thread_id, checkpoint_ns, *rest in rows:
+                if limit is not None and len(results) >= limit:
+                    break
+                if filter:
+                    metadata = self.serde.loads_typed((rest[4], rest[5]))
+                    if not all(metadata.get(k) == v for k, v in filter.items()):
+                        continue
+                results.append(self._row_to_tuple(thread_id, checkpoint_ns, rest))
+        yield from results
+
+    def _row_to_tuple(self, thread_id: str, checkpoint_ns: str, row) -> CheckpointTuple:
+        checkpoint_id, parent_id, type_, blob, meta_type, meta_blob = row
+        checkpoint = self.serde.loads_typed((type_, blob))
+        writes = self.conn.execute(
+            "SELECT task_id, idx, channel, type, value, task_path FROM writes "
+            "WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?",
+            (thread_id, checkpoint_ns, checkpoint_id),
+        ).fetchall()
+        writes.sort(key=lambda w: writes_sort_key(w[5], w[0], w[1]))
+        return CheckpointTuple(
+            config={
+                "configurable": {
+                    "thread_id": thread_id,
+                    "checkpoint_ns": checkpoint_ns,
+                    "checkpoint_id": checkpoint_id,
+                }
+            },
+            checkpoint={
+                **checkpoint,
+                "channel_values": self._load_blobs(thread_id, checkpoint_ns, checkpoint["channel_versions"]),
+            },
+            metadata=self.serde.loads_typed((meta_type, meta_blob)),
+            parent_config=(
+                {
+                    "configurable": {
+                        "thread_id": thread_id,
+                        "checkpoint_ns": checkpoint_ns,
+                        "checkpoint_id": parent_id,
+                    }
+                }
+                if parent_id
+                else None
+            ),
+            pending_writes=[
+                (task_id, channel, self._load_value(channel, wtype, value))
+                for task_id, _, channel, wtype, value, _ in writes
+            ],
+        )
+
+    def get_next_version(self, current, channel=None) -> str:
+        # 与 MemorySaver 相同的字符串版本号：整数部分递增，随机小数避免并发冲突
+        if current is None:
+            current_v = 0
+        elif isinstance(current, int):
+            current_v = current
+        else:
+            current_v = int(current.split(".")[0])
+        return f"{current_v + 1:032}.{random.random():016}"
+
+    # 异步接口：SQLite 本身是同步的，丢进线程池执行，避免阻塞事件循环
+    async def aget_tuple(self, config):
+        return await asyncio.get_running_loop().run_in_executor(None, self.get_tuple, config)
+
+    async def alist(self, config, *, filter=None, before=None, limit=None):
+        results = await asyncio.get_running_loop().run_in_executor(
+            None, lambda: list(self.list(config, filter=filter, before=before, limit=limit))
+        )
+        for item in results:
+            yield item
+
+    async def aput(self, config, checkpoint, metadata, new_versions):
+        return await asyncio.get_running_loop().run_in_executor(
+            None, self.put, config, checkpoint, metadata, new_versions
+        )
+
+    async def aput_writes(self, config, writes, task_id, task_path=""):
+        return await asyncio.get_running_loop().run_in_executor(
+            None, self.put_writes, config, writes, task_id, task_path
+        )
+
+    async def adelete_thread(self, thread_id: str) -> None:
+        return await asyncio.get_running_loop().run_in_executor(None, self.delete_thread, thread_id)
+
+    # ------------------------------------------------------------------
+    # 统计
+    # ------------------------------------------------------------------
+    def stats(self, thread_id: str = None) -> dict:
+        """
+        返回磁盘占用统计；传 thread_id 时只统计该线程。
+        """
+        with self._lock:
+            self.flush()
+            where, params = ("WHERE thread_id = ?", (thread_id,)) if thread_id else ("", ())
+            result = {}
+            for table, cols in (
+                ("checkpoints", "length(checkpoint) + length(metadata)"),
+                ("blobs", "length(blob)"),
+                ("writes", "length(value)"),
+            ):
+                count, size = self.conn.execute(
+                    f"SELECT count(*), coalesce(sum({cols}), 0) FROM {table} {where}", params
+                ).fetchone()
+                result[f"{table}_rows"] = count
+                result[f"{table}_bytes"] = size
+            result["threads"] = self.conn.execute(f"SELECT count(*) FROM threads {where}", params).fetchone()[0]
+            result["file_bytes"] = sum(
+                os.path.getsize(p) for p in (self.path, self.path + "-wal") if os.path.exists(p)
+            )
+            return result
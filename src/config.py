@@ -1,5 +1,5 @@
 import os
-import torch
+import functools
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -7,7 +7,19 @@ load_dotenv()
 # 基础配置
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 MODEL_NAME = os.getenv("MODEL_NAME", "deepseek-chat")
-DEVICE = "cuda" if torch.cuda.is_available() else ("mps" if torch.backends.mps.is_available() else "cpu")
+# 可指向本地的 OpenAI 兼容 Mock 服务做压测 (见 scripts/mock_llm_server.py)
+DEEPSEEK_BASE_URL = os.getenv("DEEPSEEK_BASE_URL", "https://api.deepseek.com/v1")
+
+
+@functools.lru_cache(maxsize=None)
+def get_device() -> str:
+    """
+    嵌入模型所用的设备。只在真正加载模型时才导入 torch：sidecar 模式下的 worker 只导入配置，不该为此加载 torch。
+    """
+    import torch
+
+    return "cuda" if torch.cuda.is_available() else ("mps" if torch.backends.mps.is_available() else "cpu")
+
 
 # 路径配置
 DATA_PATH = "./data/sutras/cbeta-text-cleaned"
@@ -17,4 +29,83 @@ PROCESSED_LOG = "processed_files.log" # 进度记录
 # 检索参数配置
 CHUNK_SIZE = 1024
 CHUNK_OVERLAP = 100
-TOP_K = 3
\ No newline at end of file
+TOP_K = 3
+# 切分器：classical 为按 。！？； 与偈颂断句的 ClassicalChineseSplitter (src/splitter.py)；sentence 为 LlamaIndex 的 SentenceSplitter
+# 切换后需要重建索引
+SPLITTER = os.getenv("ZENGRAPH_SPLITTER", "classical")
+
+# 检索后端：local 为进程内 BuddhistRecursiveRetriever；sidecar 为连接独立的检索进程 (scripts/retriever_sidecar.py)
+RETRIEVER_BACKEND = os.getenv("ZENGRAPH_RETRIEVER", "local")
+# socket 放在只有当前用户可访问的目录 (0700) 下：优先 $XDG_RUNTIME_DIR，否则项目下的 ./run
+RETRIEVER_RUNTIME_DIR = os.path.join(os.getenv("XDG_RUNTIME_DIR") or os.path.abspath("./run"), "zengraph")
+RETRIEVER_SOCKET = os.getenv("ZENGRAPH_RETRIEVER_SOCKET", os.path.join(RETRIEVER_RUNTIME_DIR, "retriever.sock"))
+# sidecar 连接的共享密钥 (双向认证后才收发 pickle 消息)：优先取环境变量，否则读密钥文件 (默认 <socket>.key，sidecar 启动时生成)
+RETRIEVER_AUTHKEY = os.getenv("ZENGRAPH_RETRIEVER_AUTHKEY")
+RETRIEVER_AUTHKEY_FILE = os.getenv("ZENGRAPH_RETRIEVER_AUTHKEY_FILE")
+RETRIEVER_MMAP_DIR = "./retriever_mmap"  # sidecar 使用的内存映射索引目录
+RETRIEVER_MAX_BATCH = 32          # sidecar 每批最多合并的查询数
+RETRIEVER_MAX_WAIT_MS = 5         # sidecar 攒批的最长等待时间
+RETRIEVER_TIMEOUT = 10.0          # worker 等待 sidecar 响应的超时 (秒)
+
+# 对话历史配置
+HISTORY_MAX_TURNS = 4          # 原文保留的最近轮数 (一问一答为一轮)
+HISTORY_TOKEN_BUDGET = 1200    # 原文窗口的 token 上限，超出则把最早的轮次折叠进摘要
+HISTORY_SUMMARY_MAX_CHARS = 300  # 滚动摘要的最大字数
+HISTORY_MAX_PENDING_LINES = 8  # 等待摘要的行数上限，超过后同步做截断兜底
+HISTORY_LOG_COMPACT_LINES = 8   # history_log 里已并入摘要的行超过该数时压缩一次日志 (整体重写)
+
+# Checkpoint 持久化配置
+CHECKPOINT_PATH = os.getenv("CHECKPOINT_PATH", "./checkpoints/zengraph.sqlite")
+CHECKPOINT_KEEP_LAST = 3          # 每个线程只保留最近 K 个 checkpoint
+CHECKPOINT_TTL_SECONDS = 7 * 24 * 3600  # 线程闲置超过该时长后整体清除
+CHECKPOINT_FLUSH_INTERVAL = 0.2   # 批量写的最长攒批时间 (秒)
+CHECKPOINT_FLUSH_BATCH = 64       # 攒够这么多条写入立即提交
+
+# 请求合并配置：温度不高于该值的调用视为幂等，相同请求并发时只打一次上游
+SINGLEFLIGHT_MAX_TEMPERATURE = 0.3
+
+
+# 尾延迟控制
+GRAPH_DEADLINE_SECONDS = 20.0     # 一轮对话从路由到开始生成回答的总预算，超时直接走兜底
+LLM_NODE_BUDGETS = {              # 各节点单次模型调用的时间预算 (秒)
+    "intent_router": 3.0,
+    "contextualize": 5.0,
+    "rewrite": 8.0,
+    "grade": 5.0,
+    "answer": 30.0,
+    "summary": 20.0,
+}
+LLM_DEFAULT_BUDGET = 15.0
+LLM_HEDGE_ENABLED = True          # 幂等 (低温) 请求在 p95 延迟后发出对冲请求
+LLM_HEDGE_PERCENTILE = 95
+LLM_HEDGE_MIN_DELAY = 0.3         # 对冲延迟下限，避免样本少时过早对冲
+LLM_HEDGE_DEFAULT_DELAY = 1.5     # 样本不足时使用的对冲延迟
+LLM_HEDGE_MIN_SAMPLES = 20
+LLM_INITIAL_CONCURRENCY = 8       # AIMD 并发上限的初始值 / 下限 / 上限
+LLM_MIN_CONCURRENCY = 2
+LLM_MAX_CONCURRENCY = 32
+LLM_RATE_LIMIT = 20.0             # 令牌桶：平均每秒请求数
+LLM_RATE_BURST = 40               # 令牌桶：允许的突发请求数
+
+# 评分短路配置
+GRADER_THRESHOLDS_PATH = "./testdata/grader_thresholds.json"  # scripts/calibrate_grader.py 的输出
+GRADER_LOG_PATH = "./logs/grader_decisions.jsonl"            # LLM 评分记录，供离线标定
+GRADER_AUDIT_RATE = 0.05          # 短路区间里仍调用 LLM 抽查的比例
+GRADER_LOG_QUERY_TEXT = os.getenv("ZENGRAPH_GRADER_LOG_QUERY", "0") != "0"  # 评分日志记录用户问题原文；默认只记哈希
+GRADER_LOG_MAX_BYTES = 20 * 1024 * 1024  # 评分日志超过该大小时轮转为 .1 (只保留一份旧文件)
+
+# 观测配置
+LOG_LEVEL = os.getenv("ZENGRAPH_LOG_LEVEL", "WARNING")              # 设为 INFO 可看到各节点的过程日志
+INSTRUMENTATION_SAMPLE_RATE = float(os.getenv("ZENGRAPH_EVENT_SAMPLE_RATE", "1.0"))  # 结构化事件的采样率 (出错的事件总是保留)
+INSTRUMENTATION_EVENTS_PATH = os.getenv("ZENGRAPH_EVENTS_PATH")     # 结构化事件 JSONL 路径，不设置则不落盘
+INSTRUMENTATION_RECORD_PROMPTS = os.getenv("ZENGRAPH_RECORD_PROMPTS", "0") != "0"  # 模型调用事件附带完整消息，供 scripts/prompt_prefix_stability.py 分析
+METRICS_PORT = int(os.getenv("ZENGRAPH_METRICS_PORT", "0"))         # Prometheus 文本端点端口，0 表示不开启
+
+# HTTP 服务配置 (serve.py)
+SERVER_HOST = os.getenv("ZENGRAPH_HOST", "0.0.0.0")
+SERVER_PORT = int(os.getenv("ZENGRAPH_PORT", "8000"))
+SERVER_MAX_IN_FLIGHT = int(os.getenv("ZENGRAPH_MAX_IN_FLIGHT", "16"))  # 同时在跑的对话轮数上限
+SERVER_MAX_QUEUE = int(os.getenv("ZENGRAPH_MAX_QUEUE", "32"))          # 在途已满时允许排队的请求数，再多直接 503
+SERVER_QUEUE_TIMEOUT = 2.0        # 排队超过该时长仍未轮到则 503 (秒)
+SERVER_MAX_PENDING_PER_THREAD = 2  # 同一 thread_id 最多排队的轮数 (含正在执行的)，再多返回 429
+SERVER_WARMUP = os.getenv("ZENGRAPH_WARMUP", "1") != "0"  # 启动时预加载检索器，完成前 /readyz 返回 503
@@ -0,0 +1,126 @@
+import json
+import hashlib
+import logging
+import os
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .config import (
+    GRADER_THRESHOLDS_PATH, GRADER_LOG_PATH, GRADER_AUDIT_RATE, GRADER_LOG_QUERY_TEXT, GRADER_LOG_MAX_BYTES,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class GradePolicy:
+    """
+    基于检索相似度的评分短路策略：
+    - 最高分 >= high：经文明显相关，直接判 yes，不调 LLM；
+    - 最高分 <= low ：经文明显无关，直接判 no (交给 decide_to_generate 去重写或兜底)；
+    - 中间地带才调用 LLM Grader。
+
+    阈值由 scripts/calibrate_grader.py 根据线上记录的 LLM 评分离线标定；
+    没有标定文件时两个阈值都不生效，所有请求照旧走 LLM (同时积累标定数据)。
+    """
+
+    def __init__(self, high: float = float("inf"), low: float = float("-inf"), audit_rate: float = GRADER_AUDIT_RATE):
+        self.high = high
+        self.low = low
+        self.audit_rate = audit_rate
+        # 评分日志由单个后台线程写：请求路径上只做序列化和入队，文件句柄常开，大小按写入字节数累计
+        self._log_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="grader-log")
+        self._log_file = None
+        self._log_file_path = None
+        self._log_bytes = 0
+
+    @classmethod
+    def from_file(cls, path: str = GRADER_THRESHOLDS_PATH):
+        if not os.path.exists(path):
+            return cls()
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        # 未生效的阈值在文件里记为 null
+        high = data.get("high")
+        low = data.get("low")
+        return cls(
+            high=float("inf") if high is None else high,
+            low=float("-inf") if low is None else low,
+        )
+
+    def decide(self, scores: list):
+        """
+        返回 "yes" / "no"，落在中间地带 (或没有得分) 时返回 None，表示需要 LLM 评分。
+        """
+        if not scores:
+            return None
+        top = max(scores)
+        if top >= self.high:
+            return "yes"
+        if top <= self.low:
+            return "no"
+        return None
+
+    def should_audit(self) -> bool:
+        """
+        短路区间里按小比例仍然调用 LLM，用来持续检验阈值是否漂移，也让标定数据不只来自中间地带。
+        """
+        return random.random() < self.audit_rate
+
+    def log_decision(self, query: str, scores: list, grade: str, shortcut: str = None, path: str = GRADER_LOG_PATH):
+        """
+        记录一次 LLM 评分，供离线标定。shortcut 为该请求在当前阈值下本可走的短路结果 (审计样本)。
+        - 问题只记哈希 (用于去重和对账)，原文要显式打开 GRADER_LOG_QUERY_TEXT 才写入；
+        - weight 是这条记录代表的请求数：中间地带每次都调 LLM，记 1；短路区间只有 audit_rate 的请求被抽查，
+          记 1 / audit_rate。标定时按权重统计，审计样本才不会被中间地带的样本淹没；
+        - 只在这里序列化，写文件交给后台线程，不阻塞评分节点。
+        """
+        record = {
+            "ts": time.time(),
+            "query_sha256": hashlib.sha256(query.encode("utf-8")).hexdigest(),
+            "scores": [round(s, 4) for s in scores],
+            "top_score": round(max(scores), 4) if scores else None,
+            "grade": grade,
+            "shortcut": shortcut,
+            "weight": 1.0 / self.audit_rate if shortcut is not None and self.audit_rate > 0 else 1.0,
+        }
+        if GRADER_LOG_QUERY_TEXT:
+            record["query"] = query
+        self._log_executor.submit(self._write_record, path, json.dumps(record, ensure_ascii=False) + "\n")
+
+    def _write_record(self, path: str, line: str):
+        """
+        后台线程：追加一行；累计超过 GRADER_LOG_MAX_BYTES 时轮转为 path + ".1"，磁盘上最多保留两份。
+        """
+        try:
+            if self._log_file is not None and (self._log_file_path != path or self._log_bytes >= GRADER_LOG_MAX_BYTES):
+                self._log_file.close()
+                self._log_file = None
+                if self._log_file_path == path:
+                    os.replace(path, path + ".1")
+            if self._log_file is None:
+                if os.path.dirname(path):
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                self._log_file = open(path, "a", encoding="utf-8")
+                self._log_file_path = path
+                self._log_bytes = self._log_file.tell()
+            data = line.encode("utf-8")
+            self._log_file.write(line)
+            self._log_file.flush()
+            self._log_bytes += len(data)
+        except OSError as e:
+            if self._log_file is not None:
+                self._log_file.close()
+                self._log_file = None
+            logger.warning("--- ⚠️ 评分日志写入失败: %s ---", e)
+
+    def close_log(self):
+        """
+        等排队的记录写完并关闭文件 (进程退出时线程池也会自动等它们写完)。
+        """
+        self._log_executor.shutdown(wait=True)
+        if self._log_file is not None:
+            self._log_file.close()
+            self._log_file = None
+
+grade_policy = GradePolicy.from_file()
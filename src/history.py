@@ -0,0 +1,206 @@
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from .config import (
+    HISTORY_MAX_TURNS,
+    HISTORY_TOKEN_BUDGET,
+    HISTORY_SUMMARY_MAX_CHARS,
+    HISTORY_MAX_PENDING_LINES,
+    HISTORY_LOG_COMPACT_LINES,
+)
+from .utils import get_deepseek_model
+from .prompts import SUMMARY
+from .schema import append_log
+
+
+SUMMARY_PREFIX = "【前情摘要】"
+
+_CJK_RE = re.compile(r"[\u3000-\u303f\u3400-\u9fff\uff00-\uffef]")
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    粗略估算 token 数：中文基本一字一 token，其余字符按 4 个一 token 计。
+    这里只用于裁剪预算，不需要 tiktoken 那样精确，胜在不占主路径时间。
+    """
+    cjk = len(_CJK_RE.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def summarize_history(summary: str, lines: list) -> str:
+    """
+    默认摘要器：把旧摘要和新滑出窗口的对话交给 DeepSeek 折叠成一段新摘要。
+    """
+    model = get_deepseek_model(temperature=0.1, node="summary")
+    response = model.run(SUMMARY.render(summary=summary or "无", lines="\n".join(lines)))
+    return response.choices[0].message.content.strip()
+
+
+def _truncate_summary(summary: str, lines: list) -> str:
+    """
+    兜底折叠：不调模型，直接拼接后保留最近的部分。
+    """
+    merged = "\n".join(([summary] if summary else []) + list(lines))
+    return merged[-HISTORY_SUMMARY_MAX_CHARS:]
+
+
+def reset_log(lines: list) -> dict:
+    """
+    history_log 的整体替换写入 (见 schema.append_log)。
+    """
+    return {"reset": list(lines)}
+
+
+def apply_update(state: dict, update: dict) -> dict:
+    """
+    图外使用 (压测脚本) 时按 AgentState 的 reducer 语义合并 append_turn 的返回值。
+    """
+    merged = dict(state)
+    for key, value in update.items():
+        merged[key] = append_log(state.get(key), value) if key == "history_log" else value
+    return merged
+
+
+class HistoryManager:
+    """
+    有界对话历史，存成一份只追加的日志加两个偏移量：
+    - history_log        对话日志，每轮只追加一问一答两行 (reducer 负责拼接，节点不复制整个列表)；
+    - history_folded     日志前 history_folded 行已并入摘要；
+    - history_offset     原文窗口的起点，窗口只保留最近若干轮并受 token 预算约束，
+                         [history_folded, history_offset) 是刚滑出窗口、还没折叠进摘要的行；
+    - history_summary    更早对话的滚动摘要。
+
+    已折叠的行积累到 compact_lines 行时才把日志整体重写一次 (丢掉已折叠部分)，其余轮次的写入都是增量。
+    摘要在后台线程里生成，不阻塞当前轮的回答；结果在后续轮次里被取回并写入 state。
+    所有数据都存放在 state 中，进程重启后丢失的只是尚未完成的摘要任务，下一轮会重新提交。
+    """
+
+    def __init__(
+        self,
+        max_turns: int = HISTORY_MAX_TURNS,
+        token_budget: int = HISTORY_TOKEN_BUDGET,
+        max_pending_lines: int = HISTORY_MAX_PENDING_LINES,
+        summarizer=summarize_history,
+        max_jobs: int = 256,
+        compact_lines: int = HISTORY_LOG_COMPACT_LINES,
+    ):
+        self.max_turns = max_turns
+        self.token_budget = token_budget
+        self.max_pending_lines = max_pending_lines
+        self.summarizer = summarizer
+        self.max_jobs = max_jobs
+        self.compact_lines = compact_lines
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="history-summary")
+
+    def view(self, state, recent_lines: int = None) -> list:
+        """
+        Router / Contextualize / Answer 共用的紧凑视图：[摘要] + 待折叠行 + 最近原文。
+        recent_lines 只截取原文窗口的尾部，摘要和待折叠行总是保留，保证各节点看到的前情一致。
+        """
+        log = state.get("history_log") or []
+        folded = state.get("history_folded") or 0
+        offset = state.get("history_offset") or 0
+        summary = state.get("history_summary") or ""
+        pending = log[folded:offset]
+        window = log[offset:]
+        if recent_lines is not None:
+            window = window[-recent_lines:] if recent_lines > 0 else []
+        head = [f"{SUMMARY_PREFIX}{summary}"] if summary else []
+        return head + list(pending) + list(window)
+
+    def append_turn(self, state, user_line: str, ai_line: str) -> dict:
+        """
+        追加一轮问答并完成裁剪，返回需要写回 state 的字段 (history_log 只含新增的两行，或压缩后的整份日志)。
+        """
+        new_lines = [user_line, ai_line]
+        log = list(state.get("history_log") or []) + new_lines
+        folded = state.get("history_folded") or 0
+        offset = state.get("history_offset") or 0
+        old_summary = state.get("history_summary") or ""
+
+        # 1. 窗口超出轮数或 token 预算时，按整轮 (两行) 从最早处移出，至少保留最新一轮
+        while len(log) - offset > 2 and (
+            len(log) - offset > self.max_turns * 2
+            or sum(estimate_tokens(line) for line in log[offset:]) > self.token_budget
+        ):
+            offset += 2
+
+        # 2. 把后台已完成的摘要取回来，并为剩余的待折叠行提交新任务
+        pending = log[folded:offset]
+        summary, remaining = self._fold(old_summary, pending)
+        folded += len(pending) - len(remaining)
+
+        update = {"history_log": new_lines, "history_offset": offset, "history_folded": folded}
+        # 3. 已折叠的行攒够了才重写整份日志，偏移量随之平移
+        if folded >= self.compact_lines:
+            update = {"history_log": reset_log(log[folded:]), "history_offset": offset - folded, "history_folded": 0}
+        if summary != old_summary:
+            update["history_summary"] = summary
+        return update
+
+    def _fold(self, summary: str, pending: list):
+        if not pending:
+            return summary, pending
+
+        with self._lock:
+            # 后台任务可能只覆盖了 pending 的前缀 (任务提交之后又有新行滑出)，从长到短查找
+            in_flight = False
+            for n in range(len(pending), 0, -1):
+                key = self._job_key(summary, pending[:n])
+                future = self._jobs.get(key)
+                if future is None:
+                    continue
+                if not future.done():
+                    # 还在算，本轮先带着 pending 走，不重复提交
+                    in_flight = True
+                    break
+                del self._jobs[key]
+                try:
+                    new_summary = future.result()[:HISTORY_SUMMARY_MAX_CHARS]
+                except Exception:
+                    new_summary = _truncate_summary(summary, pending[:n])
+                summary, pending = new_summary, pending[n:]
+                break
+
+            # 积压过多 (摘要器太慢或一直失败)，同步截断兜底，保证 state 有界
+            if len(pending) > self.max_pending_lines:
+                overflow = len(pending) - self.max_pending_lines
+                summary = _truncate_summary(summary, pending[:overflow])
+                pending = pending[overflow:]
+
+            if pending and not in_flight:
+                key = self._job_key(summary, pending)
+                if key not in self._jobs:
+                    self._jobs[key] = self._executor.submit(self.summarizer, summary, list(pending))
+                    while len(self._jobs) > self.max_jobs:
+                        self._jobs.popitem(last=False)
+
+        return summary, pending
+
+    @staticmethod
+    def _job_key(summary: str, lines: list) -> str:
+        digest = hashlib.sha1(summary.encode("utf-8"))
+        for line in lines:
+            digest.update(b"\x00" + line.encode("utf-8"))
+        return digest.hexdigest()
+
+    def flush(self, timeout: float = None):
+        """
+        等待所有后台摘要任务结束 (用于测试、压测和进程退出前)。
+        """
+        with self._lock:
+            futures = list(self._jobs.values())
+        for future in futures:
+            try:
+                future.result(timeout=timeout)
+            except Exception:
+                pass
+
+
+# 全局共享一个实例，所有节点读到的是同一套裁剪规则
+history_manager = HistoryManager()
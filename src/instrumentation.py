@@ -0,0 +1,417 @@
+import bisect
+import json
+import logging
+import os
+import random
+import threading
+import time
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from .config import LOG_LEVEL, INSTRUMENTATION_SAMPLE_RATE, INSTRUMENTATION_EVENTS_PATH, INSTRUMENTATION_RECORD_PROMPTS
+from .prompts import identify as identify_prompt
+from .stats import RollingWindow
+
+logger = logging.getLogger(__name__)
+
+# 毫秒延迟的直方图桶上界 (Prometheus 累积桶)
+LATENCY_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+# 检索相似度的直方图桶上界
+SCORE_BUCKETS = (0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0)
+
+METRIC_PREFIX = "zengraph_"
+
+
+def configure_logging(level: str = LOG_LEVEL):
+    """
+    节点的过程日志默认不输出 (WARNING)；设置 ZENGRAPH_LOG_LEVEL=INFO 恢复以前逐步打印的效果。
+    只调整本项目的 logger，不放开 httpx 等第三方库的 INFO 日志。
+    """
+    root = logging.getLogger(__name__.split(".")[0])
+    root.setLevel(level.upper() if isinstance(level, str) else level)
+    if not root.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        root.addHandler(handler)
+        root.propagate = False
+
+
+class Histogram:
+    """
+    进程内直方图：累积桶计数 (自启动以来，供 Prometheus 抓取) + 最近 window 个样本的滑动窗口 (在线查分位数)。
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS_MS, window: int = 1024):
+        self.buckets = tuple(buckets)
+        self.bucket_counts = [0] * (len(self.buckets) + 1)  # 最后一格是 +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.window = RollingWindow(window)
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.bucket_counts[index] += 1
+            self.count += 1
+            self.sum += value
+        self.window.add(value)
+
+    def percentile(self, q: float) -> float:
+        return self.window.percentile(q)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            count, total = self.count, self.sum
+        return {
+            "count": count,
+            "mean": total / count if count else 0.0,
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+            "p99": self.percentile(99),
+        }
+
+
+class JsonlSink:
+    """
+    结构化事件逐行追加到 JSONL 文件，第一次写入时才打开文件。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = None
+        self._lock = threading.Lock()
+
+    def emit(self, event: dict):
+        line = json.dumps(event, ensure_ascii=False, default=str) + "\n"
+        with self._lock:
+            if self._file is None:
+                if os.path.dirname(self.path):
+                    os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                self._file = open(self.path, "a", encoding="utf-8")
+            self._file.write(line)
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+class LoggingSink:
+    """
+    把结构化事件写进日志 (默认 DEBUG 级别)，调试时用。
+    """
+
+    def __init__(self, level: int = logging.DEBUG):
+        self.level = level
+
+    def emit(self, event: dict):
+        if logger.isEnabledFor(self.level):
+            logger.log(self.level, json.dumps(event, ensure_ascii=False, default=str))
+
+
+def _cache_hit_tokens(usage):
+    """
+    上游前缀缓存命中的 token 数：DeepSeek 返回 prompt_cache_hit_tokens，
+    OpenAI 兼容接口返回 prompt_tokens_details.cached_tokens；都没有时返回 None。
+    """
+    if usage is None:
+        return None
+    hit = getattr(usage, "prompt_cache_hit_tokens", None)
+    if hit is None:
+        hit = getattr(getattr(usage, "prompt_tokens_details", None), "cached_tokens", None)
+    return hit
+
+
+def _plain_message(message) -> dict:
+    if isinstance(message, dict):
+        return {"role": message.get("role"), "content": message.get("content")}
+    return {"role": getattr(message, "role", None), "content": getattr(message, "content", None)}
+
+
+def _label_key(labels: dict) -> tuple:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(key: tuple, extra: tuple = ()) -> str:
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+class Instrumentation:
+    """
+    埋点中心：
+    - wrap_node()     包住 LangGraph 节点，记录耗时、路由、loop_step、检索得分、评分结论；
+    - install_model() 包住模型的 run / arun，记录耗时、prompt / completion token、上游前缀缓存命中的 token、
+                      是否命中请求合并，以及提示词 ID (record_prompts 时事件里附带完整消息)；
+    - 聚合指标 (直方图 + 计数器) 总是全量统计，可在进程内查询或以 Prometheus 文本格式导出；
+    - 逐条的结构化事件按 sample_rate 采样后送往各个 sink (出错的事件不采样，总是保留)。
+    """
+
+    def __init__(self, sample_rate: float = 1.0, sinks=None, record_prompts: bool = False):
+        self.sample_rate = sample_rate
+        self.sinks = list(sinks or [])
+        self.record_prompts = record_prompts
+        self._histograms = {}                 # (name, labels) -> Histogram
+        self._counters = defaultdict(float)   # (name, labels) -> value
+        self._lock = threading.Lock()
+
+    # --------------------------------------------------------------------------
+    # 聚合指标
+    # --------------------------------------------------------------------------
+    def histogram(self, name: str, buckets=LATENCY_BUCKETS_MS, **labels) -> Histogram:
+        key = (name, _label_key(labels))
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            with self._lock:
+                histogram = self._histograms.setdefault(key, Histogram(buckets))
+        return histogram
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._counters[key] += value
+
+    def add_sink(self, sink):
+        self.sinks.append(sink)
+
+    def emit(self, event: dict):
+        if not self.sinks:
+            return
+        if not event.get("error") and random.random() >= self.sample_rate:
+            return
+        event.setdefault("ts", time.time())
+        for sink in self.sinks:
+            try:
+                sink.emit(event)
+            except Exception as e:
+                logger.warning("--- ⚠️ 埋点事件写入失败 (%s): %s ---", type(sink).__name__, e)
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+
+    # --------------------------------------------------------------------------
+    # 节点
+    # --------------------------------------------------------------------------
+    def record_node(self, node: str, elapsed_ms: float, state: dict, update: dict,
+                    thread_id: str = None, error: str = None):
+        self.histogram("node_latency_ms", node=node).observe(elapsed_ms)
+        self.inc("node_calls_total", node=node)
+        if error:
+            self.inc("node_errors_total", node=node, error=error)
+
+        scores = [score for _, score in update.get("retrieved_refs") or []]
+        if scores:
+            self.histogram("retrieval_top_score", buckets=SCORE_BUCKETS).observe(max(scores))
+        if update.get("route"):
+            self.inc("route_total", route=update["route"])
+        if update.get("grade"):
+            self.inc("grade_total", grade=update["grade"], source=update.get("grade_source", node))
+
+        self.emit({
+            "type": "node",
+            "node": node,
+            "thread_id": thread_id,
+            "ms": round(elapsed_ms, 2),
+            "route": update.get("route", state.get("route")),
+            "loop_step": update.get("loop_step", state.get("loop_step", 0)),
+            "retrieval_scores": [round(s, 4) for s in scores] if scores else None,
+            "grade": update.get("grade"),
+            "grade_source": update.get("grade_source"),
+            "error": error,
+        })
+
+    def wrap_node(self, name: str, fn):
+        """
+        返回带埋点的节点函数。签名里带 config，LangGraph 会把 thread_id 等运行配置传进来。
+        (不用 functools.wraps：它会让 LangGraph 按原函数签名判断，从而不再传 config)
+        """
+        def instrumented(state, config):
+            thread_id = (config or {}).get("configurable", {}).get("thread_id")
+            start = time.perf_counter()
+            update, error = None, None
+            try:
+                update = fn(state)
+                return update
+            except BaseException as e:
+                error = type(e).__name__
+                raise
+            finally:
+                elapsed_ms = (time.perf_counter() - start) * 1000
+                self.record_node(name, elapsed_ms, state, update if isinstance(update, dict) else {}, thread_id, error)
+
+        instrumented.__name__ = getattr(fn, "__name__", name)
+        return instrumented
+
+    # --------------------------------------------------------------------------
+    # 模型调用
+    # --------------------------------------------------------------------------
+    def record_llm(self, node: str, elapsed_ms: float, response=None, shared: bool = False, error: str = None,
+                   messages=None):
+        usage = getattr(response, "usage", None)
+        prompt_tokens = getattr(usage, "prompt_tokens", None)
+        completion_tokens = getattr(usage, "completion_tokens", None)
+        cache_hit_tokens = _cache_hit_tokens(usage)
+        prompt_id = identify_prompt(messages)
+
+        self.histogram("llm_latency_ms", node=node).observe(elapsed_ms)
+        self.inc("llm_calls_total", node=node)
+        if error:
+            self.inc("llm_errors_total", node=node, error=error)
+        if shared:
+            # 合并命中的调用没有自己的上游开销，token 只记在领头的那次上
+            self.inc("llm_coalesced_total", node=node)
+        else:
+            if prompt_tokens:
+                self.inc("llm_prompt_tokens_total", prompt_tokens, node=node)
+            if completion_tokens:
+                self.inc("llm_completion_tokens_total", completion_tokens, node=node)
+            if cache_hit_tokens is not None:
+                self.inc("llm_prompt_cache_hit_tokens_total", cache_hit_tokens, node=node)
+
+        event = {
+            "type": "llm",
+            "node": node,
+            "prompt_id": prompt_id,
+            "ms": round(elapsed_ms, 2),
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "cache_hit_tokens": cache_hit_tokens,
+            "coalesced": shared,
+            "error": error,
+        }
+        if self.record_prompts and messages:
+            event["messages"] = [_plain_message(m) for m in messages]
+        self.emit(event)
+
+    def install_model(self, model, node: str, flight=None):
+        """
+        给 Camel 模型实例的 run / arun 套上埋点。应装在最外层，这样记录的是调用方真正等待的时间。
+        flight: 该模型装了请求合并时传入，用来判断这次调用是否命中合并。
+        """
+        raw_run = model.run
+        raw_arun = getattr(model, "arun", None)
+
+        def run(messages, response_format=None, tools=None):
+            start = time.perf_counter()
+            response, error = None, None
+            try:
+                response = raw_run(messages, response_format, tools)
+                return response
+            except BaseException as e:
+                error = type(e).__name__
+                raise
+            finally:
+                shared = flight.last_shared() if flight is not None and error is None else False
+                self.record_llm(node, (time.perf_counter() - start) * 1000, response, shared, error, messages)
+
+        model.run = run
+
+        if raw_arun is not None:
+            async def arun(messages, response_format=None, tools=None):
+                start = time.perf_counter()
+                response, error = None, None
+                try:
+                    response = await raw_arun(messages, response_format, tools)
+                    return response
+                except BaseException as e:
+                    error = type(e).__name__
+                    raise
+                finally:
+                    shared = flight.last_shared() if flight is not None and error is None else False
+                    self.record_llm(node, (time.perf_counter() - start) * 1000, response, shared, error, messages)
+
+            model.arun = arun
+
+        return model
+
+    # --------------------------------------------------------------------------
+    # 导出
+    # --------------------------------------------------------------------------
+    def snapshot(self) -> dict:
+        """
+        进程内查询用：{"histograms": {"node_latency_ms{node=answer}": {...}}, "counters": {...}}
+        """
+        with self._lock:
+            histograms = list(self._histograms.items())
+            counters = list(self._counters.items())
+
+        def name_of(name, key):
+            return name + ("{" + ",".join(f"{k}={v}" for k, v in key) + "}" if key else "")
+
+        return {
+            "histograms": {name_of(name, key): h.snapshot() for (name, key), h in histograms},
+            "counters": {name_of(name, key): value for (name, key), value in counters},
+        }
+
+    def render_prometheus(self) -> str:
+        with self._lock:
+            histograms = sorted(self._histograms.items())
+            counters = sorted(self._counters.items())
+
+        lines = []
+        typed = set()
+        for (name, key), value in counters:
+            metric = METRIC_PREFIX + name
+            if metric not in typed:
+                lines.append(f"# TYPE {metric} counter")
+                typed.add(metric)
+            lines.append(f"{metric}{_format_labels(key)} {value:g}")
+
+        for (name, key), h in histograms:
+            metric = METRIC_PREFIX + name
+            if metric not in typed:
+                lines.append(f"# TYPE {metric} histogram")
+                typed.add(metric)
+            with h._lock:
+                bucket_counts, count, total = list(h.bucket_counts), h.count, h.sum
+            cumulative = 0
+            for bound, n in zip(list(h.buckets) + ["+Inf"], bucket_counts):
+                cumulative += n
+                lines.append(f"{metric}_bucket{_format_labels(key, (('le', bound),))} {cumulative}")
+            lines.append(f"{metric}_sum{_format_labels(key)} {total:g}")
+            lines.append(f"{metric}_count{_format_labels(key)} {count}")
+        return "\n".join(lines) + "\n"
+
+    def serve_prometheus(self, port: int, host: str = "0.0.0.0"):
+        """
+        在后台线程起一个 /metrics 端点 (Prometheus 文本格式)，返回 server 以便关闭。
+        """
+        instrumentation = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                if self.path.rstrip("/") != "/metrics":
+                    self.send_error(404)
+                    return
+                data = instrumentation.render_prometheus().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        logger.info("--- 📈 Prometheus 指标端点: http://%s:%s/metrics ---", host, server.server_address[1])
+        return server
+
+
+# 进程级共享：所有节点、所有模型调用都记到这里
+instrumentation = Instrumentation(sample_rate=INSTRUMENTATION_SAMPLE_RATE, record_prompts=INSTRUMENTATION_RECORD_PROMPTS)
+if INSTRUMENTATION_EVENTS_PATH:
+    instrumentation.add_sink(JsonlSink(INSTRUMENTATION_EVENTS_PATH))
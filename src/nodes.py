@@ -1,39 +1,82 @@
-from .retriever import BuddhistRecursiveRetriever
-from .agents import get_buddhist_master_response
+import time
+import logging
+import threading
+from collections import OrderedDict
+from .agents import get_buddhist_master_response, stream_buddhist_master_response
 from .schema import AgentState
+from .history import history_manager
+from .grading import grade_policy
+from .prompts import ROUTER, HYDE, GRADER, CONTEXTUALIZE
 from .utils import get_deepseek_model, convert_to_simplified
+from .config import GRAPH_DEADLINE_SECONDS, RETRIEVER_BACKEND
+from .resilience import LLMUnavailable
 from camel.messages import BaseMessage
+from langgraph.config import get_config, get_stream_writer
 
+logger = logging.getLogger(__name__)
 
-# 初始化一次检索器，避免重复加载
-retriever_obj = BuddhistRecursiveRetriever()
+
+# 检索器只初始化一次，避免重复加载；延迟到第一次检索时再加载嵌入模型和索引，
+# 这样压测脚本可以在那之前用 set_retriever() 换成轻量实现
+_retriever = None
+_retriever_lock = threading.Lock()
+
+# 父块原文不会变，按 ID 组合缓存拼好的上下文：同一轮里 grade 和 answer 只取一次
+_context_cache = OrderedDict()
+_context_cache_lock = threading.Lock()
+CONTEXT_CACHE_SIZE = 256
+
+# 兜底节点清空检索结果后，answer 用这段“系统提示”代替经文
+FALLBACK_CONTEXT = (
+    "【系统提示】：经过仔细检索，经文数据库中完全没有找到与用户问题相关的内容。"
+    "请你无视之前的指令，直接用慈悲、遗憾的语气告知用户："
+    "贫僧才疏学浅，在现有的经律论中未曾读到与此相关的记载，无法强行解答。"
+    "请不要编造内容，直接实话实说。"
+)
+
+
+def get_retriever():
+    global _retriever
+    if _retriever is None:
+        with _retriever_lock:
+            if _retriever is None:
+                if RETRIEVER_BACKEND == "sidecar":
+                    # 嵌入模型和索引都在 sidecar 进程里，worker 不需要加载 llama-index
+                    from .retrieval_service import RetrieverClient
+                    _retriever = RetrieverClient()
+                else:
+                    from .retriever import BuddhistRecursiveRetriever
+                    _retriever = BuddhistRecursiveRetriever()
+    return _retriever
+
+
+def set_retriever(retriever):
+    """
+    替换检索器：任何提供 retrieve(text) -> list[RetrievedChunk] 与 get_texts(node_ids) 的对象都可以。
+    """
+    global _retriever
+    _retriever = retriever
+    with _context_cache_lock:
+        _context_cache.clear()
 
 
 def intent_router_node(state):
-    print("--- 🚦 正在进行意图分流 (Router) ---")
+    logger.info("--- 🚦 正在进行意图分流 (Router) ---")
     query = state["query"]
-    chat_history = state.get("chat_history", [])
+    chat_history = history_manager.view(state, recent_lines=2)
+    # 每轮从这里开始计时：检索-评分-重写循环必须在截止时间前结束，否则直接兜底
+    deadline = time.time() + GRAPH_DEADLINE_SECONDS
     
     # 如果没有历史，必然是新话题，但不一定是 HyDE，先简单判断
     if not chat_history:
         # 这里可以简单判断：如果是短语去 HyDE，如果是长句直接搜
         # 为了演示，我们默认无历史就走 HyDE 增强
-        return {"route": "hyde"}
+        return {"route": "hyde", "deadline": deadline}
 
     # 有历史，需要判断是"顺着聊"还是"起新头"
-    # 构造 Prompt：让模型做选择题
-    router_prompt = (
-        f"之前的对话历史：\n{chat_history[-2:]}\n\n"
-        f"用户当前输入：'{query}'\n\n"
-        f"请分析用户输入的意图，并严格从以下三个选项中选择一个返回：\n"
-        f"1. 'contextualize': 用户在追问之前的话题，包含代词（如'它'、'那个'）或省略主语（如'怎么做'），需要结合上下文补全。\n"
-        f"2. 'hyde': 用户开启了一个新的佛学话题，且问题比较抽象，需要生成假设性文档来辅助检索。\n"
-        f"3. 'direct': 只是简单的闲聊（如'谢谢'、'你好'），或者是极其精准的搜索词，不需要任何处理。\n"
-        f"【只输出选项单词，不要解释】"
-    )
-    
-    model = get_deepseek_model(temperature=0.1) # 路由要极其冷静
-    msg_list = [{"role": "user", "content": router_prompt}]
+    # 构造 Prompt：让模型做选择题 (选项说明是固定前缀，历史和输入在后)
+    model = get_deepseek_model(temperature=0.1, node="intent_router", deadline=deadline) # 路由要极其冷静
+    msg_list = ROUTER.render(history="\n".join(chat_history), query=query)
     
     try:
         response = model.run(msg_list)
@@ -50,44 +93,100 @@ def intent_router_node(state):
     except Exception:
         decision = "direct" # 出错就直连，最稳妥
 
-    print(f"--- 🚦 分流决定: {decision.upper()} ---")
-    return {"route": decision}
+    logger.info("--- 🚦 分流决定: %s ---", decision.upper())
+    return {"route": decision, "deadline": deadline}
+
+
+def format_context(texts: list) -> str:
+    return "\n\n".join(texts)
+
+
+def resolve_context(node_ids: list) -> str:
+    """
+    由父块 ID 从父块库还原检索上下文 (带 LRU 缓存)。
+    """
+    key = tuple(node_ids)
+    with _context_cache_lock:
+        if key in _context_cache:
+            _context_cache.move_to_end(key)
+            return _context_cache[key]
+    context = format_context(get_retriever().get_texts(list(node_ids)))
+    with _context_cache_lock:
+        _context_cache[key] = context
+        while len(_context_cache) > CONTEXT_CACHE_SIZE:
+            _context_cache.popitem(last=False)
+    return context
+
+
+def retrieval_scores(state) -> list:
+    return [score for _, score in state.get("retrieved_refs") or []]
+
+
+def retrieved_context(state) -> str:
+    """
+    grade / answer 用到经文时才按 retrieved_refs 取原文；兜底之后 refs 为空，返回兜底提示。
+    """
+    refs = state.get("retrieved_refs")
+    if not refs:
+        return FALLBACK_CONTEXT
+    return resolve_context([node_id for node_id, _ in refs])
 
 
 def retrieve_node(state: AgentState):
-    print("--- 正在递归检索深度语境 ---")
-    response = retriever_obj.query(state["query"])
-    return {"retrieved_context": str(response)}
+    logger.info("--- 正在递归检索深度语境 ---")
+    chunks = get_retriever().retrieve(state["query"])
+    # state 里只存 (父块 ID, 得分)，每个 superstep 的 checkpoint 不再复制整段经文
+    return {"retrieved_refs": [(c.node_id, c.score) for c in chunks]}
+
+
+def _stream_tokens_enabled() -> bool:
+    """
+    调用方在 config["configurable"]["stream_tokens"] 里打开时，回答逐段写进 LangGraph 的 custom 流。
+    """
+    try:
+        return bool(get_config().get("configurable", {}).get("stream_tokens"))
+    except RuntimeError:
+        # 不在图的运行上下文里 (例如单独调用节点函数)
+        return False
 
 
 def answer_node(state: AgentState):
-    print("--- 正在生成最终回答 (Answer) ---")
+    logger.info("--- 正在生成最终回答 (Answer) ---")
     question = state["query"]
-    context = state["retrieved_context"]
-    # 1. 获取当前历史
-    history = state.get("chat_history", [])
-    # 2. 调用法师，传入历史
-    answer = get_buddhist_master_response(
-        question,
-        context,
-        history
-    )
-# 3. 更新历史 (把这一轮的问答追加进去)
+    context = retrieved_context(state)
+    # 1. 获取当前历史的紧凑视图 (摘要 + 最近几轮原文)
+    history = history_manager.view(state)
+    # 2. 调用法师，传入历史 (需要流式时逐段推给 stream_mode="custom" 的订阅者)
+    if _stream_tokens_enabled():
+        writer = get_stream_writer()
+        answer = stream_buddhist_master_response(
+            question,
+            context,
+            history,
+            on_token=lambda text: writer({"token": text})
+        )
+    else:
+        answer = get_buddhist_master_response(
+            question,
+            context,
+            history
+        )
+# 3. 更新历史 (追加这一轮问答，超出窗口的旧轮次交给后台折叠成摘要)
     new_record_user = f"信众: {question}"
     new_record_ai = f"法师: {answer}"
-    updated_history = history + [new_record_user, new_record_ai]
+    history_update = history_manager.append_turn(state, new_record_user, new_record_ai)
     
-    print(f"--- 🗣️ 法师回复: {answer[:30]}... ---")
+    logger.info("--- 🗣️ 法师回复: %s... ---", answer[:30])
     
     # 4. 返回新的 state，LangGraph 会自动更新
     return {
         "final_answer": answer, # 如果你需要在外面打印
-        "chat_history": updated_history 
+        **history_update
     }
 
 
 def rewrite_query_node(state):
-    print("--- 🔄 启用 HyDE 技术重写查询 ---")
+    logger.info("--- 🔄 启用 HyDE 技术重写查询 ---")
     
     # 获取当前步数，如果没有则默认为 0
     current_step = state.get("loop_step", 0)
@@ -97,16 +196,11 @@ def rewrite_query_node(state):
     question = state["query"]
     
     # 1. 让 DeepSeek 生成一个“假设性回复”
-    hyde_prompt = (
-        f"请你扮演一位得道高僧。针对以下问题，写一段简短的、充满禅意的回答（100字以内）。"
-        f"这段回答将被用于在经文数据库中进行相似性检索，所以请务必包含核心佛学概念（如因果、无常、般若等）。"
-        f"请直接输出回答内容，不要包含'好的'或'如下'等引语。"
-        f"\n\n信众问题：{question}"
-    )
+    hyde_messages = HYDE.render(question=question)
     
     # 2. 初始化 DeepSeek 模型 (复用 ModelFactory)
     # 这里我们直接创建一个单纯的模型实例，不涉及 Agent 的复杂逻辑
-    deepseek_model = get_deepseek_model(temperature=0.8)
+    deepseek_model = get_deepseek_model(temperature=0.8, node="rewrite", deadline=state.get("deadline"))
     
     # 3. 构造 Camel 消息对象
     #! (废弃) Camel 要求输入必须是 BaseMessage 列表，不能只是字符串
@@ -118,15 +212,12 @@ def rewrite_query_node(state):
     try:
         # 4. 真实调用 DeepSeek
         # run() 方法返回的是一个 OpenAI 格式的 response 对象
-        openai_msg_list = [
-            {"role": "user", "content": hyde_prompt}
-        ]
-        response = deepseek_model.run(openai_msg_list)
+        response = deepseek_model.run(hyde_messages)
         
         # 提取生成的假设性回答
         hypothetical_answer = response.choices[0].message.content
         
-        print(f"--- 🧠 HyDE 幻觉生成: {hypothetical_answer[:30]}... ---")
+        logger.info("--- 🧠 HyDE 幻觉生成: %s... ---", hypothetical_answer[:30])
         
         # 5. 返回生成的答案作为新的查询词
         # LlamaIndex 会拿这段“佛里佛气”的话去匹配真正的经文，成功率极高
@@ -136,7 +227,7 @@ def rewrite_query_node(state):
         }
         
     except Exception as e:
-        print(f"--- ⚠️ HyDE 生成失败，回退到原始查询: {e} ---")
+        logger.warning("--- ⚠️ HyDE 生成失败，回退到原始查询: %s ---", e)
         # 如果模型挂了，为了不让程序崩溃，把原问题还回去
         return {
             "query": question,
@@ -146,29 +237,27 @@ def rewrite_query_node(state):
 
 # --- 新增：相关性打分节点 ---
 def grader_node(state):
-    print("--- ⚖️ 正在评估经文相关性 (Grader) ---")
+    logger.info("--- ⚖️ 正在评估经文相关性 (Grader) ---")
     question = state["query"]
-    context = state["retrieved_context"]
-    
+
     # 如果没检索到内容，直接打回
-    if not context:
+    if not state.get("retrieved_refs"):
         return {"grade": "no"}
+
+    # 1. 相似度足够高或足够低时直接出结论，只有中间地带才请 LLM 阅卷 (短路时不需要取经文原文)
+    scores = retrieval_scores(state)
+    shortcut = grade_policy.decide(scores)
+    if shortcut is not None and not grade_policy.should_audit():
+        logger.info("--- 📝 评分短路: 最高相似度 %.3f -> %s ---", max(scores), shortcut.upper())
+        return {"grade": shortcut, "grade_source": "score"}
     
     # 2. 构造“阅卷人”提示词
     # 技巧：使用思维链提示 (Chain of Thought) 的简化版，强行约束输出格式
-    grader_prompt = (
-        f"你是一名严格的阅卷员。你需要评估检索到的【经文片段】是否能够回答【用户问题】。\n"
-        f"用户问题: {question}\n\n"
-        f"检索到的经文片段: {context}\n\n"
-        f"请判断：经文内容是否与问题存在语义关联，或者能否为回答提供事实依据？\n"
-        f"【严格要求】\n"
-        f"1. 仅输出 'yes' 或 'no'。\n"
-        f"2. 不要包含任何解释、标点符号或其他文字。"
-    )
+    grader_messages = GRADER.render(question=question, context=retrieved_context(state))
     
     # 3. 获取模型
     # 🔥 重点：这里用极低的 temperature (0.1)，让模型变成冷酷的逻辑机器
-    grader_model = get_deepseek_model(temperature=0.1)
+    grader_model = get_deepseek_model(temperature=0.1, node="grade", deadline=state.get("deadline"))
     
     # 4. 包装消息
     # user_msg = BaseMessage.make_user_message(role_name="User", content=grader_prompt)
@@ -176,11 +265,7 @@ def grader_node(state):
     try:
         # 5. 调用模型
         # response = grader_model.run([user_msg])
-        openai_msg_list = [
-            {"role": "user", "content": grader_prompt}
-        ]
-        
-        response = grader_model.run(openai_msg_list)
+        response = grader_model.run(grader_messages)
         
         grade = response.choices[0].message.content.strip().lower()
         
@@ -191,91 +276,54 @@ def grader_node(state):
         else:
             grade = "no"
             
-        print(f"--- 📝 评分结果: {grade.upper()} (经文{'可用' if grade=='yes' else '不可用'}) ---")
-        return {"grade": grade}
+        logger.info("--- 📝 评分结果: %s (经文%s) ---", grade.upper(), "可用" if grade == "yes" else "不可用")
+        # 记录 (得分, LLM 结论)，供离线标定阈值
+        grade_policy.log_decision(question, scores, grade, shortcut)
+        return {"grade": grade, "grade_source": "llm"}
         
+    except LLMUnavailable as e:
+        # 上游超时/被限流：再重写重试只会继续排队，直接用手头的经文作答 (时间预算耗尽时由路由转兜底)
+        logger.warning("--- ⏱️ 评分超出时间预算: %s，跳过评分 ---", e)
+        return {"grade": "error"}
     except Exception as e:
-        print(f"--- ❌ 评分过程出错: {e}，默认判定为不相关 ---")
+        logger.warning("--- ❌ 评分过程出错: %s，默认判定为不相关 ---", e)
         # 遇到报错，为了安全起见，通常选择重试 (no) 或者硬着头皮答 (yes)
         # 这里我们选择触发重写机制
         return {"grade": "no"}
     
     
-def fallback_node(state):
-    """
-    当多次检索都失败时，进入此节点。
-    """
-    print("--- 🙅 超过最大重试次数，触发熔断机制 ---")
-    return {
-        # 返回一个固定的、符合人设的道歉回复
-        "context": "（经文库中未检索到相关内容）", 
-        "query": "无法回答该问题" # 或者保留原问题
-    }
-    
-    
 def fallback_node(state):
     """
     兜底节点：当多次检索均失败时触发。
     它不直接回答，而是把 context 替换成一段“系统提示”，
     让下游的 answer_node (法师) 知道该怎么回答。
     """
-    print("--- 🙅 熔断触发：已达到最大重试次数，放弃检索 ---")
-    
-    # 这里的技巧是：不要给空字符串，而是给一段明确的指令
-    # 这样 DeepSeek 法师看到后，就会按照这个指令去演
-    fallback_context = (
-        "【系统提示】：经过仔细检索，经文数据库中完全没有找到与用户问题相关的内容。"
-        "请你无视之前的指令，直接用慈悲、遗憾的语气告知用户："
-        "贫僧才疏学浅，在现有的经律论中未曾读到与此相关的记载，无法强行解答。"
-        "请不要编造内容，直接实话实说。"
-    )
+    logger.info("--- 🙅 熔断触发：已达到最大重试次数或时间预算耗尽，放弃检索 ---")
     
+    # 这里的技巧是：不要给空字符串，而是给一段明确的指令 (FALLBACK_CONTEXT)
+    # 清空检索结果，answer 取上下文时就会换成这段指令，DeepSeek 法师看到后会按指令去演
     return {
-        "context": fallback_context, 
+        "retrieved_refs": [],
         # 可以选择把 grade 重置，虽然这里已经不重要了
         "grade": "no" 
     }
     
     
 def contextualize_node(state):
-    print("--- 🧠 进入补全模式 (Contextualize) ---")
+    logger.info("--- 🧠 进入补全模式 (Contextualize) ---")
     question = convert_to_simplified(state["query"])
-    chat_history = state.get("chat_history", [])
-    
-    # 1. 准备历史记录字符串 (只取最近 3-4 句即可，太多了容易干扰)
-    # 如果 history 是列表 ["User: ...", "AI: ..."]，我们把它拼成字符串
-    history_context = "\n".join(chat_history[-4:]) if chat_history else "无"
+    # 1. 准备历史记录字符串 (摘要 + 最近 4 句原文，太多了容易干扰)
+    # 和 Router 读同一份紧凑视图，保证两边看到的前情一致
+    chat_history = history_manager.view(state, recent_lines=4)
+    history_context = "\n".join(chat_history) if chat_history else "无"
 
     # 2. 构造“严防死守”的 Prompt
-    # 这里的技巧是：给 Few-Shot (少样本示例) + 负面约束 (Negative Constraints)
-    prompt = (
-        f"你是一个专业的语言助手。你的唯一任务是根据【对话历史】，将用户的【最新问题】重写为一个独立、完整的问句。\n\n"
-        
-        f"--- 对话历史 ---\n"
-        f"{history_context}\n\n"
-        
-        f"--- 用户最新问题 ---\n"
-        f"{question}\n\n"
-        
-        f"--- 严格约束 (必须遵守) ---\n"
-        f"1. 核心任务：消解指代词（把'它'、'那'替换为具体名词），补全省略的主语。\n"
-        f"2. ❌ 严禁回答问题：不要输出任何答案。\n"
-        f"3. ❌ 严禁发挥想象：不要添加任何原本不存在的形容词、成语、佛学术语（如'明镜'、'菩提'等）。\n"
-        f"4. ✅ 保持原意：只做语法层面的修正，不要改变用户的情感色彩。\n\n"
-        
-        f"--- 示例 ---\n"
-        f"例1：\n历史：'我很焦虑。'\n用户：'怎么做？'\n输出：'如何克服焦虑？'\n\n"
-        f"例2：\n历史：'什么是缘起性空？'\n用户：'它和唯识有什么区别？'\n输出：'缘起性空和唯识有什么区别？'\n\n"
-        
-        f"请直接输出重写后的句子："
-    )
+    # 这里的技巧是：给 Few-Shot (少样本示例) + 负面约束 (Negative Constraints)，都放在固定前缀里
+    msg_list = CONTEXTUALIZE.render(history=history_context, question=question)
 
     # 3. 获取模型 (关键：Temperature 设为 0.1 或 0.2)
     # 这里的低温是为了让模型"丧失创造力"，变成一个冷酷的逻辑机器
-    model = get_deepseek_model(temperature=0.1)
-
-    # 4. 构造消息列表 (使用 OpenAI 标准字典格式，确保不报错)
-    msg_list = [{"role": "user", "content": prompt}]
+    model = get_deepseek_model(temperature=0.1, node="contextualize", deadline=state.get("deadline"))
 
     try:
         # 5. 调用模型
@@ -290,12 +338,12 @@ def contextualize_node(state):
              # 取冒号后面的部分
             new_query = new_query.split("：")[-1]
             
-        print(f"--- 🎯 补全结果: '{question}' -> '{new_query}' ---")
+        logger.info("--- 🎯 补全结果: '%s' -> '%s' ---", question, new_query)
         
         # 7. 返回结果：只更新 standalone_query，绝对不碰 query
         return {"standalone_query": new_query}
 
     except Exception as e:
-        print(f"--- ⚠️ 补全失败 ({str(e)})，回退到原问题 ---")
+        logger.warning("--- ⚠️ 补全失败 (%s)，回退到原问题 ---", e)
         # 如果报错了，为了不中断流程，把原问题直接传下去
         return {"standalone_query": question}
\ No newline at end of file
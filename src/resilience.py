@@ -0,0 +1,237 @@
+import asyncio
+import functools
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from .config import (
+    LLM_NODE_BUDGETS,
+    LLM_DEFAULT_BUDGET,
+    LLM_HEDGE_ENABLED,
+    LLM_HEDGE_PERCENTILE,
+    LLM_HEDGE_MIN_DELAY,
+    LLM_HEDGE_DEFAULT_DELAY,
+    LLM_HEDGE_MIN_SAMPLES,
+    LLM_INITIAL_CONCURRENCY,
+    LLM_MIN_CONCURRENCY,
+    LLM_MAX_CONCURRENCY,
+    LLM_RATE_LIMIT,
+    LLM_RATE_BURST,
+)
+from .stats import RollingWindow
+
+
+class LLMUnavailable(Exception):
+    """上游模型在时间预算内不可用 (超时或被限流挡下)。"""
+
+
+class LLMTimeout(LLMUnavailable, TimeoutError):
+    pass
+
+
+class LLMOverloaded(LLMUnavailable):
+    pass
+
+
+def time_left(deadline: float = None) -> float:
+    """
+    距离整轮截止时间还剩多少秒；没有设置截止时间时返回 inf。
+    """
+    return float("inf") if deadline is None else deadline - time.time()
+
+
+class TokenBucket:
+    """
+    令牌桶限速：平均 rate 次/秒，允许 burst 次突发。
+    """
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, timeout: float) -> bool:
+        end = time.monotonic() + timeout
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return True
+                wait_for = (1 - self._tokens) / self.rate
+            if now + wait_for > end:
+                return False
+            time.sleep(wait_for)
+
+
+class AIMDLimiter:
+    """
+    AIMD 自适应并发上限：请求按时成功则上限缓慢加 1/limit (约每轮 +1)，
+    超时或失败则上限乘性减半。上游变慢时自动收缩并发，恢复后再慢慢放开。
+    """
+
+    def __init__(self, initial: int, minimum: int, maximum: int, backoff: float = 0.5):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.backoff = backoff
+        self.in_flight = 0
+        self._cond = threading.Condition()
+
+    def acquire(self, timeout: float) -> bool:
+        end = time.monotonic() + timeout
+        with self._cond:
+            while self.in_flight >= int(self.limit):
+                remaining = end - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+            self.in_flight += 1
+            return True
+
+    def try_acquire(self) -> bool:
+        return self.acquire(timeout=0)
+
+    def release(self, ok: bool = None):
+        """
+        归还并发槽。ok 为 True/False 时按上游调用的结果调整上限；为 None 表示根本没发出调用，上限不变。
+        """
+        with self._cond:
+            self.in_flight -= 1
+            if ok is True:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            elif ok is False:
+                self.limit = max(self.minimum, self.limit * self.backoff)
+            self._cond.notify_all()
+
+
+class ResilientCaller:
+    """
+    给单次模型调用加上：按节点的时间预算、整轮截止时间、AIMD 并发上限、令牌桶限速，
+    以及对幂等 (低温) 请求在 p95 延迟后发出对冲 (hedged) 的第二个请求，谁先回来用谁。
+
+    上游调用是同步阻塞的，无法真正取消；超时后调用方立即返回，落后的请求在后台跑完再归还并发槽。
+    """
+
+    def __init__(self, limiter: AIMDLimiter, bucket: TokenBucket, max_workers: int = LLM_MAX_CONCURRENCY * 2):
+        self.limiter = limiter
+        self.bucket = bucket
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="llm-call")
+        self._latency = defaultdict(RollingWindow)
+        self._lock = threading.Lock()
+        self.counters = defaultdict(int)
+
+    def _count(self, name: str):
+        with self._lock:
+            self.counters[name] += 1
+
+    def hedge_delay(self, node: str) -> float:
+        window = self._latency[node]
+        if len(window) < LLM_HEDGE_MIN_SAMPLES:
+            return LLM_HEDGE_DEFAULT_DELAY
+        return max(LLM_HEDGE_MIN_DELAY, window.percentile(LLM_HEDGE_PERCENTILE))
+
+    def _launch(self, fn, node: str, budget: float, timeout: float, hedge: bool = False):
+        acquired = self.limiter.try_acquire() if hedge else self.limiter.acquire(timeout)
+        if not acquired:
+            return None
+        if not self.bucket.acquire(0 if hedge else timeout):
+            self.limiter.release(ok=None)  # 只是没拿到令牌，没有发出上游调用，不调整并发上限
+            return None
+
+        start = time.monotonic()
+        future = self._executor.submit(fn)
+
+        def _done(f):
+            elapsed = time.monotonic() - start
+            ok = f.exception() is None and elapsed <= budget
+            if f.exception() is None:
+                self._latency[node].add(elapsed)
+            self.limiter.release(ok=ok)
+
+        future.add_done_callback(_done)
+        self._count("hedged" if hedge else "calls")
+        return future
+
+    def call(self, fn, node: str = "default", idempotent: bool = False, deadline: float = None):
+        budget = LLM_NODE_BUDGETS.get(node, LLM_DEFAULT_BUDGET)
+        timeout = min(budget, time_left(deadline))
+        if timeout <= 0:
+            self._count("deadline_exceeded")
+            raise LLMTimeout(f"[{node}] 本轮时间预算已用完")
+        end = time.monotonic() + timeout
+
+        primary = self._launch(fn, node, budget, timeout)
+        if primary is None:
+            self._count("rejected")
+            raise LLMOverloaded(f"[{node}] {timeout:.1f}s 内没有拿到并发槽/令牌")
+        pending = {primary}
+
+        # 对冲：幂等请求等到 p95 还没回来，就再发一个
+        if idempotent and LLM_HEDGE_ENABLED:
+            delay = min(self.hedge_delay(node), end - time.monotonic())
+            done, _ = wait(pending, timeout=max(0, delay))
+            if not done and end - time.monotonic() > 0:
+                hedge = self._launch(fn, node, budget, 0, hedge=True)
+                if hedge is not None:
+                    pending.add(hedge)
+
+        error = None
+        while pending:
+            done, pending = wait(pending, timeout=max(0, end - time.monotonic()), return_when=FIRST_COMPLETED)
+            if not done:
+                break
+            for future in done:
+                if future.exception() is None:
+                    if future is not primary:
+                        self._count("hedge_wins")
+                    return future.result()
+                error = future.exception()
+
+        if error is not None and not pending:
+            raise error
+        self._count("timeouts")
+        raise LLMTimeout(f"[{node}] 超过 {timeout:.1f}s 时间预算")
+
+    def stats(self) -> dict:
+        with self._lock:
+            result = dict(self.counters)
+        result["concurrency_limit"] = round(self.limiter.limit, 2)
+        result["in_flight"] = self.limiter.in_flight
+        return result
+
+
+# 进程级共享：所有节点、所有会话共用同一个并发上限和限速桶
+llm_caller = ResilientCaller(
+    AIMDLimiter(LLM_INITIAL_CONCURRENCY, LLM_MIN_CONCURRENCY, LLM_MAX_CONCURRENCY),
+    TokenBucket(LLM_RATE_LIMIT, LLM_RATE_BURST),
+)
+
+
+def install_resilience(model, node: str, idempotent: bool, deadline: float = None, caller: ResilientCaller = llm_caller):
+    """
+    给 Camel 模型实例的 run / arun 套上时间预算、限流和对冲。
+    arun 也走同一套同步控制 (放到线程里执行)，保证异步调用不会绕过进程级并发上限。
+    """
+    raw_run = model.run
+
+    @functools.wraps(raw_run)
+    def run(messages, response_format=None, tools=None):
+        return caller.call(
+            lambda: raw_run(messages, response_format, tools),
+            node=node,
+            idempotent=idempotent and response_format is None and not tools,
+            deadline=deadline,
+        )
+
+    async def arun(messages, response_format=None, tools=None):
+        return await asyncio.to_thread(run, messages, response_format, tools)
+
+    model.run = run
+    model.arun = arun
+    return model
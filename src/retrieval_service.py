@@ -0,0 +1,421 @@
+import itertools
+import json
+import logging
+import os
+import queue
+import stat
+import threading
+import time
+from concurrent.futures import Future
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener, answer_challenge, deliver_challenge
+
+import numpy as np
+
+from .config import (
+    TOP_K,
+    RETRIEVER_SOCKET,
+    RETRIEVER_AUTHKEY,
+    RETRIEVER_AUTHKEY_FILE,
+    RETRIEVER_MMAP_DIR,
+    RETRIEVER_MAX_BATCH,
+    RETRIEVER_MAX_WAIT_MS,
+    RETRIEVER_TIMEOUT,
+)
+from .schema import RetrievedChunk
+
+logger = logging.getLogger(__name__)
+
+# ==============================================================================
+# 检索 sidecar：一个进程持有嵌入模型和索引，多个 worker 通过 Unix socket 调用。
+# 索引导出为内存映射文件 (向量、子块 -> 父块映射、父块原文)，只读映射、按需换页，
+# 同一台机器上再起一个 sidecar 或本地检索也共享同一份页缓存。
+# ==============================================================================
+
+META_FILE = "meta.json"
+VECTORS_FILE = "vectors.f32"        # (向量数, dim) 的 float32，已归一化
+OWNERS_FILE = "owners.i32"          # 每个向量所属父块的下标 (父块自己的向量指向自己)
+TEXTS_FILE = "texts.bin"            # 父块原文 UTF-8 首尾相接
+OFFSETS_FILE = "text_offsets.i64"   # 第 i 个父块原文在 texts.bin 中的 [offsets[i], offsets[i+1])
+
+
+def write_mmap_index(out_dir: str, vectors, owners, parent_ids: list, texts: list, embed_model: str = None):
+    """
+    把 (向量, 所属父块, 父块 ID, 父块原文) 写成内存映射文件。meta.json 最后写入，存在即表示导出完整。
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    meta_path = os.path.join(out_dir, META_FILE)
+    if os.path.exists(meta_path):
+        os.remove(meta_path)
+
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    vectors = vectors / np.where(norms == 0, 1, norms)
+    vectors.tofile(os.path.join(out_dir, VECTORS_FILE))
+    np.asarray(owners, dtype=np.int32).tofile(os.path.join(out_dir, OWNERS_FILE))
+
+    offsets = [0]
+    with open(os.path.join(out_dir, TEXTS_FILE), "wb") as f:
+        for text in texts:
+            data = text.encode("utf-8")
+            f.write(data)
+            offsets.append(offsets[-1] + len(data))
+    np.asarray(offsets, dtype=np.int64).tofile(os.path.join(out_dir, OFFSETS_FILE))
+
+    with open(meta_path, "w", encoding="utf-8") as f:
+        json.dump({
+            "dim": int(vectors.shape[1]),
+            "vectors": int(vectors.shape[0]),
+            "parents": len(parent_ids),
+            "parent_ids": list(parent_ids),
+            "embed_model": embed_model,
+        }, f, ensure_ascii=False)
+
+
+def export_index(retriever, out_dir: str = RETRIEVER_MMAP_DIR, embed_model: str = "BAAI/bge-small-zh-v1.5"):
+    """
+    从 BuddhistRecursiveRetriever 导出：子块 (IndexNode) 的向量归到它指向的父块，父块自身的向量归到自己，
+    与 RecursiveRetriever 的“命中子块 -> 返回父块”一致。
+    """
+    embedding_dict = retriever.index.vector_store.data.embedding_dict
+    node_dict = retriever.node_dict
+
+    parent_ids, parent_pos = [], {}
+    vectors, owners = [], []
+    for node_id, embedding in embedding_dict.items():
+        node = node_dict.get(node_id)
+        if node is None:
+            continue
+        parent_id = getattr(node, "index_id", None) or node.node_id
+        if parent_id not in node_dict:
+            continue
+        if parent_id not in parent_pos:
+            parent_pos[parent_id] = len(parent_ids)
+            parent_ids.append(parent_id)
+        vectors.append(embedding)
+        owners.append(parent_pos[parent_id])
+
+    texts = [node_dict[pid].get_content() for pid in parent_ids]
+    write_mmap_index(out_dir, vectors, owners, parent_ids, texts, embed_model)
+    return {"vectors": len(vectors), "parents": len(parent_ids)}
+
+
+class MmapIndex:
+    """
+    只读打开导出的索引。向量做暴力内积 (已归一化，即余弦相似度)，和 SimpleVectorStore 的默认打分一致。
+    """
+
+    def __init__(self, index_dir: str = RETRIEVER_MMAP_DIR):
+        with open(os.path.join(index_dir, META_FILE), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        self.dim = meta["dim"]
+        self.parent_ids = meta["parent_ids"]
+        self.embed_model = meta.get("embed_model")
+        self._parent_pos = {pid: i for i, pid in enumerate(self.parent_ids)}
+        self.vectors = np.memmap(os.path.join(index_dir, VECTORS_FILE), dtype=np.float32, mode="r",
+                                 shape=(meta["vectors"], self.dim))
+        self.owners = np.memmap(os.path.join(index_dir, OWNERS_FILE), dtype=np.int32, mode="r")
+        self.offsets = np.memmap(os.path.join(index_dir, OFFSETS_FILE), dtype=np.int64, mode="r")
+        self._texts = np.memmap(os.path.join(index_dir, TEXTS_FILE), dtype=np.uint8, mode="r")
+
+    def text(self, parent: int) -> str:
+        return self._texts[self.offsets[parent]:self.offsets[parent + 1]].tobytes().decode("utf-8")
+
+    def get_texts(self, node_ids: list) -> list:
+        return [self.text(self._parent_pos[i]) for i in node_ids if i in self._parent_pos]
+
+    def search(self, queries, top_k: int = TOP_K) -> list:
+        """
+        queries: (batch, dim)。每个查询取相似度最高的 top_k 个向量，映射到父块；
+        同一父块被多个子块命中时只保留得分最高的一次。返回 [[RetrievedChunk, ...], ...]。
+        """
+        queries = np.asarray(queries, dtype=np.float32)
+        queries = queries / np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+        scores = queries @ self.vectors.T
+        k = min(top_k, scores.shape[1])
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+
+        results = []
+        for row, candidates in enumerate(top):
+            ordered = candidates[np.argsort(-scores[row, candidates])]
+            chunks, seen = [], set()
+            for i in ordered:
+                parent = int(self.owners[i])
+                if parent in seen:
+                    continue
+                seen.add(parent)
+                chunks.append(RetrievedChunk(self.parent_ids[parent], self.text(parent), float(scores[row, i])))
+            results.append(chunks)
+        return results
+
+
+def load_query_embedder(model_name: str = "BAAI/bge-small-zh-v1.5"):
+    """
+    bge 查询向量 (带检索指令前缀)，一次编码一批查询。返回 texts -> np.ndarray 的函数。
+    """
+    from llama_index.embeddings.huggingface import HuggingFaceEmbedding
+    from .config import get_device
+
+    model = HuggingFaceEmbedding(model_name=model_name, device=get_device(), embed_batch_size=RETRIEVER_MAX_BATCH)
+
+    def embed(texts: list):
+        return np.asarray(model._embed(list(texts), prompt_name="query"), dtype=np.float32)
+
+    return embed
+
+
+def _check_private(path: str, what: str):
+    """
+    path 必须属于当前用户，且组和其他用户没有任何权限。
+    """
+    st = os.lstat(path)
+    if st.st_uid != os.getuid():
+        raise PermissionError(f"{what} {path} 属于其他用户 (uid={st.st_uid})，拒绝使用")
+    if stat.S_IMODE(st.st_mode) & 0o077:
+        raise PermissionError(f"{what} {path} 的权限为 {stat.S_IMODE(st.st_mode):o}，组或其他用户可访问，拒绝使用")
+
+
+def ensure_socket_dir(socket_path: str):
+    """
+    创建 (或检查) socket 所在目录：必须是当前用户私有的 0700 目录，其他用户无法在里面抢占或替换 socket。
+    """
+    directory = os.path.dirname(os.path.abspath(socket_path))
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    _check_private(directory, "socket 目录")
+
+
+def authkey_path(socket_path: str) -> str:
+    return RETRIEVER_AUTHKEY_FILE or socket_path + ".key"
+
+
+def load_authkey(socket_path: str, create: bool = False) -> bytes:
+    """
+    读取 sidecar 连接的共享密钥：ZENGRAPH_RETRIEVER_AUTHKEY 优先，否则读密钥文件。
+    create=True (sidecar 启动时) 且文件不存在则生成一个 0600 的随机密钥；worker 只读不生成。
+    """
+    if RETRIEVER_AUTHKEY:
+        return RETRIEVER_AUTHKEY.encode("utf-8")
+    path = authkey_path(socket_path)
+    if create and not os.path.exists(path):
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(fd, "w") as f:
+            f.write(os.urandom(32).hex())
+    _check_private(path, "密钥文件")
+    with open(path, "rb") as f:
+        key = f.read().strip()
+    if not key:
+        raise PermissionError(f"密钥文件 {path} 为空")
+    return key
+
+
+class RetrievalServer:
+    """
+    sidecar 服务端：每个连接一个读线程，检索请求进同一个队列，由批处理线程攒批
+    (最多 max_batch 条或等 max_wait_ms) 后一次性编码、一次矩阵乘完成检索，再分别回给各连接。
+
+    协议 (multiprocessing.connection 的 pickle 消息)：
+      请求 (op, req_id, payload)，op 为 "retrieve" / "get_texts" / "stats"
+      响应 (req_id, ok, result)
+    连接建立时用共享密钥 (load_authkey) 做双向认证，认证通过之前不反序列化任何消息；
+    socket 只建在当前用户私有的目录里，路径被其他用户占用时拒绝启动。
+    """
+
+    def __init__(self, index: MmapIndex, embed, socket_path: str = RETRIEVER_SOCKET, top_k: int = TOP_K,
+                 max_batch: int = RETRIEVER_MAX_BATCH, max_wait_ms: float = RETRIEVER_MAX_WAIT_MS):
+        self.index = index
+        self.embed = embed
+        self.socket_path = socket_path
+        self.top_k = top_k
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self._queue = queue.Queue()
+        self._closed = threading.Event()
+        self._listener = None
+        self._authkey = None
+        self._conns = set()
+        self.counters = {"requests": 0, "batches": 0, "connections": 0}
+
+    def serve_forever(self):
+        ensure_socket_dir(self.socket_path)
+        if os.path.lexists(self.socket_path):
+            st = os.lstat(self.socket_path)
+            if st.st_uid != os.getuid() or not stat.S_ISSOCK(st.st_mode):
+                raise PermissionError(f"{self.socket_path} 已存在且不是当前用户的 socket，拒绝启动")
+            # 自己上次留下的 socket 文件
+            os.remove(self.socket_path)
+        self._authkey = load_authkey(self.socket_path, create=True)
+        # 先收紧 umask 再 bind，socket 文件从创建起就只有当前用户可访问，没有 chmod 之前的窗口
+        old_umask = os.umask(0o077)
+        try:
+            # 认证放到每个连接自己的线程里做 (_serve_conn)，一个不应答的连接不会卡住 accept
+            self._listener = Listener(self.socket_path, family="AF_UNIX")
+        finally:
+            os.umask(old_umask)
+        threading.Thread(target=self._batch_loop, daemon=True, name="retrieval-batch").start()
+        logger.info("--- 📚 检索 sidecar 已启动: %s (%d 个向量) ---", self.socket_path, len(self.index.owners))
+        while not self._closed.is_set():
+            try:
+                conn = self._listener.accept()
+            except OSError:
+                break
+            self.counters["connections"] += 1
+            threading.Thread(target=self._serve_conn, args=(conn,), daemon=True).start()
+
+    def close(self):
+        self._closed.set()
+        if self._listener is not None:
+            self._listener.close()
+        # 主动断开已有连接，让 worker 立即失败并重连，而不是等到超时
+        for conn in list(self._conns):
+            conn.close()
+        self._queue.put(None)
+
+    def _serve_conn(self, conn):
+        # 和 Listener(authkey=...) 相同的双向认证，通过之前不 recv() 任何 pickle 消息
+        try:
+            deliver_challenge(conn, self._authkey)
+            answer_challenge(conn, self._authkey)
+        except (AuthenticationError, AssertionError, EOFError, OSError, TypeError):
+            logger.warning("--- ⚠️ 检索 sidecar 拒绝了一个未通过认证的连接 ---")
+            conn.close()
+            return
+        self._conns.add(conn)
+        send_lock = threading.Lock()
+
+        def reply(req_id, ok, result):
+            with send_lock:
+                try:
+                    conn.send((req_id, ok, result))
+                except OSError:
+                    pass
+
+        while True:
+            try:
+                op, req_id, payload = conn.recv()
+            except (EOFError, OSError, TypeError):
+                # 对端断开；或 close() 已关闭该连接 (句柄置空后 recv 抛 TypeError)
+                break
+            if op == "retrieve":
+                self._queue.put((payload, req_id, reply))
+            elif op == "get_texts":
+                reply(req_id, True, self.index.get_texts(payload))
+            elif op == "stats":
+                reply(req_id, True, dict(self.counters))
+            else:
+                reply(req_id, False, f"unknown op: {op}")
+        self._conns.discard(conn)
+        conn.close()
+
+    def _batch_loop(self):
+        while not self._closed.is_set():
+            item = self._queue.get()
+            if item is None:
+                break
+            batch = [item]
+            end = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch:
+                try:
+                    item = self._queue.get(timeout=max(0, end - time.monotonic()))
+                except queue.Empty:
+                    break
+                if item is None:
+                    self._closed.set()
+                    break
+                batch.append(item)
+
+            self.counters["requests"] += len(batch)
+            self.counters["batches"] += 1
+            try:
+                results = self.index.search(self.embed([text for text, _, _ in batch]), self.top_k)
+            except Exception as e:
+                logger.warning("--- ⚠️ 批量检索失败: %s ---", e)
+                for _, req_id, reply in batch:
+                    reply(req_id, False, str(e))
+                continue
+            for (_, req_id, reply), chunks in zip(batch, results):
+                reply(req_id, True, [tuple(c) for c in chunks])
+
+
+class RetrieverClient:
+    """
+    worker 端：与 BuddhistRecursiveRetriever 相同的 retrieve / get_texts 接口，检索交给 sidecar。
+    一条连接多路复用，多个线程可以同时调用；连接断开后下一次调用自动重连。
+    """
+
+    def __init__(self, socket_path: str = RETRIEVER_SOCKET, timeout: float = RETRIEVER_TIMEOUT,
+                 connect_timeout: float = 30.0):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self._conn = None
+        self._pending = {}
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        # sidecar 可能比 worker 晚起，等一会儿
+        end = time.monotonic() + self.connect_timeout
+        while True:
+            try:
+                # 密钥文件由 sidecar 启动时生成，和 socket 一样可能还没出现
+                conn = Client(self.socket_path, family="AF_UNIX", authkey=load_authkey(self.socket_path))
+                break
+            except (AuthenticationError, AssertionError) as e:
+                # 对端不持有同一把密钥：不是我们的 sidecar，不能信任它回的任何消息
+                raise ConnectionError(f"检索 sidecar 认证失败: {self.socket_path}") from e
+            except (FileNotFoundError, ConnectionRefusedError):
+                if time.monotonic() > end:
+                    raise ConnectionError(f"连接检索 sidecar 失败: {self.socket_path}")
+                time.sleep(0.2)
+        threading.Thread(target=self._read_loop, args=(conn,), daemon=True, name="retriever-client").start()
+        return conn
+
+    def _read_loop(self, conn):
+        while True:
+            try:
+                req_id, ok, result = conn.recv()
+            except (EOFError, OSError):
+                break
+            future = self._pending.pop(req_id, None)
+            if future is None:
+                continue
+            if ok:
+                future.set_result(result)
+            else:
+                future.set_exception(RuntimeError(result))
+
+        # 连接断了：挂起的请求全部失败，下一次调用重连
+        with self._lock:
+            if self._conn is conn:
+                self._conn = None
+            pending, self._pending = self._pending, {}
+        for future in pending.values():
+            future.set_exception(ConnectionError("检索 sidecar 连接已断开"))
+
+    def _call(self, op: str, payload):
+        future = Future()
+        with self._lock:
+            if self._conn is None:
+                self._conn = self._connect()
+            req_id = next(self._ids)
+            self._pending[req_id] = future
+            self._conn.send((op, req_id, payload))
+        try:
+            return future.result(timeout=self.timeout)
+        finally:
+            self._pending.pop(req_id, None)
+
+    def retrieve(self, text: str) -> list[RetrievedChunk]:
+        return [RetrievedChunk(*chunk) for chunk in self._call("retrieve", text)]
+
+    def get_texts(self, node_ids: list) -> list[str]:
+        return self._call("get_texts", list(node_ids))
+
+    def stats(self) -> dict:
+        return self._call("stats", None)
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
@@ -5,25 +5,54 @@ from llama_index.core import (
     load_index_from_storage,
     Settings
 )
-from llama_index.core.node_parser import SentenceSplitter
 from llama_index.core.schema import IndexNode
 from llama_index.core.retrievers import RecursiveRetriever
 from llama_index.core.query_engine import RetrieverQueryEngine
 from llama_index.embeddings.huggingface import HuggingFaceEmbedding
 import os
+import logging
 import chromadb
 from llama_index.vector_stores.chroma import ChromaVectorStore
-from .config import DATA_PATH, PERSIST_PATH, DEVICE
+from .config import DATA_PATH, PERSIST_PATH, get_device, TOP_K, CHUNK_SIZE, CHUNK_OVERLAP
 from .utils import convert_to_simplified
+from .schema import RetrievedChunk
+from .splitter import make_splitter, exclude_path_metadata
+
+logger = logging.getLogger(__name__)
+
+
+def build_hierarchical_nodes(documents, parent_splitter=None, child_splitter=None) -> list:
+    """
+    父子两级切分：子块 (IndexNode) 用于匹配，指向父块；返回子块与父块一起入库的节点列表。
+    """
+    # 父块：1024 字符，提供完整语境
+    parent_splitter = parent_splitter or make_splitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
+    # 子块：128 字符，用于高精匹配
+    child_splitter = child_splitter or make_splitter(chunk_size=128, chunk_overlap=20)
+
+    # 绝对路径既不该进向量，也不该挤占子块 (128 字) 的预算
+    parent_nodes = parent_splitter.get_nodes_from_documents(exclude_path_metadata(documents))
+    all_nodes = []
+
+    for i, p_node in enumerate(parent_nodes):
+        # 生成子节点并链接到父节点
+        c_nodes = child_splitter.get_nodes_from_documents([p_node])
+        for c_node in c_nodes:
+            # IndexNode 的核心：存子块内容，但指向父块 ID
+            idx_node = IndexNode.from_text_node(c_node, p_node.node_id)
+            all_nodes.append(idx_node)
+        all_nodes.append(p_node)
+    return all_nodes
+
 
 class BuddhistRecursiveRetriever:
-    def __init__(self):
+    def __init__(self, similarity_top_k: int = TOP_K):
         # --- 设置本地嵌入模型 ---
         # 我们使用一个小巧的中文增强模型，它会在你第一次运行进下载到本地
-        print("--- 正在初始化本地嵌入模型 (BGE-Small) ---")
+        logger.info("--- 正在初始化本地嵌入模型 (BGE-Small) ---")
         Settings.embed_model = HuggingFaceEmbedding(
             model_name="BAAI/bge-small-zh-v1.5",
-            device=DEVICE,
+            device=get_device(),
             embed_batch_size=128,
         )
         # 顺便把 LLM 也关掉，不让 LlamaIndex 乱调 OpenAI
@@ -42,24 +71,8 @@ class BuddhistRecursiveRetriever:
                 # 这一步至关重要：确保进库的向量全是简体的
                 simplified_text = convert_to_simplified(doc.get_content())
                 doc.set_content(simplified_text)
-                
-            # 父块：1024 字符，提供完整语境
-            parent_splitter = SentenceSplitter(chunk_size=1024, chunk_overlap=100)
-            # 子块：128 字符，用于高精匹配
-            child_splitter = SentenceSplitter(chunk_size=128, chunk_overlap=20)
-            
-            parent_nodes = parent_splitter.get_nodes_from_documents(documents)
-            all_nodes = []
-            
-            for i, p_node in enumerate(parent_nodes):
-                # 生成子节点并链接到父节点
-                c_nodes = child_splitter.get_nodes_from_documents([p_node])
-                for c_node in c_nodes:
-                    # IndexNode 的核心：存子块内容，但指向父块 ID
-                    idx_node = IndexNode.from_text_node(c_node, p_node.node_id)
-                    all_nodes.append(idx_node)
-                all_nodes.append(p_node)
-            
+
+            all_nodes = build_hierarchical_nodes(documents)
             self.index = VectorStoreIndex(all_nodes)
             self.index.storage_context.persist(persist_dir=PERSIST_PATH)
         else:
@@ -67,13 +80,29 @@ class BuddhistRecursiveRetriever:
             self.index = load_index_from_storage(sc)
 
         # 2. 配置递归检索器
-        base_retriever = self.index.as_retriever(similarity_top_k=3)
+        base_retriever = self.index.as_retriever(similarity_top_k=similarity_top_k)
+        self.node_dict = {n.node_id: n for n in self.index.docstore.docs.values()}
         self.recursive_retriever = RecursiveRetriever(
             "vector",
             retriever_dict={"vector": base_retriever},
-            node_dict={n.node_id: n for n in self.index.docstore.docs.values()},
+            node_dict=self.node_dict,
         )
         self.query_engine = RetrieverQueryEngine.from_args(self.recursive_retriever)
 
     def query(self, text: str):
-        return self.query_engine.query(text)
\ No newline at end of file
+        return self.query_engine.query(text)
+
+    def retrieve(self, text: str) -> list[RetrievedChunk]:
+        """
+        只做递归检索，不经过 ResponseSynthesizer，返回父块 ID、原文和得分。
+        """
+        return [
+            RetrievedChunk(n.node.node_id, n.node.get_content(), n.score or 0.0)
+            for n in self.recursive_retriever.retrieve(text)
+        ]
+
+    def get_texts(self, node_ids: list) -> list[str]:
+        """
+        按 ID 从父块库取回原文 (Checkpointer 还原引用时使用)。
+        """
+        return [self.node_dict[i].get_content() for i in node_ids if i in self.node_dict]
\ No newline at end of file
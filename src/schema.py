@@ -1,12 +1,34 @@
-from typing import TypedDict
+from typing import Annotated, NamedTuple, TypedDict
+
+
+class RetrievedChunk(NamedTuple):
+    node_id: str         # 父块 ID
+    text: str            # 父块原文
+    score: float         # 相似度得分
+
+
+def append_log(current: list, update) -> list:
+    """
+    history_log 的 reducer：节点只写本轮新增的行，追加到日志末尾；
+    写入 {"reset": [...]} 时整体替换 (日志压缩)。用 dict 标记而不是自定义类型，序列化后读回来语义不变。
+    """
+    if isinstance(update, dict):
+        return list(update.get("reset") or [])
+    return list(current or []) + list(update or [])
+
 
 class AgentState(TypedDict):
     query: str           # 用户问题
     standalone_query: str   # HyDE处理后问题
     route: str           # 意图路由
-    retrieved_context: str # 检索到的父块内容
+    retrieved_refs: list[tuple[str, float]]  # 检索结果的 (父块 ID, 相似度)，原文在 grade / answer 时才从父块库取
     final_answer: str    # 法师的回答
     retry_count: int     # 容错计数
     grade: str           # 结果打分
+    grade_source: str    # 打分来源："llm" 或 "score" (相似度短路)
     loop_step: int       # 循环次数
-    chat_history: list[str]     # 聊天历史，格式如 ["User: ...", "AI: ..."]
\ No newline at end of file
+    deadline: float      # 本轮截止时间 (time.time() 时间戳)，由 Router 在每轮开始时设置
+    history_log: Annotated[list[str], append_log]  # 只追加的对话日志，格式如 ["信众: ...", "法师: ..."]
+    history_folded: int         # history_log 的前 history_folded 行已并入摘要
+    history_offset: int         # 原文窗口的起点；[history_folded, history_offset) 是等待折叠进摘要的行
+    history_summary: str        # 更早对话的滚动摘要
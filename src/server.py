@@ -0,0 +1,269 @@
+import asyncio
+import json
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import AsyncExitStack, asynccontextmanager
+
+from fastapi import FastAPI
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from pydantic import BaseModel, Field
+from starlette.background import BackgroundTask
+
+from .config import (
+    SERVER_MAX_IN_FLIGHT,
+    SERVER_MAX_QUEUE,
+    SERVER_QUEUE_TIMEOUT,
+    SERVER_MAX_PENDING_PER_THREAD,
+    SERVER_WARMUP,
+)
+from .workflow import create_workflow
+from .nodes import get_retriever, set_retriever
+from .instrumentation import instrumentation
+from .utils import convert_to_simplified, get_llm_flight_stats, get_llm_resilience_stats
+
+logger = logging.getLogger(__name__)
+
+
+class Rejected(Exception):
+    """请求被准入控制挡下：status 为返回的 HTTP 状态码。"""
+
+    def __init__(self, status: int, reason: str, retry_after: float = 1.0):
+        super().__init__(reason)
+        self.status = status
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """
+    准入控制：最多 max_in_flight 轮同时执行，其余最多 max_queue 个排队等待，
+    排队也满了或等待超过 queue_timeout 就直接 503 (load shedding)。
+    过载时让一部分请求快速失败，而不是所有请求一起排长队、一起超时。
+    只在事件循环线程里使用，不需要额外加锁。
+    """
+
+    def __init__(self, max_in_flight: int, max_queue: int, queue_timeout: float):
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._slots = asyncio.Semaphore(max_in_flight)
+        self.in_flight = 0
+        self.queued = 0
+        self.admitted = 0
+        self.shed = 0
+
+    async def acquire(self):
+        if self._slots.locked() and self.queued >= self.max_queue:
+            self.shed += 1
+            raise Rejected(503, "queue_full")
+        self.queued += 1
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.shed += 1
+            raise Rejected(503, "queue_timeout")
+        finally:
+            self.queued -= 1
+        self.in_flight += 1
+        self.admitted += 1
+
+    def release(self):
+        self.in_flight -= 1
+        self._slots.release()
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "admitted": self.admitted,
+            "shed": self.shed,
+            "max_in_flight": self.max_in_flight,
+            "max_queue": self.max_queue,
+        }
+
+
+class ThreadLocks:
+    """
+    同一 thread_id 的轮次串行执行，避免两轮同时读到同一个旧 checkpoint、互相覆盖对话历史。
+    锁按引用计数管理，会话空闲后即回收；同一会话排队过多时返回 429。
+    """
+
+    def __init__(self, max_pending: int):
+        self.max_pending = max_pending
+        self._locks = {}  # thread_id -> [asyncio.Lock, 持有或等待的请求数]
+
+    @asynccontextmanager
+    async def hold(self, thread_id: str):
+        entry = self._locks.setdefault(thread_id, [asyncio.Lock(), 0])
+        if entry[1] >= self.max_pending:
+            raise Rejected(429, "thread_busy")
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                self._locks.pop(thread_id, None)
+
+    def __len__(self):
+        return len(self._locks)
+
+
+class ChatRequest(BaseModel):
+    thread_id: str = Field(..., min_length=1, max_length=128)
+    query: str = Field(..., min_length=1, max_length=2000)
+    stream: bool = False
+
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def warmup():
+    """
+    预加载检索器 (嵌入模型 + 索引) 并跑一次检索，避免第一个用户请求承担冷启动。
+    """
+    start = time.perf_counter()
+    convert_to_simplified("預熱")
+    get_retriever().retrieve("如何放下执着")
+    logger.info("--- 🔥 预热完成，用时 %.1fs ---", time.perf_counter() - start)
+
+
+def create_app(checkpointer=None, retriever=None, run_warmup: bool = SERVER_WARMUP,
+               max_in_flight: int = SERVER_MAX_IN_FLIGHT, max_queue: int = SERVER_MAX_QUEUE,
+               queue_timeout: float = SERVER_QUEUE_TIMEOUT,
+               max_pending_per_thread: int = SERVER_MAX_PENDING_PER_THREAD) -> FastAPI:
+    """
+    checkpointer: 默认使用 SqliteCheckpointer
+    retriever   : 替换检索器 (压测时传入轻量实现)
+    """
+    if retriever is not None:
+        set_retriever(retriever)
+    if checkpointer is None:
+        from .checkpoint import SqliteCheckpointer
+        checkpointer = SqliteCheckpointer()
+
+    graph = create_workflow().compile(checkpointer=checkpointer)
+    status = {"ready": False, "warmup_error": None}
+
+    @asynccontextmanager
+    async def lifespan(app: FastAPI):
+        # 图里的节点都是同步的，LangGraph 的异步接口会把它们放进默认线程池执行：
+        # 线程池要能容纳全部在途请求，否则准入控制之外又多一层看不见的排队
+        loop = asyncio.get_running_loop()
+        loop.set_default_executor(ThreadPoolExecutor(max_workers=max_in_flight + 4, thread_name_prefix="graph"))
+        app.state.admission = AdmissionController(max_in_flight, max_queue, queue_timeout)
+        app.state.thread_locks = ThreadLocks(max_pending_per_thread)
+
+        async def _warmup():
+            try:
+                if run_warmup:
+                    await asyncio.to_thread(warmup)
+                status["ready"] = True
+            except Exception as e:
+                status["warmup_error"] = str(e)
+                logger.error("--- ❌ 预热失败: %s ---", e)
+
+        warmup_task = asyncio.create_task(_warmup())
+        try:
+            yield
+        finally:
+            status["ready"] = False
+            warmup_task.cancel()
+            if hasattr(checkpointer, "close"):
+                checkpointer.close()
+
+    app = FastAPI(title="ZenGraph Agent", lifespan=lifespan)
+    app.state.graph = graph
+
+    def _reject(e: Rejected) -> JSONResponse:
+        instrumentation.inc("requests_rejected_total", status=e.status, reason=e.reason)
+        return JSONResponse(
+            {"error": e.reason},
+            status_code=e.status,
+            headers={"Retry-After": str(int(max(1, e.retry_after)))},
+        )
+
+    @app.get("/healthz")
+    async def healthz():
+        return {"status": "ok"}
+
+    @app.get("/readyz")
+    async def readyz():
+        body = {"ready": status["ready"], "warmup_error": status["warmup_error"], **app.state.admission.stats()}
+        return JSONResponse(body, status_code=200 if status["ready"] else 503)
+
+    @app.get("/metrics")
+    async def metrics():
+        return PlainTextResponse(instrumentation.render_prometheus())
+
+    @app.get("/stats")
+    async def stats():
+        return {
+            "admission": app.state.admission.stats(),
+            "active_threads": len(app.state.thread_locks),
+            "singleflight": get_llm_flight_stats(),
+            "resilience": get_llm_resilience_stats(),
+        }
+
+    @app.post("/chat")
+    async def chat(request: ChatRequest):
+        if not status["ready"]:
+            return _reject(Rejected(503, "warming_up", retry_after=5))
+
+        # 先排同一会话的锁，再占全局在途名额：等前一轮的请求不占用执行名额
+        stack = AsyncExitStack()
+        try:
+            await stack.enter_async_context(app.state.thread_locks.hold(request.thread_id))
+            await app.state.admission.acquire()
+            stack.callback(app.state.admission.release)
+        except Rejected as e:
+            await stack.aclose()
+            return _reject(e)
+
+        config = {"configurable": {"thread_id": request.thread_id, "stream_tokens": request.stream}}
+        # 每轮重新计数重写次数
+        payload = {"query": request.query, "loop_step": 0}
+        start = time.perf_counter()
+
+        if not request.stream:
+            try:
+                result = await graph.ainvoke(payload, config=config)
+            finally:
+                await stack.aclose()
+            return {
+                "thread_id": request.thread_id,
+                "answer": result.get("final_answer"),
+                "route": result.get("route"),
+                "grade": result.get("grade"),
+                "latency_ms": round((time.perf_counter() - start) * 1000, 1),
+            }
+
+        async def events():
+            answer = None
+            try:
+                async for mode, chunk in graph.astream(payload, config=config, stream_mode=["custom", "updates"]):
+                    if mode == "custom" and "token" in chunk:
+                        yield _sse("token", {"text": chunk["token"]})
+                    elif mode == "updates":
+                        for node, update in chunk.items():
+                            yield _sse("node", {"node": node})
+                            if node == "answer" and update:
+                                answer = update.get("final_answer")
+                yield _sse("done", {
+                    "thread_id": request.thread_id,
+                    "answer": answer,
+                    "latency_ms": round((time.perf_counter() - start) * 1000, 1),
+                })
+            except Exception as e:
+                logger.warning("--- ❌ 流式请求失败 (%s): %s ---", request.thread_id, e)
+                yield _sse("error", {"message": str(e)})
+            finally:
+                await stack.aclose()
+
+        # 客户端在流开始前就断开时生成器不会执行，由后台任务兜底释放 (重复关闭是安全的)
+        return StreamingResponse(events(), media_type="text/event-stream", background=BackgroundTask(stack.aclose))
+
+    return app
@@ -0,0 +1,156 @@
+import asyncio
+import contextvars
+import functools
+import hashlib
+import json
+import threading
+
+
+# 当前线程 / 协程最近一次 do() / ado() 是否搭了别人的便车 (供埋点区分上游调用和合并命中)
+_last_shared = contextvars.ContextVar("singleflight_last_shared", default=False)
+
+
+class _Call:
+    __slots__ = ("event", "result", "error")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    请求合并 (singleflight)：同一时刻 key 相同的调用只真正执行一次，其余调用等待并共享结果。
+    线程和 asyncio 都可用；结果不做缓存，领头的调用一结束，后来的同 key 请求会重新发起。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}        # key -> _Call (线程)
+        self._async_calls = {}  # (loop, key) -> asyncio.Future
+        self.calls = 0          # 总调用次数
+        self.executions = 0     # 真正打到上游的次数
+        self.coalesced = 0      # 被合并掉的次数
+
+    def do(self, key, fn):
+        with self._lock:
+            self.calls += 1
+            call = self._calls.get(key)
+            if call is not None:
+                self.coalesced += 1
+                leader = False
+            else:
+                call = self._calls[key] = _Call()
+                self.executions += 1
+                leader = True
+        _last_shared.set(not leader)
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+        return call.result
+
+    async def ado(self, key, coro_fn):
+        loop = asyncio.get_running_loop()
+        slot = (id(loop), key)
+        with self._lock:
+            self.calls += 1
+            future = self._async_calls.get(slot)
+            if future is not None:
+                self.coalesced += 1
+                leader = False
+            else:
+                future = self._async_calls[slot] = loop.create_future()
+                self.executions += 1
+                leader = True
+        _last_shared.set(not leader)
+
+        if not leader:
+            # shield：某个等待者被取消时不影响领头请求和其他等待者
+            return await asyncio.shield(future)
+
+        try:
+            result = await coro_fn()
+        except BaseException as e:
+            future.set_exception(e)
+            # 没有等待者时避免 "exception was never retrieved" 警告
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._async_calls[slot]
+
+    @staticmethod
+    def last_shared() -> bool:
+        """
+        当前线程 (或协程) 上一次调用是否被合并，直接复用了领头请求的结果。
+        """
+        return _last_shared.get()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "executions": self.executions,
+                "coalesced": self.coalesced,
+                "in_flight": len(self._calls) + len(self._async_calls),
+            }
+
+
+def request_key(model_name: str, temperature: float, messages: list) -> str:
+    """
+    (模型, 温度, 消息) 的稳定哈希，作为合并的 key。
+    """
+    payload = json.dumps(
+        [model_name, temperature, messages], ensure_ascii=False, sort_keys=True, default=str
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def install_singleflight(model, flight: SingleFlight, model_name: str, temperature: float):
+    """
+    给 Camel 模型实例的 run / arun 套上请求合并。
+    只合并普通的对话请求；带 response_format、tools 或流式输出的请求原样透传。
+    """
+    raw_run = model.run
+    raw_arun = getattr(model, "arun", None)
+    streaming = bool(getattr(model, "model_config_dict", {}).get("stream"))
+
+    @functools.wraps(raw_run)
+    def run(messages, response_format=None, tools=None):
+        if streaming or response_format is not None or tools:
+            _last_shared.set(False)
+            return raw_run(messages, response_format, tools)
+        key = request_key(model_name, temperature, messages)
+        return flight.do(key, lambda: raw_run(messages))
+
+    model.run = run
+
+    if raw_arun is not None:
+        @functools.wraps(raw_arun)
+        async def arun(messages, response_format=None, tools=None):
+            if streaming or response_format is not None or tools:
+                _last_shared.set(False)
+                return await raw_arun(messages, response_format, tools)
+            key = request_key(model_name, temperature, messages)
+            return await flight.ado(key, lambda: raw_arun(messages))
+
+        model.arun = arun
+
+    return model
@@ -0,0 +1,208 @@
+import re
+import logging
+from typing import List
+
+from llama_index.core.bridge.pydantic import Field
+from llama_index.core.node_parser import SentenceSplitter
+from llama_index.core.node_parser.interface import MetadataAwareTextSplitter
+
+from .config import SPLITTER
+
+logger = logging.getLogger(__name__)
+
+SPLITTER_KINDS = ("classical", "sentence")
+# SimpleDirectoryReader 写进 metadata、但默认没从嵌入/LLM 文本中排除的路径字段
+PATH_METADATA_KEYS = ("file_path",)
+
+# 断句处：句末标点 (可带后引号/括号) 或换行；切出来的各段首尾相接，覆盖整个区间
+_SENTENCE_RE = re.compile(r"[。！？；]+[」』”’）]*|\n+")
+# 句内的次级停顿，句子本身超长时才按它切
+_CLAUSE_RE = re.compile(r"[，、：　]+")
+# 偈颂：四/五/七言的句读连续出现，句读之间用逗号、顿号或空格隔开
+_VERSE_RE = re.compile(
+    "(?:"
+    + "|".join(rf"(?:[^\s，、；。！？：「」『』]{{{n}}}[，、；　 ]+)+[^\s，、；。！？：「」『』]{{{n}}}" for n in (4, 5, 7))
+    + r")[。！？；]*\s*"
+)
+_VERSE_MAX_CHARS = 96  # 单句超过这个长度就不再当作偈颂句判断
+_CJK_RE = re.compile(r"[\u3000-\u303f\u3400-\u9fff\uff00-\uffef]")
+
+
+def metadata_cost(metadata_str: str) -> int:
+    """
+    元数据占用的块预算，和正文同一把尺子：中文一字一 token，其余字符 4 个一 token
+    (与 history.estimate_tokens 相同的估算)。路径、文件名这类 ASCII 元数据不能按字符数扣。
+    """
+    cjk = len(_CJK_RE.findall(metadata_str))
+    return cjk + (len(metadata_str) - cjk + 3) // 4
+
+
+def exclude_path_metadata(documents):
+    """
+    让文件路径不进入嵌入文本和 LLM 文本 (也就不再占块预算)；其余 metadata 原样保留，检索结果仍可追溯来源。
+    """
+    for doc in documents:
+        for attr in ("excluded_embed_metadata_keys", "excluded_llm_metadata_keys"):
+            keys = list(getattr(doc, attr))
+            setattr(doc, attr, keys + [k for k in PATH_METADATA_KEYS if k not in keys])
+    return documents
+
+
+def _spans(pattern, text: str, start: int, end: int) -> list:
+    """
+    在 [start, end) 内按分隔符切开，分隔符留在前一段末尾。
+    """
+    spans = []
+    for m in pattern.finditer(text, start, end):
+        spans.append((start, m.end()))
+        start = m.end()
+    if start < end:
+        spans.append((start, end))
+    return spans
+
+
+def _is_verse(text: str, start: int, end: int) -> bool:
+    if end - start > _VERSE_MAX_CHARS:
+        return False
+    return _VERSE_RE.fullmatch(text, start, end) is not None
+
+
+def _strip(text: str, start: int, end: int):
+    while start < end and text[start].isspace():
+        start += 1
+    while end > start and text[end - 1].isspace():
+        end -= 1
+    return start, end
+
+
+def _units(text: str):
+    """
+    逐个产出 (start, end, 偈颂句数)，偈颂句数为 0 表示普通句子。
+    """
+    last = None
+    verse_start, verses = None, 0
+    for start, end in _spans(_SENTENCE_RE, text, 0, len(text)):
+        if text[start:end].isspace():
+            # 空行只并到前一个单元尾部，不单独成块，也不打断偈颂
+            if last and verse_start is None:
+                last = (last[0], end, last[2])
+            continue
+        if _is_verse(text, start, end):
+            if verse_start is None:
+                verse_start = start
+            verses += 1
+            continue
+        if last:
+            yield last
+            last = None
+        if verse_start is not None:
+            yield verse_start, start, verses
+            verse_start, verses = None, 0
+        last = (start, end, 0)
+    if last:
+        yield last
+    if verse_start is not None:
+        yield verse_start, len(text), verses
+
+
+def sentence_units(text: str) -> list:
+    """
+    按 。！？； 和换行切成句子区间，再把连续的偈颂句合并成一整个偈 (一个不可拆的单元)。
+    """
+    return [(start, end) for start, end, _ in _units(text)]
+
+
+def verse_spans(text: str) -> list:
+    """
+    由两句以上偈颂句组成的偈在原文中的区间 (不含首尾空白)，供 scripts/bench_splitter.py 统计偈颂被切断的比例。
+    """
+    return [_strip(text, start, end) for start, end, verses in _units(text) if verses >= 2]
+
+
+def _fit(text: str, start: int, end: int, limit: int) -> list:
+    """
+    把超过 limit 的单元拆小：偈颂拆回句子，句子按逗号等句读拆，最后按字数硬切。
+    """
+    if end - start <= limit:
+        return [(start, end)]
+    for pattern in (_SENTENCE_RE, _CLAUSE_RE):
+        parts = _spans(pattern, text, start, end)
+        if len(parts) > 1:
+            return [span for s, e in parts for span in _fit(text, s, e, limit)]
+    return [(s, min(s + limit, end)) for s in range(start, end, limit)]
+
+
+class ClassicalChineseSplitter(MetadataAwareTextSplitter):
+    """
+    面向古籍 (CBETA 经文) 的切分器，替代 LlamaIndex 的 SentenceSplitter：
+    - 只按 。！？； 和换行断句，偈颂整首作为一个单元，尽量不从中间切开；
+    - chunk_size / chunk_overlap 按字符计 (中文一字约一 token)，全程只做正则扫描和区间运算，不跑分词器；
+    - 每个块都是原文的一个连续切片，split_spans 直接给出字符偏移。
+    """
+
+    chunk_size: int = Field(default=1024, description="每个块的最大字符数。", gt=0)
+    chunk_overlap: int = Field(default=100, description="相邻块之间重叠的最大字符数 (按整句回退)。", ge=0)
+
+    def __init__(self, chunk_size: int = 1024, chunk_overlap: int = 100, **kwargs):
+        if chunk_overlap > chunk_size:
+            raise ValueError(f"chunk_overlap ({chunk_overlap}) 不能大于 chunk_size ({chunk_size})")
+        super().__init__(chunk_size=chunk_size, chunk_overlap=chunk_overlap, **kwargs)
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "ClassicalChineseSplitter"
+
+    def split_text(self, text: str) -> List[str]:
+        return [text[s:e] for s, e in self.split_spans(text)]
+
+    def split_text_metadata_aware(self, text: str, metadata_str: str) -> List[str]:
+        """
+        扣掉元数据的估算 token 数后再装箱；元数据再长，正文也至少保留 chunk_size 的一半，不会因为路径过长整批失败。
+        """
+        cost = metadata_cost(metadata_str)
+        limit = self.chunk_size - cost
+        if limit < self.chunk_size // 2:
+            limit = max(self.chunk_size // 2, 1)
+            logger.warning("--- ⚠️ 元数据约 %d token，超过 chunk_size (%d) 的一半，正文按 %d 字切分 ---", cost, self.chunk_size, limit)
+        return [text[s:e] for s, e in self.split_spans(text, limit)]
+
+    def split_spans(self, text: str, chunk_size: int = None) -> list:
+        """
+        返回每个块在原文中的 (start, end) 字符偏移。
+        按句子/偈颂单元贪心装箱；开新块时从上一块末尾回退若干个完整单元作为重叠 (不超过 chunk_overlap)。
+        """
+        limit = chunk_size or self.chunk_size
+        overlap = min(self.chunk_overlap, limit // 2)
+        units = [
+            (s, e) for start, end in sentence_units(text)
+            for s, e in _fit(text, start, end, limit) if not text[s:e].isspace()
+        ]
+
+        chunks = []
+        current = []
+        for unit in units:
+            if current and unit[1] - current[0][0] > limit:
+                chunks.append(_strip(text, current[0][0], current[-1][1]))
+                kept = []
+                # 第一个单元不参与重叠，保证每个新块的起点都在前进
+                for prev in reversed(current[1:]):
+                    if current[-1][1] - prev[0] > overlap:
+                        break
+                    kept.insert(0, prev)
+                # 重叠部分加上新单元仍然超长时放弃重叠
+                current = kept if kept and unit[1] - kept[0][0] <= limit else []
+            current.append(unit)
+        if current:
+            chunks.append(_strip(text, current[0][0], current[-1][1]))
+        return [(s, e) for s, e in chunks if e > s]
+
+
+def make_splitter(chunk_size: int, chunk_overlap: int, kind: str = SPLITTER):
+    """
+    按配置返回切分器：classical 为 ClassicalChineseSplitter，sentence 为 LlamaIndex 原生的 SentenceSplitter。
+    """
+    if kind not in SPLITTER_KINDS:
+        raise ValueError(f"未知的切分器: {kind!r}，可选 {', '.join(SPLITTER_KINDS)} (ZENGRAPH_SPLITTER)")
+    if kind == "sentence":
+        return SentenceSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    return ClassicalChineseSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
@@ -0,0 +1,53 @@
+import math
+import threading
+from collections import deque
+
+
+def percentile(values, q: float) -> float:
+    """
+    线性插值的分位数，q 取 0-100。空序列返回 0。
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    pos = (len(ordered) - 1) * q / 100
+    lower, upper = math.floor(pos), math.ceil(pos)
+    if lower == upper:
+        return float(ordered[lower])
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (pos - lower)
+
+
+def summarize(values) -> dict:
+    """
+    压测报告里常用的一组统计量 (单位与输入一致)。
+    """
+    return {
+        "count": len(values),
+        "mean": sum(values) / len(values) if values else 0.0,
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "p99": percentile(values, 99),
+        "max": max(values) if values else 0.0,
+    }
+
+
+class RollingWindow:
+    """
+    线程安全的滑动窗口，只保留最近 size 个样本，用于在线估计 p95 等分位数。
+    """
+
+    def __init__(self, size: int = 200):
+        self._samples = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def add(self, value: float):
+        with self._lock:
+            self._samples.append(value)
+
+    def __len__(self):
+        return len(self._samples)
+
+    def percentile(self, q: float) -> float:
+        with self._lock:
+            values = list(self._samples)
+        return percentile(values, q)
@@ -1,14 +1,19 @@
 import os
+import logging
 import opencc
 from camel.models import ModelFactory
-from .config import OPENAI_API_KEY, MODEL_NAME
+from .config import OPENAI_API_KEY, MODEL_NAME, DEEPSEEK_BASE_URL, SINGLEFLIGHT_MAX_TEMPERATURE
+from .singleflight import SingleFlight, install_singleflight
+from .resilience import install_resilience, llm_caller
+from .instrumentation import instrumentation
 
-
-# 定义常量，方便管理
-DEEPSEEK_BASE_URL = "https://api.deepseek.com/v1"
+logger = logging.getLogger(__name__)
 
 _cc_converter = None
 
+# 进程内共享的请求合并器，节点和法师 Agent 的模型调用都经过它
+llm_flight = SingleFlight()
+
 
 def convert_to_simplified(text: str) -> str:
     """
@@ -22,7 +27,7 @@ def convert_to_simplified(text: str) -> str:
     return _cc_converter.convert(text)
 
 
-def get_deepseek_model(temperature: float = 0.7):
+def get_deepseek_model(temperature: float = 0.7, node: str = "default", deadline: float = None, stream: bool = False):
     """
     统一的模型获取入口。
     
@@ -30,16 +35,43 @@ def get_deepseek_model(temperature: float = 0.7):
         temperature (float): 创造力参数，默认 0.7。
                          HyDE 这种需要想象力的可以设高点 (0.8-0.9)，
                          严谨的回答可以设低点 (0.3-0.5)。
+        node (str): 调用方节点名，用于查找该节点的时间预算 (LLM_NODE_BUDGETS)。
+        deadline (float): 整轮对话的截止时间 (time.time() 时间戳)，None 表示不限。
+        stream (bool): 流式输出，run() 返回逐段的 chunk 迭代器 (时间预算只约束首包)。
     """
     # 确保环境变量被正确设置 (双重保险)
-    os.environ["OPENAI_BASE_URL"] = "https://api.deepseek.com/v1"  # 或者是 /v1
+    os.environ["OPENAI_BASE_URL"] = DEEPSEEK_BASE_URL
     os.environ["OPENAI_API_KEY"] = OPENAI_API_KEY
     
-    print(f"🛠️ [System]正在初始化 DeepSeek 模型 (Temp={temperature})...")
+    logger.debug("🛠️ [System]正在初始化 DeepSeek 模型 (Temp=%s)...", temperature)
 
-    return ModelFactory.create(
+    model = ModelFactory.create(
         model_platform="openai",
         model_type="deepseek-chat", # 这里建议直接写死或从 config 读
         api_key=OPENAI_API_KEY,
-        model_config_dict={"temperature": temperature}
-    )
\ No newline at end of file
+        url=DEEPSEEK_BASE_URL,
+        model_config_dict={"temperature": temperature, **({"stream": True} if stream else {})}
+    )
+
+    # 低温调用 (Router / Grader / Contextualize) 结果基本确定：可以对冲，也可以合并
+    idempotent = temperature <= SINGLEFLIGHT_MAX_TEMPERATURE
+    # 内层：时间预算 + 限流 + 对冲；中间：请求合并 (被合并的调用不占并发槽)；最外层：埋点
+    install_resilience(model, node=node, idempotent=idempotent, deadline=deadline)
+    if idempotent:
+        install_singleflight(model, llm_flight, "deepseek-chat", temperature)
+    instrumentation.install_model(model, node, flight=llm_flight if idempotent else None)
+    return model
+
+
+def get_llm_flight_stats() -> dict:
+    """
+    请求合并的统计：总调用数、实际上游请求数、被合并的次数。
+    """
+    return llm_flight.stats()
+
+
+def get_llm_resilience_stats() -> dict:
+    """
+    尾延迟控制的统计：调用数、对冲次数与胜出次数、超时、被拒绝次数、当前并发上限。
+    """
+    return llm_caller.stats()
\ No newline at end of file
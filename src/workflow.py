@@ -1,3 +1,4 @@
+import logging
 from langgraph.graph import StateGraph, END
 from .nodes import (
     retrieve_node,
@@ -9,6 +10,10 @@ from .nodes import (
     contextualize_node
 )
 from .schema import AgentState
+from .resilience import time_left
+from .instrumentation import instrumentation
+
+logger = logging.getLogger(__name__)
 
 
 MAX_RETRIES = 3
@@ -23,34 +28,55 @@ def decide_to_generate(state):
     loop_step = state.get("loop_step", 0)
     
     if grade == "yes":
-        print("--- 决策: 经文相关，前往生成节点 ---")
+        logger.info("--- 决策: 经文相关，前往生成节点 ---")
+        return "answer"
+    # 本轮时间预算已耗尽 -> 不再重写，直接兜底
+    elif time_left(state.get("deadline")) <= 0:
+        logger.info("--- ⏱️ 本轮时间预算耗尽，前往兜底回复 ---")
+        return "fallback"
+    # 评分调用超时/被限流 -> 不触发重写重试，用已检索到的经文作答
+    elif grade == "error":
+        logger.info("--- ⏱️ 评分不可用，直接使用已检索的经文 ---")
         return "answer"
     # 如果评分是 no，但还没达到最大重试次数 -> 继续重写
     elif loop_step < MAX_RETRIES:
-        print("--- 🔄 经文不相关且未达上限，尝试重写 ---")
+        logger.info("--- 🔄 经文不相关且未达上限，尝试重写 ---")
         return "rewrite"
     
     # 如果评分是 no，且已经试了很多次了 -> 放弃
     else:
-        print("--- 🛑 重试次数耗尽，前往兜底回复 ---")
+        logger.info("--- 🛑 重试次数耗尽，前往兜底回复 ---")
         return "fallback"
 
 
 # 定义路由函数 (给 add_conditional_edges 用)
 def route_decision(state):
+    # 路由这一步就把预算耗光了 (上游严重拥塞)，不再进入检索循环
+    if state["route"] != "direct" and time_left(state.get("deadline")) <= 0:
+        return "fallback"
     return state["route"] # 返回 'contextualize', 'hyde', 或 'direct'
 
-def create_workflow():
+def create_workflow(node_wrapper=None):
+    """
+    node_wrapper: 可选的 (节点名, 节点函数) -> 节点函数，用于给每个节点统一加计时等，
+                  不改变节点本身的输入输出。
+    每个节点最外层都套上 instrumentation 的埋点 (耗时、路由、loop_step、检索得分、评分结论)。
+    """
     workflow = StateGraph(AgentState)
+
+    def wrap(name, fn):
+        if node_wrapper is not None:
+            fn = node_wrapper(name, fn)
+        return instrumentation.wrap_node(name, fn)
     
     # 添加节点
-    workflow.add_node("intent_router", intent_router_node)
-    workflow.add_node("contextualize", contextualize_node)
-    workflow.add_node("retrieve", retrieve_node)
-    workflow.add_node("grade", grader_node)
-    workflow.add_node("rewrite", rewrite_query_node)
-    workflow.add_node("answer", answer_node)
-    workflow.add_node("fallback", fallback_node) # ✅ 新增兜底节点
+    workflow.add_node("intent_router", wrap("intent_router", intent_router_node))
+    workflow.add_node("contextualize", wrap("contextualize", contextualize_node))
+    workflow.add_node("retrieve", wrap("retrieve", retrieve_node))
+    workflow.add_node("grade", wrap("grade", grader_node))
+    workflow.add_node("rewrite", wrap("rewrite", rewrite_query_node))
+    workflow.add_node("answer", wrap("answer", answer_node))
+    workflow.add_node("fallback", wrap("fallback", fallback_node)) # ✅ 新增兜底节点
     
     # 连线：开始 -> 路由 -> 检索 -> 打分-> (分支) -> 生成答案 or 重写 -> 结束
     # workflow.set_entry_point("retrieve")
@@ -62,7 +88,8 @@ def create_workflow():
         {
             "contextualize": "contextualize", # 路 A
             "hyde": "rewrite",                   # 路 B
-            "direct": "answer"                # 路 C (闲聊直接去回答，跳过检索)
+            "direct": "answer",               # 路 C (闲聊直接去回答，跳过检索)
+            "fallback": "fallback"            # 时间预算耗尽
             # 注意：如果是"精准搜索"，direct 也可以连向 retrieve，看你策略
         }
     )
@@ -0,0 +1,74 @@
+import os
+import sys
+import threading
+from typing import TypedDict
+
+import pytest
+from langgraph.graph import StateGraph, END
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src.checkpoint import SqliteCheckpointer
+
+
+class CounterState(TypedDict, total=False):
+    n: int
+    b: int
+    origin: str
+
+
+def build_app(saver):
+    """
+    每轮三步，每步 n + 2、b + 4；origin 只在第一轮写一次，之后一直引用同一个旧版本的 blob。
+    """
+    def step(state):
+        update = {"n": state.get("n", 0) + 2, "b": state.get("b", 0) + 4}
+        if "origin" not in state:
+            update["origin"] = "first-turn"
+        return update
+
+    workflow = StateGraph(CounterState)
+    for name in ("x", "y", "z"):
+        workflow.add_node(name, step)
+    workflow.set_entry_point("x")
+    workflow.add_edge("x", "y")
+    workflow.add_edge("y", "z")
+    workflow.add_edge("z", END)
+    return workflow.compile(checkpointer=saver)
+
+
+@pytest.mark.parametrize("threads,flush_batch", [(1, 3), (1, 5), (16, 3), (16, 64)])
+def test_concurrent_put_get_across_flush_batch_with_pruning(tmp_path, threads, flush_batch):
+    turns = 10
+    saver = SqliteCheckpointer(
+        str(tmp_path / "cp.sqlite"), keep_last=2, flush_batch=flush_batch, flush_interval=0.01,
+    )
+    app = build_app(saver)
+    errors = []
+
+    def run(t):
+        config = {"configurable": {"thread_id": f"t-{t}"}}
+        try:
+            for turn in range(turns):
+                result = app.invoke({}, config=config)
+                expected = (turn + 1) * 3
+                if (result.get("n"), result.get("b"), result.get("origin")) != (2 * expected, 4 * expected, "first-turn"):
+                    errors.append((t, turn, result))
+                    return
+        except Exception as e:  # 读回损坏的 state 时可能直接抛错
+            errors.append((t, repr(e)))
+
+    workers = [threading.Thread(target=run, args=(t,)) for t in range(threads)]
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+
+    try:
+        assert errors == []
+        for t in range(threads):
+            state = app.get_state({"configurable": {"thread_id": f"t-{t}"}}).values
+            assert state == {"n": 6 * turns, "b": 12 * turns, "origin": "first-turn"}
+        # 裁剪确实发生：每个线程只剩 keep_last 个 checkpoint
+        assert saver.stats()["checkpoints_rows"] == 2 * threads
+    finally:
+        saver.close()